@@ -7,15 +7,22 @@ import aiohttp_cors
 from aiohttp import web, PAYLOAD_REGISTRY
 from aiohttp_apispec import setup_aiohttp_apispec
 
+from api.channel import FacilityChannel, setup_channel
+from api.clusters import FacilityClusters
+from api.compression import CompressedBodies, compression_middleware
+from api.facility_cache import FacilityCache
 from api.handlers import ROUTES
-from api.jwt import JWT
+from api.jwt import JWT, auth_middleware
+from api.metrics import Metrics, metrics_middleware
+from api.suggest import FacilitySuggest
+from api.timing import add_server_timing
+from api.tiles import TileStore, clear_tiles
 from api.middlewares import transaction_middleware, error_middleware
 from settings import Settings
 from api.payloads import AsyncGenJSONListPayload, JsonPayload
-from utils import setup_db, setup_logger
+from utils import setup_db
 
 logger = logging.getLogger(__name__)
-setup_logger(logger)
 
 
 def create_app(settings: Settings) -> web.Application:
@@ -25,11 +32,30 @@ def create_app(settings: Settings) -> web.Application:
     app = web.Application(
         logger=logger,
     )
+    app.middlewares.append(metrics_middleware)
     app.middlewares.append(error_middleware)
+    app.middlewares.append(compression_middleware)
+    # До транзакции: запросам без токена не нужно соединение с базой
+    app.middlewares.append(auth_middleware)
     app.middlewares.append(transaction_middleware)
 
-    app['jwt'] = JWT()
+    app['jwt'] = JWT(settings.API_JWT_KEYS)
+    app['metrics'] = Metrics()
+    app['compressed'] = CompressedBodies()
 
+    # Структуры данных в памяти, которые обновляются после изменения объектов
+    app['clusters'] = FacilityClusters()
+    app['tiles'] = TileStore(settings.API_TILES_DIR)
+    app['facility_cache'] = FacilityCache()
+    app['suggest'] = FacilitySuggest()
+    app['facility_observers'] = [app['clusters'], app['tiles'], app['facility_cache'], app['suggest']]
+    # Изменения, сделанные другими процессами (pre-fork, другие экземпляры, импорт из командной строки)
+    app['facility_channel'] = FacilityChannel(app['facility_observers'])
+
+    app.on_response_prepare.append(add_server_timing)
+    app.on_startup.append(clear_tiles)
+
+    app.cleanup_ctx.append(partial(setup_channel, settings=settings))
     app.cleanup_ctx.append(partial(setup_db, settings=settings))
 
     app.add_routes(ROUTES)
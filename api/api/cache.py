@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """
+    Кеш с вытеснением давно не использованных элементов.
+
+    Размер ограничивается количеством элементов (maxsize) и/или суммарным размером
+    элементов (maxbytes, размер считает функция sizeof). Если задан ttl, элементы
+    старше ttl секунд считаются отсутствующими; ttl можно задать и отдельному элементу в set.
+    """
+    def __init__(self,
+                 maxsize: int | None = None,
+                 maxbytes: int | None = None,
+                 ttl: float | None = None,
+                 sizeof: Callable[[Any], int] = len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        # key -> (value, size, expires_at)
+        self._data: OrderedDict[Hashable, tuple[Any, int, float | None]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, _, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            self._pop(key)
+            self.evictions += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """
+        :param ttl: время жизни элемента в секундах, не больше ttl кеша (по умолчанию ttl кеша)
+        """
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            # элемент больше всего кеша, не вытесняем ради него остальные
+            self.delete(key)
+            return
+        self._pop(key)
+        if self.ttl is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, size, expires_at)
+        self.bytes += size
+        while (
+                (self.maxsize is not None and len(self._data) > self.maxsize) or
+                (self.maxbytes is not None and self.bytes > self.maxbytes)
+        ):
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        self._pop(key)
+
+    def _pop(self, key: Hashable):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'bytes': self.bytes,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
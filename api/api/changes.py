@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import json
+import uuid
+from functools import partial
+from typing import NamedTuple, Protocol
+
+import sqlalchemy as sa
+from aiohttp import web
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.middlewares import before_commit, on_commit
+from db.facility import Facility, FacilityTypes
+
+# Канал NOTIFY, по которому процессы API узнают об изменениях объектов, сделанных другими процессами
+CHANNEL = 'facility_changes'
+MAX_PAYLOAD_SIZE = 7900  # байт, NOTIFY принимает не больше 8000
+# Изменений, которые наблюдатели применяют по одному; при массовом изменении (импорт) они сбрасываются:
+# перестроить структуру при следующем обращении быстрее, чем применить изменения в event loop
+MAX_APPLIED_CHANGES = 1000
+
+
+class FacilityState(NamedTuple):
+    """
+    Снимок полей спортивного объекта, от которых зависят структуры данных в памяти (кластеры, тайлы, кеши).
+    """
+    id: uuid.UUID
+    name: str
+    x: float
+    y: float
+    type: FacilityTypes | None
+    hidden: bool | None
+
+    def dump(self) -> list:
+        return [str(self.id), self.name, self.x, self.y, self.type.name if self.type is not None else None, self.hidden]
+
+    @staticmethod
+    def load(data: list) -> FacilityState:
+        id, name, x, y, type, hidden = data
+        return FacilityState(
+            id=uuid.UUID(id),
+            name=name,
+            x=x,
+            y=y,
+            type=FacilityTypes[type] if type is not None else None,
+            hidden=hidden,
+        )
+
+    @staticmethod
+    def of(facility: Facility) -> FacilityState:
+        return FacilityState(
+            id=facility.id,
+            name=facility.name,
+            x=facility.x,
+            y=facility.y,
+            type=facility.type,
+            hidden=facility.hidden,
+        )
+
+
+class FacilityObserver(Protocol):
+    def facility_changed(self, before: FacilityState | None, after: FacilityState | None):
+        """
+        Вызывается после коммита транзакции, изменившей объект.
+        :param before: состояние объекта до изменения (None - объект был создан)
+        :param after: состояние объекта после изменения (None - объект был удален)
+        """
+        ...
+
+    def reset(self):
+        """
+        Вызывается, если процесс мог не узнать о каких-то изменениях (см. api.channel):
+        наблюдатель забывает все, что знал об объектах.
+        """
+        ...
+
+    # Наблюдатель может также определить facilities_changed(changes) со списком пар (before, after),
+    # чтобы обработать массовое изменение за один раз (см. notify)
+
+
+Change = tuple[FacilityState | None, FacilityState | None]
+
+
+def notify(observer: FacilityObserver, changes: list[Change]):
+    if len(changes) > MAX_APPLIED_CHANGES:
+        observer.reset()
+        return
+    batch = getattr(observer, 'facilities_changed', None)
+    if batch is not None:
+        batch(changes)
+        return
+    for before, after in changes:
+        observer.facility_changed(before, after)
+
+
+def dump_changes(source: str | None, changes: list[Change]) -> str:
+    """
+    Текст уведомления об изменениях. Если изменения не помещаются в уведомление (массовый импорт
+    или изменение), вместо них отправляется reset: получатели сбрасывают все, что знали об объектах.
+    """
+    payload = json.dumps(
+        {'source': source, 'changes': [[s.dump() if s is not None else None for s in change] for change in changes]},
+        ensure_ascii=False, separators=(',', ':')
+    )
+    if len(payload.encode()) > MAX_PAYLOAD_SIZE:
+        payload = json.dumps({'source': source, 'reset': True}, separators=(',', ':'))
+    return payload
+
+
+def load_changes(payload: str) -> tuple[str | None, list[Change] | None]:
+    """
+    :return: источник уведомления и изменения (None - нужно сбросить все)
+    """
+    data = json.loads(payload)
+    if data.get('reset'):
+        return data['source'], None
+    return data['source'], [
+        tuple(FacilityState.load(s) if s is not None else None for s in change) for change in data['changes']
+    ]
+
+
+async def publish(session: AsyncSession, source: str | None, changes: list[Change]):
+    """
+    Отправляет уведомление об изменениях другим процессам API в транзакции session:
+    оно будет доставлено после коммита транзакции и не будет, если она откатится.
+    :param source: идентификатор процесса-отправителя, свои уведомления процесс пропускает
+    """
+    if changes:
+        await session.execute(sa.select(sa.func.pg_notify(CHANNEL, dump_changes(source, changes))))
+
+
+def _publish_on_commit(request: web.Request, changes: list[Change]):
+    # Все изменения запроса уходят одним уведомлением перед коммитом
+    pending = request.get('published_changes')
+    if pending is None:
+        pending = request['published_changes'] = []
+        before_commit(request, partial(publish, request['session'], request.app['facility_channel'].source, pending))
+    pending.extend(changes)
+
+
+def facility_changed(request: web.Request, before: FacilityState | None, after: FacilityState | None):
+    """
+    Сообщает всем наблюдателям из app['facility_observers'] об изменении объекта,
+    как только транзакция текущего запроса будет закоммичена. Другие процессы API
+    узнают об изменении из уведомления, отправленного в той же транзакции.
+    """
+    observer: FacilityObserver
+    for observer in request.app['facility_observers']:
+        on_commit(request, partial(observer.facility_changed, before, after))
+    _publish_on_commit(request, [(before, after)])
+
+
+def facilities_changed(request: web.Request, changes: list[Change]):
+    """
+    То же, что facility_changed, для многих объектов сразу (массовый импорт, пакетные изменения).
+    """
+    if not changes:
+        return
+    observer: FacilityObserver
+    for observer in request.app['facility_observers']:
+        on_commit(request, partial(notify, observer, changes))
+    _publish_on_commit(request, changes)
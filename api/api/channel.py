@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+
+import asyncpg
+from aiohttp import web
+from sqlalchemy.engine import make_url
+
+from api.changes import CHANNEL, Change, FacilityObserver, load_changes, notify
+from api.replicas import WRITE_LSN_SQL, parse_lsn
+from settings import Settings
+from utils import db_connect_args
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_CONNECT_TIMEOUT = 5  # секунд, которые запуск ждет подключения к каналу
+CHANNEL_RECONNECT_DELAY = 1  # секунд между попытками подключения
+
+
+class FacilityChannel:
+    """
+    Изменения объектов между процессами API: процессами pre-fork, другими экземплярами
+    и импортом из командной строки, через LISTEN/NOTIFY PostgreSQL.
+
+    Процесс, изменивший объекты, сообщает о них своим наблюдателям после коммита, а в той же
+    транзакции отправляет уведомление (api.changes.publish). Остальные процессы получают его
+    после коммита и передают изменения своим наблюдателям; свои уведомления процесс пропускает.
+
+    Уведомления, отправленные, пока соединение не слушает канал, теряются, поэтому после каждого
+    подключения наблюдатели сбрасываются (reset) и перестраиваются при следующем обращении.
+    Если настроены реплики, перед тем как передать изменения наблюдателям, процесс запоминает позицию
+    WAL основной базы: иначе кеши заполнились бы с реплики, еще не применившей изменение.
+    """
+    def __init__(self, observers: list[FacilityObserver]):
+        self.source = uuid.uuid4().hex
+        self.observers = observers
+        self.connected = asyncio.Event()
+        self._payloads: list[str] = []
+        self._wakeup = asyncio.Event()
+
+    async def run(self, app: web.Application, dsn: str, connect_args: dict):
+        """
+        Слушает канал, переподключаясь после разрыва соединения, пока задачу не отменят.
+        """
+        failures = 0
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn, **connect_args)
+                failures = 0
+                await self._listen(app, connection)
+            except Exception as e:
+                # Пока база недоступна, попытки повторяются каждую секунду, в журнал пишется только первая
+                if not failures:
+                    logger.warning('facility changes channel is unavailable: %r', e)
+                failures += 1
+            finally:
+                self.connected.clear()
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(CHANNEL_RECONNECT_DELAY)
+
+    async def _listen(self, app: web.Application, connection: asyncpg.Connection):
+        connection.add_termination_listener(lambda _: self._wakeup.set())
+        await connection.add_listener(CHANNEL, self._received)
+        # Пока канал не слушали, изменения могли пройти мимо
+        await self._remember_write(app, connection)
+        self._payloads.clear()
+        self._reset()
+        self.connected.set()
+        logger.info('listening to facility changes')
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if connection.is_closed():
+                raise ConnectionError('connection is closed')
+            payloads, self._payloads = self._payloads, []
+            if payloads:
+                await self._apply(app, connection, payloads)
+
+    def _received(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str):
+        self._payloads.append(payload)
+        self._wakeup.set()
+
+    async def _apply(self, app: web.Application, connection: asyncpg.Connection, payloads: list[str]):
+        changes: list[Change] = []
+        reset = False
+        for payload in payloads:
+            try:
+                source, payload_changes = load_changes(payload)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning('invalid facility changes notification %r: %r', payload[:100], e)
+                reset = True
+                continue
+            if source == self.source:
+                continue
+            if payload_changes is None:
+                reset = True
+            else:
+                changes.extend(payload_changes)
+        if not changes and not reset:
+            return
+
+        await self._remember_write(app, connection)
+        if reset:
+            self._reset()
+            return
+        for observer in self.observers:
+            try:
+                notify(observer, changes)
+            except Exception as e:
+                logger.exception(e)
+
+    @staticmethod
+    async def _remember_write(app: web.Application, connection: asyncpg.Connection):
+        replicas = app.get('replicas')
+        if replicas is not None:
+            replicas.written(parse_lsn(await connection.fetchval(str(WRITE_LSN_SQL))))
+
+    def _reset(self):
+        for observer in self.observers:
+            try:
+                observer.reset()
+            except Exception as e:
+                logger.exception(e)
+
+
+async def setup_channel(app: web.Application, settings: Settings):
+    """
+    Подключает процесс к каналу изменений объектов. Запуск ждет первого подключения
+    не дольше CHANNEL_CONNECT_TIMEOUT секунд, дальше процесс подключается в фоне.
+    """
+    channel: FacilityChannel = app['facility_channel']
+    dsn = make_url(settings.API_DB_URL).set(drivername='postgresql').render_as_string(hide_password=False)
+    task = asyncio.create_task(channel.run(app, dsn, db_connect_args(settings.API_DB_USE_SSL)))
+    try:
+        await asyncio.wait_for(channel.connected.wait(), CHANNEL_CONNECT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning('facility changes channel is not connected, in-memory structures may become stale')
+
+    try:
+        yield
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import logging
+import math
+import uuid
+from collections import Counter
+from typing import Iterable, Iterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.changes import FacilityState
+from api.snapshot import SnapshotIndex
+from db.facility import Facility, FacilityTypes
+
+logger = logging.getLogger(__name__)
+
+MAX_ZOOM = 16  # на больших масштабах кластеры совпадают с самими объектами
+CELLS_PER_TILE = 8  # на сколько ячеек делится сторона тайла при кластеризации
+WORLD_SIZE = 360.0  # ширина мира в единицах координат (x, y - долгота, широта)
+
+
+def cell_size(zoom: int) -> float:
+    """
+    Размер ячейки сетки кластеризации на заданном масштабе.
+    """
+    return WORLD_SIZE / (CELLS_PER_TILE << zoom)
+
+
+class Cluster:
+    """
+    Ячейка сетки: количество объектов, сумма координат (для центроида) и разбивка по типам.
+    """
+    __slots__ = ('count', 'sum_x', 'sum_y', 'types')
+
+    def __init__(self):
+        self.count = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.types = Counter()
+
+    def add(self, x: float, y: float, type: FacilityTypes | None):
+        self.count += 1
+        self.sum_x += x
+        self.sum_y += y
+        if type is not None:
+            self.types[type.value] += 1
+
+    def remove(self, x: float, y: float, type: FacilityTypes | None):
+        self.count -= 1
+        self.sum_x -= x
+        self.sum_y -= y
+        if type is not None:
+            self.types[type.value] -= 1
+            if not self.types[type.value]:
+                del self.types[type.value]
+
+    def dict(self) -> dict:
+        return {
+            'x': self.sum_x / self.count,
+            'y': self.sum_y / self.count,
+            'count': self.count,
+            'types': dict(self.types),
+        }
+
+
+class FacilityClusters(SnapshotIndex):
+    """
+    Предвычисленные кластеры видимых спортивных объектов для каждого масштаба карты.
+
+    Кластеры строятся один раз при первом обращении (ensure_loaded), после чего
+    поддерживаются инкрементально: каждое изменение объекта убирает его из старых ячеек
+    и добавляет в новые, полный пересчет не нужен.
+    """
+    def __init__(self, max_zoom: int = MAX_ZOOM):
+        super().__init__()
+        self.max_zoom = max_zoom
+        self._points: dict[uuid.UUID, tuple[float, float, FacilityTypes | None]] = {}
+        self._levels: list[dict[tuple[int, int], Cluster]] = [{} for _ in range(max_zoom + 1)]
+
+    async def _read(self, session: AsyncSession) -> Iterable[tuple]:
+        return await Facility.get_visible_points(session)
+
+    def _build(self, rows: Iterable[tuple], skip: set[uuid.UUID]):
+        for id, x, y, type in rows:
+            if id not in skip:
+                self._set(id, (x, y, type))
+        logger.info('clusters are built for %d facilities', len(self._points))
+
+    def _clear(self):
+        self._points.clear()
+        self._levels = [{} for _ in range(self.max_zoom + 1)]
+
+    def facility_changed(self, before: FacilityState | None, after: FacilityState | None):
+        id = before.id if after is None else after.id
+        self._changed([id])
+        if after is None or after.hidden:
+            self._set(id, None)
+        else:
+            self._set(id, (after.x, after.y, after.type))
+
+    def _set(self, id: uuid.UUID, point: tuple[float, float, FacilityTypes | None] | None):
+        old = self._points.pop(id, None)
+        if old is not None:
+            for zoom, level in enumerate(self._levels):
+                key = self._cell(zoom, old[0], old[1])
+                cluster = level[key]
+                cluster.remove(*old)
+                if not cluster.count:
+                    del level[key]
+        if point is not None:
+            self._points[id] = point
+            for zoom, level in enumerate(self._levels):
+                key = self._cell(zoom, point[0], point[1])
+                cluster = level.get(key)
+                if cluster is None:
+                    cluster = level[key] = Cluster()
+                cluster.add(*point)
+
+    @staticmethod
+    def _cell(zoom: int, x: float, y: float) -> tuple[int, int]:
+        size = cell_size(zoom)
+        return math.floor(x / size), math.floor(y / size)
+
+    def get(self, zoom: int, min_x: float, min_y: float, max_x: float, max_y: float) -> Iterator[Cluster]:
+        """
+        Кластеры масштаба zoom, ячейки которых пересекаются с прямоугольной областью.
+        """
+        zoom = max(0, min(zoom, self.max_zoom))
+        level = self._levels[zoom]
+        min_cx, min_cy = self._cell(zoom, min_x, min_y)
+        max_cx, max_cy = self._cell(zoom, max_x, max_y)
+
+        # Если ячеек в области меньше, чем непустых ячеек на масштабе, дешевле перебрать область
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) <= len(level):
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    cluster = level.get((cx, cy))
+                    if cluster is not None:
+                        yield cluster
+        else:
+            for (cx, cy), cluster in level.items():
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy:
+                    yield cluster
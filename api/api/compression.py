@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import importlib.util
+from functools import lru_cache
+from typing import Hashable
+
+from aiohttp import hdrs, web
+from aiohttp.web import ContentCoding
+
+from api.cache import LRUCache
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+MIN_COMPRESS_SIZE = 1024  # байт, меньшие ответы отправляются без сжатия
+EXECUTOR_COMPRESS_SIZE = 64 * 1024  # байт, большие ответы сжимаются в пуле потоков, а не в event loop
+COMPRESSED_CACHE_BYTES = 32 * 1024 * 1024  # бюджет памяти сжатых вариантов ответов с ETag
+
+# Уровни сжатия: ответ без ETag сжимается для каждого запроса, поэтому быстрее;
+# ответ с ETag сжимается один раз, поэтому сильнее
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+CACHED_GZIP_LEVEL = 9
+CACHED_BROTLI_QUALITY = 9
+
+
+@lru_cache(maxsize=None)
+def brotli_available() -> bool:
+    return importlib.util.find_spec('brotli') is not None
+
+
+def _accepted(accept_encoding: str) -> dict[str, float]:
+    """
+    Кодировки из Accept-Encoding с их весами (q).
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str | None, brotli: bool | None = None) -> str | None:
+    """
+    Кодировка сжатия, которую принимает клиент: br (если установлен brotli) или gzip,
+    при равных весах предпочитается br. None - ответ отправляется без сжатия.
+    """
+    if not accept_encoding:
+        return None
+    if brotli is None:
+        brotli = brotli_available()
+    accepted = _accepted(accept_encoding)
+    default = accepted.get('*', 0.0)
+    candidates = [(BROTLI, 2)] if brotli else []
+    candidates.append((GZIP, 1))
+    best = max(
+        ((accepted.get(coding, default), priority, coding) for coding, priority in candidates),
+        default=(0.0, 0, None)
+    )
+    return best[2] if best[0] > 0 else None
+
+
+def compress(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == BROTLI:
+        import brotli
+        return brotli.compress(body, quality=CACHED_BROTLI_QUALITY if cached else BROTLI_QUALITY)
+    # mtime=0: одинаковые тела сжимаются в одинаковые байты
+    return gzip.compress(body, compresslevel=CACHED_GZIP_LEVEL if cached else GZIP_LEVEL, mtime=0)
+
+
+async def compress_async(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if len(body) < EXECUTOR_COMPRESS_SIZE:
+        return compress(body, encoding, cached)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, compress, body, encoding, cached)
+
+
+class CompressedBodies:
+    """
+    Сжатые варианты тел ответов с ETag (каталог, объекты, тайлы).
+
+    Сильный ETag однозначно определяет тело ответа, поэтому сжатый вариант хранится по ETag
+    и кодировке и не сбрасывается при изменениях объектов: у измененного ответа другой ETag,
+    а старые варианты вытесняются как давно не использованные. Повторный запрос того же
+    ответа не тратит процессор на сжатие; одновременные запросы ждут одного сжатия.
+    """
+    def __init__(self, maxbytes: int = COMPRESSED_CACHE_BYTES):
+        self._cache = LRUCache(maxbytes=maxbytes)
+        self._pending: dict[Hashable, asyncio.Task] = {}
+
+    async def get(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        compressed = self._cache.get(key)
+        if compressed is not None:
+            return compressed
+
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.create_task(self._compress(key, body, encoding))
+        # Сжатие доводится до конца и сохраняется, даже если клиент, который его начал, отключился
+        return await asyncio.shield(task)
+
+    async def _compress(self, key: Hashable, body: bytes, encoding: str) -> bytes:
+        try:
+            compressed = await compress_async(body, encoding, cached=True)
+            self._cache.set(key, compressed)
+            return compressed
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def _is_json(content_type: str) -> bool:
+    return content_type == 'application/json' or content_type.endswith('+json')
+
+
+def _vary(response: web.StreamResponse):
+    vary = response.headers.get(hdrs.VARY)
+    if vary is None:
+        response.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+    elif hdrs.ACCEPT_ENCODING.lower() not in vary.lower():
+        response.headers[hdrs.VARY] = f'{vary}, {hdrs.ACCEPT_ENCODING}'
+
+
+def _weak_etag(response: web.StreamResponse):
+    # Сжатый ответ - другое представление ресурса, сильный ETag у него должен отличаться.
+    # Слабый ETag совпадает с исходным при слабом сравнении, которым проверяется If-None-Match
+    etag = response.headers.get(hdrs.ETAG)
+    if etag is not None and not etag.startswith('W/'):
+        response.headers[hdrs.ETAG] = f'W/{etag}'
+
+
+def enable_stream_compression(request: web.Request, response: web.StreamResponse):
+    """
+    Сжатие потокового ответа, который еще не отправлен. Потоковые ответы сжимаются
+    только gzip: brotli в aiohttp не поддерживает сжатие по частям.
+    """
+    _vary(response)
+    if choose_encoding(request.headers.get(hdrs.ACCEPT_ENCODING), brotli=False) == GZIP:
+        response.enable_compression(ContentCoding.gzip)
+        _weak_etag(response)
+
+
+@web.middleware
+async def compression_middleware(request: web.Request, handler):
+    """
+    Сжимает JSON ответы (не меньше MIN_COMPRESS_SIZE байт) кодировкой из Accept-Encoding.
+    Ответы с ETag сжимаются один раз (см. CompressedBodies), остальные - для каждого запроса.
+    Стоит снаружи transaction_middleware: соединение с базой возвращается в пул до сжатия.
+    """
+    response = await handler(request)
+    if response.status == 304:
+        # 304 повторяет ETag ответа 200, который получил бы этот клиент
+        _vary(response)
+        if choose_encoding(request.headers.get(hdrs.ACCEPT_ENCODING)) is not None:
+            _weak_etag(response)
+        return response
+    if (
+            response.prepared or
+            response.status != 200 or
+            not isinstance(response, web.Response) or
+            not isinstance(response.body, bytes) or
+            not _is_json(response.content_type) or
+            hdrs.CONTENT_ENCODING in response.headers
+    ):
+        return response
+
+    _vary(response)
+    encoding = choose_encoding(request.headers.get(hdrs.ACCEPT_ENCODING))
+    if encoding is None:
+        return response
+    etag = response.headers.get(hdrs.ETAG)
+    strong_etag = etag if etag is not None and not etag.startswith('W/') else None
+    # ETag слабый и у маленьких ответов без сжатия: он не должен зависеть от размера тела
+    _weak_etag(response)
+    body = response.body
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+
+    if strong_etag is not None:
+        response.body = await request.app['compressed'].get(strong_etag, encoding, body)
+    else:
+        response.body = await compress_async(body, encoding)
+    response.headers[hdrs.CONTENT_ENCODING] = encoding
+    return response
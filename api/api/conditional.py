@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime
+
+from aiohttp import web
+
+
+def make_etag(*parts) -> str:
+    """
+    Сильный ETag из частей версии ресурса.
+    """
+    return '"%s"' % hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def is_conditional(request: web.Request) -> bool:
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def not_modified(request: web.Request, etag: str, last_modified: datetime | None = None) -> bool:
+    """
+    Проверяет условия If-None-Match / If-Modified-Since запроса (RFC 7232).
+    :return: True - если у клиента актуальная версия ресурса и можно ответить 304
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # Для If-None-Match используется слабое сравнение: W/"x" совпадает с "x"
+        return any(
+            tag.strip().removeprefix('W/') == etag.removeprefix('W/')
+            for tag in if_none_match.split(',')
+        )
+
+    if last_modified is not None:
+        if_modified_since = request.if_modified_since
+        if if_modified_since is not None:
+            return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def conditional_response(
+        request: web.Request,
+        body: bytes,
+        etag: str,
+        last_modified: datetime | None = None,
+        content_type: str = 'application/json',
+        headers: dict | None = None
+) -> web.Response:
+    """
+    Ответ с валидаторами ETag / Last-Modified, или 304, если у клиента актуальная версия.
+    """
+    if not_modified(request, etag, last_modified):
+        response = web.Response(status=304, headers=headers)
+    else:
+        response = web.Response(body=body, content_type=content_type, headers=headers)
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
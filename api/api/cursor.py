@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import uuid
+
+from marshmallow import ValidationError
+
+from db.facility import KEYSET_COLUMNS, Facility
+
+
+def encode_cursor(order_by: str | None, order_desc: bool | None, sort_key: tuple) -> str:
+    """
+    Непрозрачный для клиента курсор: сортировка и ключ (значение, id) последнего объекта страницы.
+    """
+    value, id = sort_key
+    data = json.dumps([order_by, bool(order_desc), value, id], separators=(',', ':'), ensure_ascii=False, default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, order_by: str | None, order_desc: bool | None) -> tuple:
+    """
+    Проверяет, что курсор выдан для той же сортировки, и возвращает ключ (значение, id).
+    :raise ValidationError: если курсор некорректный
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_order_by, cursor_order_desc, value, id = json.loads(data)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValidationError({'cursor': ['invalid cursor']})
+    if cursor_order_by != order_by or cursor_order_desc != bool(order_desc):
+        raise ValidationError({'cursor': ['cursor was issued for another order_by/order_desc']})
+    if order_by not in KEYSET_COLUMNS:
+        raise ValidationError({'cursor': ['invalid cursor']})
+    # Курсор мог быть подделан: ключ проверяется здесь, а не ошибкой запроса к базе
+    try:
+        return _parse_value(order_by, value), uuid.UUID(id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValidationError({'cursor': ['invalid cursor']})
+
+
+def _parse_value(order_by: str | None, value):
+    python_type = getattr(Facility, order_by or 'id').type.python_type
+    if python_type is uuid.UUID:
+        return uuid.UUID(value)
+    if python_type is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(f'{order_by} must be a number')
+        return float(value)
+    if not isinstance(value, python_type):
+        raise TypeError(f'{order_by} must be {python_type.__name__}')
+    return value
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import csv
+import enum
+import importlib.util
+import io
+import uuid
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Callable, NamedTuple
+
+import sqlalchemy as sa
+
+from api.schemas.facility import FacilityResponse
+from api.serializers import json_float, serialize_facility_row
+from db.facility import Facility
+from db.facility_rows import FacilityRows
+
+EXPORT_CHUNK_SIZE = 5000  # строчек, которые кодируются и отправляются за раз
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+GEOJSON = 'geojson'
+ARROW = 'arrow'
+
+# Поля выгрузки по порядку - те же, что у объекта в ответах API
+EXPORT_FIELDS = tuple(FacilityResponse._declared_fields)
+
+Partitions = AsyncIterable[list[sa.engine.Row]]
+
+
+def arrow_available() -> bool:
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def _indexes(keys: tuple[str, ...]) -> list[int]:
+    row_keys = FacilityRows.keys()
+    return [row_keys.index(key) for key in keys]
+
+
+async def _ndjson(partitions: Partitions) -> AsyncIterator[bytes]:
+    """
+    Объект на каждой строчке, как в ответах API.
+    """
+    async for rows in partitions:
+        yield b''.join([serialize_facility_row(row) + b'\n' for row in rows])
+
+
+async def _geojson(partitions: Partitions) -> AsyncIterator[bytes]:
+    """
+    FeatureCollection: точка (x, y) и объект, как в ответах API, в properties.
+    """
+    id_index, x_index, y_index = _indexes(('id', 'x', 'y'))
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    async for rows in partitions:
+        features = [
+            b'{"type":"Feature","id":"%s","geometry":{"type":"Point","coordinates":[%s,%s]},"properties":%s}' % (
+                str(row[id_index]).encode(),
+                json_float(row[x_index]).encode(),
+                json_float(row[y_index]).encode(),
+                serialize_facility_row(row),
+            )
+            for row in rows
+        ]
+        if features:
+            yield (b'' if first else b',') + b','.join(features)
+            first = False
+    yield b']}'
+
+
+def _csv_value(value) -> str | float | int:
+    if value is None:
+        return ''
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (uuid.UUID, datetime)):
+        return str(value)
+    return value
+
+
+async def _csv(partitions: Partitions) -> AsyncIterator[bytes]:
+    """
+    CSV с заголовком из имен полей; enum записываются именами, как их принимает импорт.
+    """
+    indexes = _indexes(EXPORT_FIELDS)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_FIELDS)
+    async for rows in partitions:
+        writer.writerows([[_csv_value(row[i]) for i in indexes] for row in rows])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class _Chunks:
+    """
+    Файл для pyarrow, который копит записанные байты до следующего take().
+    """
+    closed = False
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_columns(pa) -> list[tuple[str, object, Callable[[tuple], object]]]:
+    """
+    (имя, тип Arrow, функция, строящая массив из значений колонки) для каждого поля выгрузки.
+    Enum колонки - словарные с полным перечислением в словаре, поэтому словарь одинаков во всех пачках.
+    """
+    columns = []
+    for key in EXPORT_FIELDS:
+        column_type = Facility.__table__.c[key].type
+        if isinstance(column_type, sa.Enum):
+            members = list(column_type.enum_class)
+            dictionary = pa.array([member.name for member in members], pa.string())
+            positions = {member: i for i, member in enumerate(members)}
+            arrow_type = pa.dictionary(pa.int8(), pa.string())
+
+            def build(values, dictionary=dictionary, positions=positions):
+                indices = pa.array([positions.get(value) for value in values], pa.int8())
+                return pa.DictionaryArray.from_arrays(indices, dictionary)
+        else:
+            if key == 'id':
+                arrow_type = pa.string()
+            elif isinstance(column_type, sa.Float):
+                arrow_type = pa.float64()
+            elif isinstance(column_type, sa.Integer):
+                arrow_type = pa.int32()
+            elif isinstance(column_type, sa.Boolean):
+                arrow_type = pa.bool_()
+            else:
+                arrow_type = pa.string()
+
+            if key == 'id':
+                def build(values, arrow_type=arrow_type):
+                    return pa.array([str(value) for value in values], arrow_type)
+            else:
+                def build(values, arrow_type=arrow_type):
+                    return pa.array(values, arrow_type)
+        columns.append((key, arrow_type, build))
+    return columns
+
+
+async def _arrow(partitions: Partitions) -> AsyncIterator[bytes]:
+    """
+    Arrow IPC stream: схема, затем по record batch на каждую пачку строчек.
+    Читается без разбора (pyarrow.ipc.open_stream, pandas, polars, DuckDB).
+    """
+    import pyarrow as pa
+
+    columns = _arrow_columns(pa)
+    schema = pa.schema([pa.field(name, arrow_type) for name, arrow_type, _ in columns])
+    indexes = _indexes(EXPORT_FIELDS)
+    sink = _Chunks()
+    with pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema) as writer:
+        async for rows in partitions:
+            values = list(zip(*rows)) if rows else [() for _ in FacilityRows.keys()]
+            batch = pa.record_batch(
+                [build(values[i]) for i, (_, _, build) in zip(indexes, columns)],
+                schema=schema
+            )
+            writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take()
+
+
+class ExportFormat(NamedTuple):
+    content_type: str
+    extension: str
+    encode: Callable[[Partitions], AsyncIterator[bytes]]
+
+
+EXPORT_FORMATS = {
+    NDJSON: ExportFormat('application/x-ndjson', 'ndjson', _ndjson),
+    CSV: ExportFormat('text/csv', 'csv', _csv),
+    GEOJSON: ExportFormat('application/geo+json', 'geojson', _geojson),
+    ARROW: ExportFormat('application/vnd.apache.arrow.stream', 'arrows', _arrow),
+}
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, NamedTuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.cache import LRUCache
+from api.changes import FacilityState
+from api.conditional import make_etag
+from api.payloads import json_list_body
+from api.serializers import serialize_facility_row
+from db.facility import CatalogVersion
+from db.facility_rows import FacilityRows
+
+FACILITY_CACHE_BYTES = 64 * 1024 * 1024  # бюджет памяти кеша
+FACILITY_CACHE_TTL = 60  # секунд, страхует от изменений, уведомление о которых не дошло
+
+ALL_KEY = ('all',)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: datetime | None
+
+
+def facility_etag(id: uuid.UUID | str, modified_at: datetime | None) -> str:
+    return make_etag(id, modified_at)
+
+
+def catalog_etag(version: tuple[int, datetime | None, int]) -> str:
+    return make_etag(*version)
+
+
+class FacilityCache:
+    """
+    Read-through кеш перед чтением одного объекта и списка всех объектов.
+
+    Хранит уже сериализованные в JSON ответы вместе с их ETag, поэтому при попадании не нужны
+    ни запрос к базе, ни marshmallow. После коммита изменения объекта сбрасываются только
+    его запись и список всех объектов.
+    """
+    def __init__(self, maxbytes: int = FACILITY_CACHE_BYTES, ttl: float | None = FACILITY_CACHE_TTL):
+        self._cache = LRUCache(maxbytes=maxbytes, ttl=ttl, sizeof=lambda response: len(response.body))
+        # Увеличивается при каждом сбросе, чтобы не сохранить ответ, прочитанный до изменения
+        self.generation = 0
+
+    @staticmethod
+    def _id_key(id: str) -> tuple[str, str] | None:
+        try:
+            return 'id', str(uuid.UUID(id))
+        except ValueError:
+            return None
+
+    def is_cached_by_id(self, id: str) -> bool:
+        return self._id_key(id) in self._cache
+
+    async def get_by_id(self, session: AsyncSession, id: str) -> CachedResponse | None:
+        key = self._id_key(id)
+        if key is None:
+            return None
+        response = self._cache.get(key)
+        if response is not None:
+            return response
+
+        generation = self.generation
+        row = await FacilityRows.get_by_id(session, id)
+        if row is None:
+            return None
+        response = CachedResponse(
+            body=serialize_facility_row(row),
+            etag=facility_etag(row.id, row.modified_at),
+            last_modified=row.modified_at
+        )
+        if generation == self.generation:
+            self._cache.set(key, response)
+        return response
+
+    async def get_by_ids(self, session: AsyncSession, ids: list[uuid.UUID]) -> dict[uuid.UUID, CachedResponse]:
+        """
+        Объекты с данными id: найденные в кеше берутся из него, остальные загружаются одним запросом.
+        В результате нет id, объектов с которыми не существует.
+        """
+        responses = {}
+        missed = []
+        for id in ids:
+            response = self._cache.get(('id', str(id)))
+            if response is not None:
+                responses[id] = response
+            else:
+                missed.append(id)
+        if not missed:
+            return responses
+
+        generation = self.generation
+        for row in await FacilityRows.get_by_ids(session, missed):
+            response = CachedResponse(
+                body=serialize_facility_row(row),
+                etag=facility_etag(row.id, row.modified_at),
+                last_modified=row.modified_at
+            )
+            if generation == self.generation:
+                self._cache.set(('id', str(row.id)), response)
+            responses[row.id] = response
+        return responses
+
+    def get_cached_all(self) -> CachedResponse | None:
+        return self._cache.get(ALL_KEY)
+
+    async def stream_all(self, session: AsyncSession) -> AsyncIterator[bytes]:
+        """
+        Построчно отдает сериализованные объекты из базы и, если весь список
+        поместился в бюджет кеша, сохраняет его для следующих запросов.
+        """
+        generation = self.generation
+        rows = []
+        size = 0
+        version = CatalogVersion()
+
+        async for facility in FacilityRows.stream(session):
+            row = serialize_facility_row(facility)
+            yield row
+
+            # Версию считаем по отданным строчкам, чтобы ETag в кеше точно соответствовал телу ответа
+            version.add(facility.modified_at)
+
+            if rows is not None:
+                size += len(row)
+                if size <= self._cache.maxbytes:
+                    rows.append(row)
+                else:
+                    # список не поместится в кеш, не держим его в памяти
+                    rows = None
+
+        if rows is not None and generation == self.generation:
+            self._cache.set(ALL_KEY, CachedResponse(
+                body=json_list_body(rows),
+                etag=catalog_etag(version.tuple()),
+                last_modified=version.max_modified_at
+            ))
+
+    def facility_changed(self, before: FacilityState | None, after: FacilityState | None):
+        self.generation += 1
+        self._cache.delete(ALL_KEY)
+        if before is not None:
+            self._cache.delete(('id', str(before.id)))
+
+    def reset(self):
+        self.generation += 1
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
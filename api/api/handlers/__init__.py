@@ -1,4 +1,5 @@
 from .ping import ping_handler, auth_ping_handler
+from .metrics import metrics_handler
 from .user import (
     register,
     login,
@@ -11,42 +12,64 @@ from .user import (
 )
 from .facility import (
     create_facility,
+    import_facilities,
+    export_facilities,
     update_facility,
     delete_facility,
     get_facility_by_id,
+    get_facilities_by_ids,
+    bulk_update_facilities,
+    bulk_delete_facilities,
     get_all_facilities,
+    get_facilities_by_bbox,
+    get_facility_clusters,
+    get_facility_tile,
+    suggest_facilities,
     search_facilities,
     hidden_facility,
 )
 
 from aiohttp import web
 
+from api.jwt import auth_required
 
+
+# Обработчики в auth_required требуют access token (см. api.jwt.auth_middleware)
 ROUTES = [
     web.get('/ping', ping_handler),
-    web.get('/authping', auth_ping_handler),
+    web.get('/authping', auth_required(auth_ping_handler)),
+    web.get('/metrics', metrics_handler),
 
     # admin
     web.post('/admin/login', login),
     web.post('/admin/token/refresh', refresh_token),
 
     web.post('/admin/users', register),
-    web.delete('/admin/users', delete_self),
-    web.put('/admin/users', update_self),
+    web.delete('/admin/users', auth_required(delete_self)),
+    web.put('/admin/users', auth_required(update_self)),
 
-    web.get('/admin/users/{id}', get_user_by_id),
+    web.get('/admin/users/{id}', auth_required(get_user_by_id)),
 
     # web.post('/api/admin/password/reset/link', send_password_reset_link),
     # web.post('/api/admin/password/reset/confirmed', confirmed_password_reset),
 
     # facility
-    web.post('/facility', create_facility),
-    web.put('/facility/{id}', update_facility),
-    web.delete('/facility/{id}', delete_facility),
+    web.post('/facility', auth_required(create_facility)),
+    web.post('/facility/import', auth_required(import_facilities)),
+    web.post('/facility/batch', get_facilities_by_ids),
+    web.post('/facility/bulk/update', auth_required(bulk_update_facilities)),
+    web.post('/facility/bulk/delete', auth_required(bulk_delete_facilities)),
+    web.get('/facility/bbox', get_facilities_by_bbox),
+    web.get('/facility/clusters', get_facility_clusters),
+    web.get('/facility/export', export_facilities),
+    web.get('/facility/suggest', suggest_facilities),
+    web.get(r'/facility/tiles/{z:\d+}/{x:\d+}/{y:\d+}', get_facility_tile),
+    web.put('/facility/{id}', auth_required(update_facility)),
+    web.delete('/facility/{id}', auth_required(delete_facility)),
     web.get('/facility/{id}', get_facility_by_id),
     web.get('/facility', get_all_facilities),
 
     web.post('/facility/search', search_facilities),
 
-    web.patch('/facility/{id}', hidden_facility)
+    web.patch('/facility/{id}', auth_required(hidden_facility))
 ]
@@ -1,25 +1,52 @@
 import logging
 
-from aiohttp import web
+from aiohttp import hdrs, web
 from aiohttp_apispec import (
     docs,
+    querystring_schema,
     request_schema
 )
+from marshmallow import ValidationError
 from sqlalchemy.exc import IntegrityError, DBAPIError
 
 from db import Facility
-from api.jwt import jwt_check
+from db.facility import KEYSET_COLUMNS
+from db.facility_bulk import FacilityBulk
+from db.facility_rows import FacilityRows
+from api.changes import FacilityState, facilities_changed, facility_changed
+from api.compression import enable_stream_compression
+from api.conditional import conditional_response, is_conditional, not_modified
+from api.export import ARROW, EXPORT_CHUNK_SIZE, EXPORT_FORMATS, arrow_available
+from api.facility_cache import catalog_etag, facility_etag
+from api.importer import CONTENT_TYPES, READ_CHUNK_SIZE, import_records, read_records
+from api.cursor import decode_cursor, encode_cursor
+from api.middlewares import autocommit, read_only, replica, snapshot
+from api.payloads import abort_response, json_list_body, stream_json_list
+from api.serializers import load_facility, serialize_facility_row
+from api.tiles import MAX_ZOOM
+from api.timing import measure, timed_partitions
 from api.schemas.error import ErrorResponse
+from api.schemas.export import ExportQuery
 from api.schemas.facility import (
     FacilityRequest,
     FacilityResponse,
     FacilityResponseList,
-    SearchQuery, FacilityHiddenRequest, FacilityUpdateRequest
+    SearchQuery, FacilityHiddenRequest, FacilityUpdateRequest,
+    BBoxQuery,
+    ClusterQuery,
+    ClusterResponseList,
+    SuggestQuery,
+    SuggestResponseList,
+    ImportQuery,
+    ImportResponse,
+    BatchRequest,
+    BatchResponse,
+    BulkDeleteRequest,
+    BulkUpdateRequest,
+    BulkResponse
 )
-from utils import setup_logger
 
 logger = logging.getLogger(__name__)
-setup_logger(logger)
 
 
 @docs(
@@ -46,7 +73,6 @@ setup_logger(logger)
 )
 @request_schema(FacilityRequest)
 async def create_facility(request: web.Request) -> web.Response:
-    jwt_check(request)
     data = FacilityRequest().load(await request.json())
 
     facility = Facility(**data)
@@ -59,9 +85,51 @@ async def create_facility(request: web.Request) -> web.Response:
     except IntegrityError:
         raise web.HTTPConflict()
 
+    facility_changed(request, None, FacilityState.of(facility))
+
     return web.json_response(FacilityResponse().dump(facility), status=201)
 
 
+@docs(
+    tags=["Facilities"],
+    summary="Массовый импорт спортивных объектов",
+    description="Загрузка файла со спортивными объектами в формате CSV (заголовок - имена полей), "
+                "NDJSON (объект или GeoJSON Feature на каждой строчке) или GeoJSON FeatureCollection "
+                "(x и y - координаты точки). Формат задается параметром format или заголовком Content-Type. "
+                "Объект с уже существующим именем обновляется. Строчки с ошибками пропускаются "
+                "и перечисляются в отчете, остальные сохраняются.",
+    responses={
+        200: {
+            "schema": ImportResponse,
+            "description": "Отчет об импорте"
+        },
+        401: {
+            "description": "Ошибка аутентификации (отсутствующий или неправильный токен аутентификации. "
+                           "Authorization: Bearer 'текст токена') "
+        },
+        422: {
+            "schema": ErrorResponse,
+            "description": "Неизвестный формат или файл, который не удалось разобрать"
+        },
+    },
+)
+@querystring_schema(ImportQuery)
+async def import_facilities(request: web.Request) -> web.Response:
+    data = ImportQuery().load(request.query)
+    format = data.get('format') or CONTENT_TYPES.get(request.content_type)
+    if format is None:
+        raise ValidationError({'format': ['format is not set and Content-Type is not supported']})
+
+    session = request['session']
+    # Тело читается по мере загрузки, в памяти одновременно не больше одной пачки строчек
+    records = read_records(request.content.iter_chunked(READ_CHUNK_SIZE), format)
+    report, changes = await import_records(session, records, load_facility)
+
+    facilities_changed(request, changes)
+
+    return web.json_response(ImportResponse().dump(report), status=200)
+
+
 @docs(
     tags=["Facilities"],
     summary="Обновление спортивного объекта",
@@ -86,7 +154,6 @@ async def create_facility(request: web.Request) -> web.Response:
 )
 @request_schema(FacilityUpdateRequest)
 async def update_facility(request: web.Request) -> web.Response:
-    jwt_check(request)
     data = FacilityUpdateRequest().load(await request.json())
 
     facility_updated_fields = {}
@@ -103,11 +170,14 @@ async def update_facility(request: web.Request) -> web.Response:
     except DBAPIError:
         raise web.HTTPBadRequest(text="facility with this id doesn't exists")
 
+    before = FacilityState.of(facility)
     for k in facility_updated_fields:
         setattr(facility, k, facility_updated_fields[k])
 
     await session.flush()
 
+    facility_changed(request, before, FacilityState.of(facility))
+
     return web.json_response(FacilityResponse().dump(facility), status=200)
 
 
@@ -135,7 +205,6 @@ async def update_facility(request: web.Request) -> web.Response:
 )
 @request_schema(FacilityHiddenRequest)
 async def hidden_facility(request: web.Request) -> web.Response:
-    jwt_check(request)
     data = FacilityHiddenRequest().load(await request.json())
     facility_hidden = data.get('hidden')
 
@@ -148,10 +217,13 @@ async def hidden_facility(request: web.Request) -> web.Response:
     except DBAPIError:
         raise web.HTTPBadRequest(text="facility with this id doesn't exists")
 
+    before = FacilityState.of(facility)
     facility.hidden = facility_hidden
 
     await session.flush()
 
+    facility_changed(request, before, FacilityState.of(facility))
+
     return web.json_response(FacilityResponse().dump(facility), status=200)
 
 
@@ -174,7 +246,6 @@ async def hidden_facility(request: web.Request) -> web.Response:
     },
 )
 async def delete_facility(request: web.Request) -> web.Response:
-    jwt_check(request)
     session = request['session']
 
     try:
@@ -186,18 +257,114 @@ async def delete_facility(request: web.Request) -> web.Response:
 
     await session.delete(facility)
 
+    facility_changed(request, FacilityState.of(facility), None)
+
     return web.json_response(status=204)
 
 
+async def _bulk_count(request: web.Request, data: dict) -> web.Response:
+    """
+    Ответ на dry_run массового изменения: сколько объектов подходит, ничего не изменяется.
+    """
+    where = FacilityBulk.where(data.get('ids'), data.get('q'), data.get('filters'))
+    count = await FacilityBulk.count(request['session'], where)
+    return web.json_response(BulkResponse().dump({'count': count, 'ids': [], 'dry_run': True}), status=200)
+
+
+async def _bulk_lock(request: web.Request, data: dict) -> list:
+    """
+    Блокирует объекты, выбранные запросом массового изменения.
+    :return: состояние объектов до изменения
+    :raise ValidationError: если подходит больше объектов, чем разрешает limit
+    """
+    where = FacilityBulk.where(data.get('ids'), data.get('q'), data.get('filters'))
+    # На один объект больше limit: превышение видно без подсчета всех подходящих объектов
+    rows = await FacilityBulk.lock(request['session'], where, data['limit'] + 1)
+    if len(rows) > data['limit']:
+        raise ValidationError({'limit': [f'more than {data["limit"]} facilities match']})
+    return rows
+
+
+BULK_RESPONSES = {
+    200: {
+        "schema": BulkResponse,
+        "description": "Объекты изменены (или посчитаны, если dry_run)"
+    },
+    401: {
+        "description": "Ошибка аутентификации (отсутствующий или неправильный токен аутентификации. "
+                       "Authorization: Bearer 'текст токена') "
+    },
+    422: {
+        "schema": ErrorResponse,
+        "description": "Ошибка валидации входных данных или подходит больше объектов, чем limit"
+    },
+}
+
+
+@docs(
+    tags=["Facilities"],
+    summary="Массовое изменение спортивных объектов",
+    description="Присваивает полям из patch новые значения у объектов, выбранных списком ids или условиями "
+                "q и filters (как в поиске), одним запросом. Если подходит больше объектов, чем limit, "
+                "ничего не изменяется. С dry_run объекты только считаются.",
+    responses=BULK_RESPONSES,
+)
+@request_schema(BulkUpdateRequest)
+async def bulk_update_facilities(request: web.Request) -> web.Response:
+    data = BulkUpdateRequest().load(await request.json())
+
+    if data['dry_run']:
+        return await _bulk_count(request, data)
+
+    before = await _bulk_lock(request, data)
+    after = await FacilityBulk.update(request['session'], [row.id for row in before], data['patch'])
+
+    before = {row.id: FacilityState.of(row) for row in before}
+    facilities_changed(request, [(before[row.id], FacilityState.of(row)) for row in after])
+
+    body = {'count': len(after), 'ids': [row.id for row in after], 'dry_run': False}
+    return web.json_response(BulkResponse().dump(body), status=200)
+
+
+@docs(
+    tags=["Facilities"],
+    summary="Массовое удаление спортивных объектов",
+    description="Удаляет объекты, выбранные списком ids или условиями q и filters (как в поиске), "
+                "одним запросом. Если подходит больше объектов, чем limit, ничего не удаляется. "
+                "С dry_run объекты только считаются.",
+    responses=BULK_RESPONSES,
+)
+@request_schema(BulkDeleteRequest)
+async def bulk_delete_facilities(request: web.Request) -> web.Response:
+    data = BulkDeleteRequest().load(await request.json())
+
+    if data['dry_run']:
+        return await _bulk_count(request, data)
+
+    before = await _bulk_lock(request, data)
+    deleted = await FacilityBulk.delete(request['session'], [row.id for row in before])
+
+    facilities_changed(request, [(FacilityState.of(row), None) for row in deleted])
+
+    body = {'count': len(deleted), 'ids': [row.id for row in deleted], 'dry_run': False}
+    return web.json_response(BulkResponse().dump(body), status=200)
+
+
+@replica
+@autocommit
 @docs(
     tags=["Facilities"],
     summary="Получение спортивного объекта по id",
-    description="Получение спортивного объекта по id",
+    description="Получение спортивного объекта по id. "
+                "Ответ содержит ETag и Last-Modified, на условный запрос с актуальной версией возвращается 304.",
     responses={
         200: {
             "schema": FacilityResponse,
             "description": "Полученный объект"
         },
+        304: {
+            "description": "Объект не изменился"
+        },
         400: {
             "schema": ErrorResponse,
             "description": "передан id объекта, которого не существует"
@@ -206,43 +373,255 @@ async def delete_facility(request: web.Request) -> web.Response:
 )
 async def get_facility_by_id(request: web.Request) -> web.Response:
     session = request['session']
+    cache = request.app['facility_cache']
+    facility_id = request.match_info['id']
     try:
-        facility = await Facility.get_by_id(session, request.match_info['id'])
-        if not facility:
+        if is_conditional(request) and not cache.is_cached_by_id(facility_id):
+            # Проверяем версию объекта, не загружая и не сериализуя его
+            modified_at = await Facility.get_modified_at(session, facility_id)
+            if modified_at is not None:
+                etag = facility_etag(facility_id, modified_at)
+                if not_modified(request, etag, modified_at):
+                    return conditional_response(request, b'', etag, modified_at)
+
+        response = await cache.get_by_id(session, facility_id)
+        if response is None:
             raise web.HTTPBadRequest(text="facility with this id doesn't exists")
     except IntegrityError:
         raise web.HTTPBadRequest(text="facility with this id doesn't exists")
     except DBAPIError:
         raise web.HTTPBadRequest(text="facility with this id doesn't exists")
-    return web.json_response(FacilityResponse().dump(facility), status=200)
+    return conditional_response(request, response.body, response.etag, response.last_modified)
 
 
+@replica
+@autocommit
+@docs(
+    tags=["Facilities"],
+    summary="Получение спортивных объектов по списку id",
+    description="Получение до 500 спортивных объектов по id одним запросом. Объекты возвращаются "
+                "в порядке ids (повторы id не дублируются), id несуществующих объектов перечисляются в missing.",
+    responses={
+        200: {
+            "schema": BatchResponse,
+            "description": "Полученные объекты"
+        },
+        422: {
+            "schema": ErrorResponse,
+            "description": "Ошибка валидации входных данных"
+        },
+    },
+)
+@request_schema(BatchRequest)
+async def get_facilities_by_ids(request: web.Request) -> web.Response:
+    data = BatchRequest().load(await request.json())
+    ids = list(dict.fromkeys(data['ids']))
+
+    responses = await request.app['facility_cache'].get_by_ids(request['session'], ids)
+
+    body = json_list_body(
+        [responses[id].body for id in ids if id in responses],
+        trailer={'missing': [str(id) for id in ids if id not in responses]}
+    )
+    return web.Response(body=body, content_type='application/json', status=200)
+
+
+@replica
+@snapshot
 @docs(
     tags=["Facilities"],
     summary="Получение всех спортивных объектов",
-    description="Получение всех спортивных объектов",
+    description="Получение всех спортивных объектов. "
+                "Ответ содержит ETag и Last-Modified, на условный запрос с актуальной версией возвращается 304. "
+                "С заголовком Accept-Encoding ответ сжимается gzip или br.",
+    responses={
+        200: {
+            "schema": FacilityResponseList,
+            "description": "Полученные объекты"
+        },
+        304: {
+            "description": "Объекты не изменились"
+        },
+    },
+)
+async def get_all_facilities(request: web.Request) -> web.StreamResponse:
+    session = request['session']
+    cache = request.app['facility_cache']
+
+    response = cache.get_cached_all()
+    if response is not None:
+        return conditional_response(request, response.body, response.etag, response.last_modified)
+
+    # Проверяем версию каталога, не загружая и не сериализуя объекты. Версия и список читаются
+    # из одного снимка базы (snapshot), поэтому ETag соответствует отправленному телу
+    version = await Facility.get_catalog_version(session)
+    etag = catalog_etag(version)
+    if not_modified(request, etag, version[1]):
+        return conditional_response(request, b'', etag, version[1])
+
+    response = web.StreamResponse(headers={'ETag': etag})
+    response.last_modified = version[1]
+    # Пока список не в кеше, он сжимается по мере отправки; из кеша отдается заранее сжатый вариант
+    enable_stream_compression(request, response)
+    return await stream_json_list(request, cache.stream_all(session), response)
+
+
+@autocommit
+@docs(
+    tags=["Facilities"],
+    summary="Получение спортивных объектов в прямоугольной области",
+    description="Получение спортивных объектов, попадающих в видимую часть карты "
+                "(min_x <= x <= max_x, min_y <= y <= max_y)",
     responses={
         200: {
             "schema": FacilityResponseList,
             "description": "Полученные объекты"
         },
+        422: {
+            "schema": ErrorResponse,
+            "description": "Ошибка валидации входных данных"
+        },
     },
 )
-async def get_all_facilities(request: web.Request) -> web.Response:
+@querystring_schema(BBoxQuery)
+async def get_facilities_by_bbox(request: web.Request) -> web.Response:
+    data = BBoxQuery().load(request.query)
+
     session = request['session']
 
-    facilities = await Facility.get_all(session)
+    facilities = await FacilityRows.get_by_bbox(
+        session,
+        min_x=data['min_x'],
+        min_y=data['min_y'],
+        max_x=data['max_x'],
+        max_y=data['max_y']
+    )
+
+    with measure('serialize'):
+        rows = [serialize_facility_row(facility) for facility in facilities]
+    body = json_list_body(rows)
+    return web.Response(body=body, content_type='application/json', status=200)
+
+
+@autocommit
+@docs(
+    tags=["Facilities"],
+    summary="Кластеры спортивных объектов",
+    description="Получение кластеров видимых спортивных объектов в прямоугольной области на заданном масштабе карты: "
+                "центроид, количество объектов и количество объектов по типам",
+    responses={
+        200: {
+            "schema": ClusterResponseList,
+            "description": "Полученные кластеры"
+        },
+        422: {
+            "schema": ErrorResponse,
+            "description": "Ошибка валидации входных данных"
+        },
+    },
+)
+@querystring_schema(ClusterQuery)
+async def get_facility_clusters(request: web.Request) -> web.Response:
+    data = ClusterQuery().load(request.query)
+
+    clusters = request.app['clusters']
+    await clusters.ensure_loaded(request['session'])
+
+    result = [
+        cluster.dict()
+        for cluster in clusters.get(data['zoom'], data['min_x'], data['min_y'], data['max_x'], data['max_y'])
+    ]
 
-    return web.json_response(FacilityResponseList().dump({
-        'count': len(facilities),
-        'data': [FacilityResponse().dump(facility) for facility in facilities]
+    return web.json_response(ClusterResponseList().dump({
+        'count': len(result),
+        'data': result
     }), status=200)
 
 
+@read_only
+@docs(
+    tags=["Facilities"],
+    summary="Подсказки имен спортивных объектов",
+    description="Имена и id видимых спортивных объектов, в имени которых есть слово, начинающееся с prefix. "
+                "Если таких нет (например, в prefix опечатка), выполняется нечеткий поиск по триграммам.",
+    responses={
+        200: {
+            "schema": SuggestResponseList,
+            "description": "Полученные подсказки"
+        },
+        422: {
+            "schema": ErrorResponse,
+            "description": "Ошибка валидации входных данных"
+        },
+    },
+)
+@querystring_schema(SuggestQuery)
+async def suggest_facilities(request: web.Request) -> web.Response:
+    data = SuggestQuery().load(request.query)
+
+    session = request['session']
+    suggest = request.app['suggest']
+    await suggest.ensure_loaded(session)
+
+    result = suggest.get(data['prefix'], data['limit'])
+    if not result:
+        result = await Facility.suggest(session, data['prefix'], data['limit'])
+
+    return web.json_response(SuggestResponseList().dump({
+        'count': len(result),
+        'data': [{'id': id, 'name': name} for id, name in result]
+    }), status=200)
+
+
+@autocommit
+@docs(
+    tags=["Facilities"],
+    summary="Тайл карты с маркерами спортивных объектов",
+    description="Маркеры видимых спортивных объектов в тайле z/x/y (нумерация тайлов как у OpenStreetMap). "
+                "Ответ содержит ETag, на запрос с совпадающим If-None-Match возвращается 304. "
+                "Если в параметре v передан текущий ETag тайла (версионированный URL), "
+                "ответ можно кешировать бессрочно.",
+    responses={
+        200: {
+            "description": "Тайл: {\"fields\": [\"id\", \"x\", \"y\", \"type\"], \"markers\": [[...], ...]}"
+        },
+        304: {
+            "description": "Тайл не изменился"
+        },
+        400: {
+            "schema": ErrorResponse,
+            "description": "Несуществующий тайл"
+        },
+    },
+)
+async def get_facility_tile(request: web.Request) -> web.Response:
+    z = int(request.match_info['z'])
+    x = int(request.match_info['x'])
+    y = int(request.match_info['y'])
+    if z > MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+        raise web.HTTPBadRequest(text="tile with this z/x/y doesn't exists")
+
+    tile = await request.app['tiles'].get(request['session'], z, x, y)
+
+    # Версия - ETag без кавычек; у сжатого ответа ETag слабый (W/"..."), префикс W/ тоже допускается
+    if request.query.get('v', '').removeprefix('W/').strip('"') == tile.etag.strip('"'):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, no-cache'
+
+    return conditional_response(request, tile.body, tile.etag, headers={'Cache-Control': cache_control})
+
+
+@replica
+@read_only
 @docs(
     tags=["Facilities"],
     summary="Поиск спортивных объектов",
-    description="Типа очень умный поиск спортивных объектов, с фильтрами и прочей шнягой",
+    description="Типа очень умный поиск спортивных объектов, с фильтрами и прочей шнягой. "
+                "q ищет по имени, владельцу, примечаниям, пользователям и режиму работы с учетом "
+                "словоформ, order_by=rank сортирует результаты по релевантности. "
+                "Для постраничной выдачи передайте limit, а для следующей страницы - "
+                "cursor из next_cursor предыдущего ответа (с теми же order_by и order_desc).",
     responses={
         200: {
             "schema": FacilityResponseList,
@@ -255,7 +634,7 @@ async def get_all_facilities(request: web.Request) -> web.Response:
     },
 )
 @request_schema(SearchQuery)
-async def search_facilities(request: web.Request) -> web.Response:
+async def search_facilities(request: web.Request) -> web.StreamResponse:
     data = SearchQuery().load(await request.json())
 
     session = request['session']
@@ -266,18 +645,91 @@ async def search_facilities(request: web.Request) -> web.Response:
     order_by = data.get('order_by')
     order_desc = data.get('order_desc')
     filters = data.get('filters')
+    cursor = data.get('cursor')
 
-    facilities = await Facility.search(
-        session,
+    after = decode_cursor(cursor, order_by, order_desc) if cursor else None
+
+    stmt = FacilityRows.search_stmt(
         q=q,
         offset=offset,
-        limit=limit,
+        # Лишний объект показывает, есть ли следующая страница
+        limit=limit + 1 if limit else None,
         order_by=order_by,
         order_desc=order_desc,
-        filters=filters
+        filters=filters,
+        after=after
     )
 
-    return web.json_response(FacilityResponseList().dump({
-        'count': len(facilities),
-        'data': [FacilityResponse().dump(facility) for facility in facilities]
-    }), status=200)
+    last = None
+    has_next = False
+
+    async def rows():
+        nonlocal last, has_next
+        count = 0
+        async for partition in timed_partitions(FacilityRows.partitions(session, stmt)):
+            if limit and count + len(partition) > limit:
+                has_next = True
+                partition = partition[:limit - count]
+            if not partition:
+                continue
+            count += len(partition)
+            last = partition[-1]
+            with measure('serialize'):
+                serialized = [serialize_facility_row(facility) for facility in partition]
+            for row in serialized:
+                yield row
+
+    def trailer():
+        next_cursor = None
+        if has_next and order_by in KEYSET_COLUMNS:
+            next_cursor = encode_cursor(order_by, order_desc, Facility.sort_key(last, order_by))
+        return {'next_cursor': next_cursor}
+
+    response = web.StreamResponse()
+    enable_stream_compression(request, response)
+    return await stream_json_list(request, rows(), response, trailer=trailer)
+
+
+@replica
+@read_only
+@docs(
+    tags=["Facilities"],
+    summary="Выгрузка всех спортивных объектов",
+    description="Выгрузка всех спортивных объектов файлом в формате ndjson (объект на строчке), csv, "
+                "geojson (FeatureCollection) или arrow (Arrow IPC stream). Объекты отправляются по мере чтения "
+                "из базы, память сервера не зависит от их количества. С заголовком Accept-Encoding: gzip "
+                "ответ сжимается.",
+    responses={
+        200: {
+            "description": "Файл с объектами"
+        },
+        422: {
+            "schema": ErrorResponse,
+            "description": "Неизвестный формат"
+        },
+    },
+)
+@querystring_schema(ExportQuery)
+async def export_facilities(request: web.Request) -> web.StreamResponse:
+    data = ExportQuery().load(request.query)
+    export_format = EXPORT_FORMATS[data['format']]
+    if data['format'] == ARROW and not arrow_available():
+        raise ValidationError({'format': ['arrow format requires pyarrow to be installed']})
+
+    session = request['session']
+
+    response = web.StreamResponse(headers={
+        hdrs.CONTENT_DISPOSITION: f'attachment; filename="facilities.{export_format.extension}"'
+    })
+    response.content_type = export_format.content_type
+    enable_stream_compression(request, response)
+    await response.prepare(request)
+
+    partitions = timed_partitions(FacilityRows.partitions(session, chunk_size=EXPORT_CHUNK_SIZE))
+    try:
+        async for chunk in export_format.encode(partitions):
+            await response.write(chunk)
+        await response.write_eof()
+    except Exception as e:
+        abort_response(request, e)
+    return response
@@ -0,0 +1,31 @@
+from aiohttp import web
+from aiohttp_apispec import docs
+
+from api.metrics import CONTENT_TYPE
+
+
+@docs(
+    tags=["Monitoring"],
+    summary="Метрики",
+    description="Метрики процесса в текстовом формате Prometheus: запросы по маршрутам, "
+                "пулы соединений с базой и кеши.",
+    responses={
+        200: {
+            "description": "Успешно"
+        },
+    },
+)
+async def metrics_handler(request: web.Request) -> web.Response:
+    app = request.app
+    pools = {'primary': app['sessionmaker'].kw['bind'].sync_engine.pool}
+    if app.get('replicas') is not None:
+        for i, replica in enumerate(app['replicas'].replicas):
+            pools[f'replica{i}'] = replica.engine.sync_engine.pool
+    caches = {
+        'facility': app['facility_cache'].stats(),
+        'tiles': app['tiles'].stats(),
+        'tokens': app['jwt'].stats(),
+        'compressed': app['compressed'].stats(),
+    }
+    body = app['metrics'].render(pools, caches)
+    return web.Response(body=body.encode(), headers={'Content-Type': CONTENT_TYPE})
@@ -8,7 +8,8 @@ from aiohttp_apispec import (
 from sqlalchemy.exc import IntegrityError, DBAPIError
 
 from db import User
-from api.jwt import JWTException, jwt_check  # , JWTException
+from api.jwt import JWTException
+from api.middlewares import autocommit, replica
 from api.schemas.error import ErrorResponse
 from api.schemas.user import (
     UserResponse,
@@ -18,10 +19,8 @@ from api.schemas.user import (
     RefreshTokenRequest,
     UpdateSelfRequest
 )
-from utils import setup_logger
 
 logger = logging.getLogger(__name__)
-setup_logger(logger)
 
 
 @docs(
@@ -126,7 +125,7 @@ async def refresh_token(request: web.Request) -> web.Response:
     session = request['session']
 
     try:
-        user_email = request.app['jwt'].get_email_from_access_token(access_token)
+        user_email = request.app['jwt'].verify_access_token(access_token)
     except JWTException:
         raise web.HTTPBadRequest(text='wrong access token')
     if not user_email:
@@ -171,7 +170,6 @@ async def refresh_token(request: web.Request) -> web.Response:
     },
 )
 async def delete_self(request: web.Request) -> web.Response:
-    jwt_check(request)
     user_email = request['email']
 
     session = request['session']
@@ -203,7 +201,6 @@ async def delete_self(request: web.Request) -> web.Response:
 )
 @request_schema(UpdateSelfRequest)
 async def update_self(request: web.Request) -> web.Response:
-    jwt_check(request)
     user_email = request['email']
     data = UpdateSelfRequest().load(await request.json())
 
@@ -223,6 +220,8 @@ async def update_self(request: web.Request) -> web.Response:
     return web.json_response(UserResponse().dump(user))
 
 
+@replica
+@autocommit
 @docs(
     tags=["Admin"],
     summary="Получение пользователя по его id",
@@ -243,7 +242,6 @@ async def update_self(request: web.Request) -> web.Response:
     },
 )
 async def get_user_by_id(request: web.Request) -> web.Response:
-    jwt_check(request)
     session = request['session']
     try:
         user = await User.get_by_id(session, request.match_info['id'])
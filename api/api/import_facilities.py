@@ -0,0 +1,79 @@
+"""
+Массовый импорт спортивных объектов из файла (CSV, NDJSON или GeoJSON), см. POST /facility/import
+
+Пример использования:
+
+python3 -m api.import_facilities --db-url $(DEV_DB_URL) registry.csv
+
+Работающие экземпляры API узнают об импорте из уведомления (см. api.channel), отправленного
+в транзакции импорта, и обновляют кластеры, подсказки, тайлы и кеши в памяти.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from api.changes import publish
+from api.importer import (
+    CSV, GEOJSON, IMPORT_FORMATS, NDJSON, READ_CHUNK_SIZE, ImportReport, import_records, read_records
+)
+from api.serializers import load_facility
+from utils import db_connect_args
+
+EXTENSIONS = {
+    '.csv': CSV,
+    '.ndjson': NDJSON,
+    '.jsonl': NDJSON,
+    '.geojson': GEOJSON,
+    '.json': GEOJSON,
+}
+
+
+async def read_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(READ_CHUNK_SIZE):
+            yield chunk
+
+
+async def run(db_url: str, path: str, format: str, use_ssl: bool = False) -> ImportReport:
+    engine = create_async_engine(db_url, connect_args=db_connect_args(use_ssl))
+    try:
+        async with AsyncSession(engine) as session:
+            async with session.begin():
+                report, changes = await import_records(session, read_records(read_chunks(path), format), load_facility)
+                await publish(session, None, changes)
+    finally:
+        await engine.dispose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', required=True, help='адрес базы данных')
+    parser.add_argument('--db-use-ssl', action='store_true', default=os.getenv('API_DB_USE_SSL') is not None,
+                        help='подключаться к базе с сертификатом из CA.pem (по умолчанию, если задан API_DB_USE_SSL)')
+    parser.add_argument('--format', choices=IMPORT_FORMATS, default=None,
+                        help='формат файла (по умолчанию по расширению)')
+    parser.add_argument('path', help='файл с объектами')
+    args = parser.parse_args()
+
+    format = args.format or EXTENSIONS.get(os.path.splitext(args.path)[1].lower())
+    if format is None:
+        parser.error('cannot detect format by file extension, use --format')
+
+    report = asyncio.run(run(args.db_url, args.path, format, args.db_use_ssl))
+
+    print(f'received {report.received}, inserted {report.inserted}, updated {report.updated}, '
+          f'unchanged {report.unchanged}, failed {report.failed}')
+    for error in report.errors:
+        print(f'row {error["row"]}: {json.dumps(error["errors"], ensure_ascii=False)}', file=sys.stderr)
+    exit(1 if report.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import csv
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Optional
+
+from marshmallow import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.changes import Change, FacilityState
+from db.facility_import import FacilityImport
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 5000  # строчек в одном COPY
+MAX_IMPORT_ERRORS = 1000  # ошибок в отчете, остальные только считаются
+READ_CHUNK_SIZE = 64 * 1024  # байт, которые читаются из тела запроса или файла за раз
+MAX_RECORD_SIZE = 1024 * 1024  # байт в одной записи CSV или NDJSON
+MAX_DOCUMENT_SIZE = 64 * 1024 * 1024  # байт в документе GeoJSON, он разбирается целиком
+
+# По умолчанию модуль csv не разбирает значения длиннее 128 КиБ. Настройка общая для процесса,
+# но больше в API CSV не разбирается
+csv.field_size_limit(MAX_RECORD_SIZE)
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+GEOJSON = 'geojson'
+IMPORT_FORMATS = (CSV, NDJSON, GEOJSON)
+CONTENT_TYPES = {
+    'text/csv': CSV,
+    'application/x-ndjson': NDJSON,
+    'application/ndjson': NDJSON,
+    'application/geo+json': GEOJSON,
+}
+
+# Строчка файла: поля объекта или ошибки разбора
+Record = tuple[Optional[dict[str, Any]], Optional[dict[str, list[str]]]]
+
+
+def _feature(feature: Any) -> Record:
+    """
+    GeoJSON Feature с геометрией Point: координаты становятся полями x и y, properties - остальными полями.
+    """
+    if not isinstance(feature, dict):
+        return None, {'_schema': ['feature must be an object']}
+    data = dict(feature.get('properties') or {})
+    geometry = feature.get('geometry')
+    if geometry is not None:
+        coordinates = geometry.get('coordinates') if isinstance(geometry, dict) else None
+        if not isinstance(coordinates, list) or len(coordinates) < 2 or geometry.get('type') != 'Point':
+            return None, {'geometry': ['geometry must be a Point']}
+        data['x'], data['y'] = coordinates[0], coordinates[1]
+    return data, None
+
+
+def _object(value: Any) -> Record:
+    if isinstance(value, dict) and value.get('type') == 'Feature':
+        return _feature(value)
+    if not isinstance(value, dict):
+        return None, {'_schema': ['row must be an object']}
+    return value, None
+
+
+async def _lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Optional[bytes]]:
+    """
+    Строчки (вместе с переводом строки) из кусков chunks произвольного размера.
+    Вместо строчки длиннее MAX_RECORD_SIZE возвращается None, сама строчка в памяти не копится.
+
+    StreamReader aiohttp умеет читать по строчкам сам, но на строчке длиннее 128 КиБ
+    бросает ValueError, а такие записи в CSV и NDJSON встречаются.
+    """
+    pending = b''
+    skipping = False  # дочитываем строчку, о которой уже вернули None
+    async for chunk in chunks:
+        start = 0
+        while (end := chunk.find(b'\n', start)) != -1:
+            line, pending = pending + chunk[start:end + 1], b''
+            start = end + 1
+            if skipping:
+                skipping = False
+            elif len(line) > MAX_RECORD_SIZE:
+                yield None
+            else:
+                yield line
+        if not skipping:
+            pending += chunk[start:]
+            if len(pending) > MAX_RECORD_SIZE:
+                pending, skipping = b'', True
+                yield None
+    if pending:
+        yield pending
+
+
+def _too_large() -> dict[str, list[str]]:
+    return {'_schema': [f'row is larger than {MAX_RECORD_SIZE} bytes']}
+
+
+async def _csv_records(chunks: AsyncIterable[bytes]) -> AsyncIterator[Record]:
+    """
+    CSV с заголовком из имен полей. Пустое значение - поле не задано.
+    """
+    header = None
+    pending = ''
+    async for line in _lines(chunks):
+        if line is None or len(pending) + len(line) > MAX_RECORD_SIZE:
+            if header is None:
+                raise ValidationError({'body': [f'header is larger than {MAX_RECORD_SIZE} bytes']})
+            pending = ''
+            yield None, _too_large()
+            continue
+        try:
+            pending += line.decode()
+        except UnicodeDecodeError:
+            raise ValidationError({'body': ['file must be in UTF-8']})
+        # Перевод строки внутри значения в кавычках - запись еще не закончилась
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, ''
+        if not record.strip():
+            continue
+        values = next(csv.reader([record.lstrip('\ufeff') if header is None else record]))
+
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield None, {'_schema': [f'expected {len(header)} values, got {len(values)}']}
+            continue
+        yield {name: value for name, value in zip(header, values) if value != ''}, None
+
+    if pending.strip():
+        yield None, {'_schema': ['unterminated quoted value']}
+
+
+async def _ndjson_records(chunks: AsyncIterable[bytes]) -> AsyncIterator[Record]:
+    """
+    JSON объект на каждой строчке: поля объекта или GeoJSON Feature.
+    """
+    async for line in _lines(chunks):
+        if line is None:
+            yield None, _too_large()
+            continue
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield None, {'_schema': ['invalid JSON']}
+            continue
+        yield _object(value)
+
+
+async def _geojson_records(chunks: AsyncIterable[bytes]) -> AsyncIterator[Record]:
+    """
+    GeoJSON FeatureCollection. В отличие от построчных форматов, документ разбирается целиком,
+    поэтому его размер ограничен MAX_DOCUMENT_SIZE.
+    """
+    body = bytearray()
+    async for chunk in chunks:
+        body += chunk
+        if len(body) > MAX_DOCUMENT_SIZE:
+            raise ValidationError({'body': [f'document is larger than {MAX_DOCUMENT_SIZE} bytes']})
+    try:
+        document = json.loads(body)
+    except ValueError:
+        raise ValidationError({'body': ['invalid JSON']})
+    if isinstance(document, dict) and document.get('type') == 'Feature':
+        features = [document]
+    elif isinstance(document, dict) and document.get('type') == 'FeatureCollection':
+        features = document.get('features') or []
+    else:
+        raise ValidationError({'body': ['GeoJSON FeatureCollection is expected']})
+    for feature in features:
+        yield _feature(feature)
+
+
+READERS = {
+    CSV: _csv_records,
+    NDJSON: _ndjson_records,
+    GEOJSON: _geojson_records,
+}
+
+
+def read_records(chunks: AsyncIterable[bytes], format: str) -> AsyncIterator[Record]:
+    """
+    Строчки загружаемого файла в формате format, по одной, по мере чтения кусков файла chunks
+    (например, request.content.iter_chunked(READ_CHUNK_SIZE)).
+    """
+    return READERS[format](chunks)
+
+
+class ImportReport:
+    def __init__(self):
+        self.received = 0  # строчек в файле
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0  # объекты, которые в файле такие же, как в базе
+        self.failed = 0  # строчек с ошибками
+        self.errors: list[dict] = []  # первые MAX_IMPORT_ERRORS ошибок: номер строчки и ошибки полей
+
+    def error(self, row: int, messages: dict):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'row': row, 'errors': messages})
+
+
+async def import_records(
+        session: AsyncSession,
+        records: AsyncIterable[Record],
+        load: Callable[[dict], dict]
+) -> tuple[ImportReport, list[Change]]:
+    """
+    Проверяет строчки функцией load (например, api.serializers.load_facility) и пачками
+    по IMPORT_BATCH_SIZE загружает правильные через COPY.
+    Строчки с ошибками пропускаются и попадают в отчет, номера строчек начинаются с 1
+    (заголовок CSV не считается).
+
+    :return: отчет и изменения объектов для наблюдателей (см. api.changes.facilities_changed)
+    """
+    report = ImportReport()
+    loader = FacilityImport(session)
+    await loader.create_staging()
+
+    names = set()
+    batch = []
+    async for data, errors in records:
+        report.received += 1
+        if errors is None:
+            try:
+                data = load(data)
+            except ValidationError as e:
+                errors = e.messages
+        if errors is None and data['name'] in names:
+            errors = {'name': ['duplicate name in upload']}
+        if errors is not None:
+            report.error(report.received, errors)
+            continue
+
+        names.add(data['name'])
+        data.setdefault('hidden', False)
+        batch.append(data)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await loader.copy(batch)
+            batch = []
+    await loader.copy(batch)
+
+    before, after = await loader.merge()
+    before = {row.id: FacilityState.of(row) for row in before}
+    changes = []
+    for row in after:
+        if row.inserted:
+            report.inserted += 1
+            changes.append((None, FacilityState.of(row)))
+        else:
+            report.updated += 1
+            changes.append((before.get(row.id), FacilityState.of(row)))
+    report.unchanged = loader.copied - len(after)
+
+    logger.info(
+        'import: %d rows, %d inserted, %d updated, %d unchanged, %d failed',
+        report.received, report.inserted, report.updated, report.unchanged, report.failed
+    )
+    return report, changes
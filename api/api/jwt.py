@@ -1,15 +1,16 @@
 import logging
-import random
 import time
 
+from api.cache import LRUCache
+
 from aiohttp import web
 import jwt
 from jwt import PyJWTError
 
-from utils import setup_logger
-
 logger = logging.getLogger(__name__)
-setup_logger(logger)
+
+VERIFIED_TOKENS_CACHE_SIZE = 1024  # проверенных access token в памяти процесса
+VERIFIED_TOKENS_CACHE_TTL = 60  # секунд, не больше; токен удаляется и раньше, когда истекает
 
 
 class JWTException(Exception):
@@ -22,21 +23,33 @@ class JWTException(Exception):
 class JWT:
     """
     Класс для работы с jwt токенами.
+
+    Токены подписываются первым из ключей, его kid записывается в заголовок токена. Остальные ключи
+    только проверяют подпись уже выданных токенов: чтобы сменить ключ, новый ставится первым,
+    а старый остается в списке, пока не истекут подписанные им токены. Одни и те же ключи
+    во всех процессах и экземплярах API позволяют принимать токены, выданные любым из них.
     """
-    def __init__(self):
-        self.JWT_SECRET = ''.join(random.choice('qwertyuiopasdfghjklzxcvbnm123456789') for _ in range(128))
+    def __init__(self, keys: list[tuple[str, str]]):
+        """
+        :param keys: пары (kid, секрет), см. settings.parse_jwt_keys
+        """
+        self.JWT_KID, self.JWT_SECRET = keys[0]
+        self.JWT_KEYS = dict(keys)
         self.TOKEN_TTL_SECONDS = 60 * 20
+        # access token -> email: проверка подписи HMAC нужна только при первом запросе с токеном
+        self._verified = LRUCache(maxsize=VERIFIED_TOKENS_CACHE_SIZE, ttl=VERIFIED_TOKENS_CACHE_TTL)
 
     def __encode_jwt(self, data: dict) -> str:
         try:
-            jwt_secret = self.JWT_SECRET
-            return jwt.encode(data, jwt_secret, algorithm="HS256")
+            return jwt.encode(data, self.JWT_SECRET, algorithm="HS256", headers={'kid': self.JWT_KID})
         except PyJWTError:
             raise JWTException
 
     def __decode_jwt(self, token: str) -> dict:
         try:
-            jwt_secret = self.JWT_SECRET
+            jwt_secret = self.JWT_KEYS.get(jwt.get_unverified_header(token).get('kid'))
+            if jwt_secret is None:
+                raise JWTException
             return jwt.decode(token, jwt_secret, algorithms=["HS256"])
         except PyJWTError:
             raise JWTException
@@ -89,93 +102,67 @@ class JWT:
         else:
             raise JWTException
 
-    def check_access_token(self, access_token: str) -> bool:
+    def verify_access_token(self, access_token: str) -> str:
         """
-        Проверяет, жив ли еще токен.
-        :raise JWTException: если токен некорректный
-        :param access_token: токен
-        :return: True - если токен еще жив, False - иначе
+        Проверяет подпись и срок действия токена за одно декодирование.
+        Проверенные токены запоминаются до истечения их срока (но не дольше VERIFIED_TOKENS_CACHE_TTL).
+        :raise JWTException: если токен некорректный или истек
+        :return: email пользователя из токена
         """
-        access_token_data = self.__decode_jwt(access_token)
-        try:
-            access_token_expires_in = access_token_data['expires_in']
-        except ValueError:
-            raise JWTException
-        now = int(time.time())
-        if now > access_token_expires_in:
-            return False
-        return True
+        email = self._verified.get(access_token)
+        if email is not None:
+            return email
 
-    def get_email_from_access_token(self, access_token: str) -> str:
         access_token_data = self.__decode_jwt(access_token)
         try:
-            access_token_email = access_token_data['email']
-        except ValueError:
+            email = access_token_data['email']
+            expires_in = access_token_data['expires_in']
+            ttl = expires_in - time.time()
+        except (KeyError, TypeError):
+            raise JWTException
+        if ttl < 0 or not isinstance(email, str):
             raise JWTException
-        return access_token_email
 
+        self._verified.set(access_token, email, ttl=ttl)
+        return email
 
-def jwt_middleware(handler):
-    """
-    Собственный промежуточный обработчик (декоратор) для проверки jwt токена.
+    def stats(self) -> dict:
+        """
+        Статистика кеша проверенных токенов.
+        """
+        return self._verified.stats()
 
-    После проверки токена в request.app['user'] будет находиться объект аутентифицированного пользователя
+
+def auth_required(handler):
     """
-    async def wrapper(request: web.Request):
-        logger.debug('JWT Check')
-        logger.debug(request.url.path)
-        logger.debug(f"HEADER: Authorization: {request.headers.get('Authorization')}")
-        if not request.headers.get('Authorization'):
-            raise web.HTTPUnauthorized(text='authorization error')
-        if request.headers.get('Authorization').split(' ')[0] != 'Bearer':
-            raise web.HTTPUnauthorized(text='authorization error')
-        try:
-            access_token = request.headers.get('Authorization').split(' ')[1]
-        except KeyError:
-            raise web.HTTPUnauthorized(text='authorization error')
-        try:
-            check_access_token = request.app['jwt'].check_access_token(access_token)
-        except JWTException:
-            raise web.HTTPUnauthorized(text='authorization error')
-        if not check_access_token:
-            raise web.HTTPUnauthorized(text='authorization error')
-        try:
-            user_email = request.app['jwt'].get_email_from_access_token(access_token)
-        except JWTException:
-            raise web.HTTPUnauthorized(text='authorization error')
+    Отмечает обработчик, которому нужен access token. Используется в таблице маршрутов:
+    web.post('/facility', auth_required(create_facility)), проверяет токен auth_middleware.
+    """
+    handler.auth_required = True
+    return handler
+
 
-        request['email'] = user_email
-        response = await handler(request)
-        return response
-    return wrapper
+def _bearer_token(request: web.Request) -> str:
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        raise web.HTTPUnauthorized(text='authorization error')
+    scheme, _, access_token = authorization.partition(' ')
+    if scheme != 'Bearer' or not access_token:
+        raise web.HTTPUnauthorized(text='authorization error')
+    return access_token
 
 
-def jwt_check(request: web.Request):
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
     """
-    Функция для проверки jwt токена.
+    Проверяет access token для обработчиков, отмеченных auth_required.
 
     После проверки токена в request['email'] будет находиться email аутентифицированного пользователя
     """
-    logger.debug('JWT Check')
-    logger.debug(request.url.path)
-    logger.debug(f"HEADER: Authorization: {request.headers.get('Authorization')}")
-    if not request.headers.get('Authorization'):
-        raise web.HTTPUnauthorized(text='authorization error')
-    if request.headers.get('Authorization').split(' ')[0] != 'Bearer':
-        raise web.HTTPUnauthorized(text='authorization error')
-    try:
-        access_token = request.headers.get('Authorization').split(' ')[1]
-    except KeyError:
-        raise web.HTTPUnauthorized(text='authorization error')
-    try:
-        check_access_token = request.app['jwt'].check_access_token(access_token)
-    except JWTException:
-        raise web.HTTPUnauthorized(text='authorization error')
-    if not check_access_token:
-        raise web.HTTPUnauthorized(text='authorization error')
-    try:
-        user_email = request.app['jwt'].get_email_from_access_token(access_token)
-    except JWTException:
-        raise web.HTTPUnauthorized(text='authorization error')
-
-    request['email'] = user_email
+    if getattr(request.match_info.handler, 'auth_required', False):
+        try:
+            request['email'] = request.app['jwt'].verify_access_token(_bearer_token(request))
+        except JWTException:
+            logger.debug('%s: wrong access token', request.path)
+            raise web.HTTPUnauthorized(text='authorization error')
+    return await handler(request)
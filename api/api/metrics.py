@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # секунд
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)  # байт
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)  # секунд
+
+# Путь в метриках для запросов, для которых не нашлось маршрута
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class Histogram:
+    """
+    Гистограмма Prometheus: количество наблюдений в корзинах с верхними границами buckets, их сумма и количество.
+    Наблюдения хранятся по корзинам без накопления, накопленные значения считаются только при выгрузке.
+    """
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str, lines: list[str]):
+        prefix = f'{labels},' if labels else ''
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {total}')
+        total += self.counts[-1]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {total}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {total}')
+
+
+class RouteMetrics:
+    """
+    Метрики одного маршрута (путь из таблицы маршрутов и метод).
+    """
+    __slots__ = ('in_flight', 'statuses', 'duration', 'request_size', 'response_size')
+
+    def __init__(self):
+        self.in_flight = 0
+        self.statuses: dict[int, int] = {}
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.request_size = Histogram(SIZE_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который измеряет время ожидания соединения (включая подключение нового).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait = Histogram(POOL_WAIT_BUCKETS)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait.observe(time.perf_counter() - start)
+
+
+def _label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return ','.join(f'{name}="{_label(value)}"' for name, value in labels.items())
+
+
+def _header(lines: list[str], name: str, type: str, help: str):
+    lines.append(f'# HELP {name} {help}')
+    lines.append(f'# TYPE {name} {type}')
+
+
+class Metrics:
+    """
+    Метрики HTTP запросов процесса в текстовом формате Prometheus.
+
+    Запросы считает metrics_middleware, состояние пулов соединений и кешей снимается в момент выгрузки.
+    В режиме pre-fork (API_WORKERS > 1) у каждого процесса свои метрики, /metrics отдает метрики
+    процесса, принявшего соединение.
+    """
+    def __init__(self):
+        self.routes: dict[tuple[str, str], RouteMetrics] = {}
+
+    def route(self, path: str, method: str) -> RouteMetrics:
+        route = self.routes.get((path, method))
+        if route is None:
+            route = self.routes[(path, method)] = RouteMetrics()
+        return route
+
+    def _render_routes(self, lines: list[str]):
+        routes = [(_labels(route=path, method=method), route) for (path, method), route in self.routes.items()]
+
+        _header(lines, 'http_requests_in_flight', 'gauge', 'Requests being processed.')
+        for labels, route in routes:
+            lines.append(f'http_requests_in_flight{{{labels}}} {route.in_flight}')
+
+        _header(lines, 'http_requests_total', 'counter', 'Processed requests by response status.')
+        for labels, route in routes:
+            for status, count in sorted(route.statuses.items()):
+                lines.append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+
+        for name, attr, help in (
+                ('http_request_duration_seconds', 'duration', 'Time to process a request.'),
+                ('http_request_size_bytes', 'request_size', 'Request body size (Content-Length).'),
+                ('http_response_size_bytes', 'response_size', 'Response body size.'),
+        ):
+            _header(lines, name, 'histogram', help)
+            for labels, route in routes:
+                getattr(route, attr).render(name, labels, lines)
+
+    @staticmethod
+    def _render_pools(pools: dict[str, Pool], lines: list[str]):
+        gauges = (
+            ('db_pool_size', 'Configured pool size.', lambda pool: pool.size()),
+            ('db_pool_checked_out', 'Connections in use.', lambda pool: pool.checkedout()),
+            ('db_pool_checked_in', 'Idle connections in the pool.', lambda pool: pool.checkedin()),
+            ('db_pool_overflow', 'Connections over pool size (negative - not yet opened).',
+             lambda pool: pool.overflow()),
+        )
+        for name, help, value in gauges:
+            _header(lines, name, 'gauge', help)
+            for pool_name, pool in pools.items():
+                lines.append(f'{name}{{{_labels(pool=pool_name)}}} {value(pool)}')
+
+        _header(lines, 'db_pool_wait_seconds', 'histogram', 'Time to get a connection from the pool.')
+        for pool_name, pool in pools.items():
+            if isinstance(pool, TimedPool):
+                pool.wait.render('db_pool_wait_seconds', _labels(pool=pool_name), lines)
+
+    @staticmethod
+    def _render_caches(caches: dict[str, dict], lines: list[str]):
+        for key, type, help in (
+                ('hits', 'counter', 'Cache hits.'),
+                ('misses', 'counter', 'Cache misses.'),
+                ('evictions', 'counter', 'Evicted and expired cache entries.'),
+                ('size', 'gauge', 'Cache entries.'),
+                ('bytes', 'gauge', 'Cache size in bytes (if the cache is bounded by size).'),
+        ):
+            name = f'cache_{key}_total' if type == 'counter' else f'cache_{key}'
+            _header(lines, name, type, help)
+            for cache_name, stats in caches.items():
+                lines.append(f'{name}{{{_labels(cache=cache_name)}}} {stats[key]}')
+
+        _header(lines, 'cache_hit_ratio', 'gauge', 'Cache hits to lookups since start.')
+        for cache_name, stats in caches.items():
+            lookups = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / lookups if lookups else 0
+            lines.append(f'cache_hit_ratio{{{_labels(cache=cache_name)}}} {ratio}')
+
+    def render(self, pools: dict[str, Pool], caches: dict[str, dict]) -> str:
+        """
+        :param pools: пулы соединений по имени
+        :param caches: статистика кешей по имени (см. api.cache.LRUCache.stats)
+        """
+        lines = []
+        self._render_routes(lines)
+        self._render_pools(pools, lines)
+        self._render_caches(caches, lines)
+        lines.append('')
+        return '\n'.join(lines)
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """
+    Время обработки, размеры запроса и ответа, статусы и запросы в обработке по маршрутам.
+    Стоит первым, чтобы видеть ответы, в которые error_middleware превратил исключения.
+    """
+    resource = request.match_info.route.resource
+    route = request.app['metrics'].route(
+        resource.canonical if resource is not None else UNMATCHED_ROUTE, request.method
+    )
+    route.in_flight += 1
+    start = time.perf_counter()
+    status = 500
+    response = None
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route.in_flight -= 1
+        route.duration.observe(time.perf_counter() - start)
+        route.statuses[status] = route.statuses.get(status, 0) + 1
+        route.request_size.observe(request.content_length or 0)
+        if response is not None:
+            # Потоковый ответ уже отправлен обработчиком, обычный отправляется после middleware
+            route.response_size.observe(
+                response.body_length if response.prepared else response.content_length or 0
+            )
@@ -1,14 +1,71 @@
 import logging
+from functools import lru_cache
+from typing import Awaitable, Callable
 
 import marshmallow
 from aiohttp import web
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
+from api.replicas import (
+    LSN_COOKIE,
+    LSN_COOKIE_MAX_AGE,
+    WRITE_LSN_SQL,
+    ReplicaSet,
+    format_lsn,
+    parse_lsn,
+    request_lsn,
+)
 from api.schemas.error import ErrorResponse
-from utils import setup_logger
+from api.timing import request_timing
 
 logger = logging.getLogger(__name__)
-setup_logger(logger)
+
+# Режимы транзакции запроса
+READ_WRITE = 'read_write'  # обычная транзакция (по умолчанию)
+READ_ONLY = 'read_only'  # транзакция READ ONLY
+SNAPSHOT = 'snapshot'  # транзакция READ ONLY REPEATABLE READ: все запросы видят один снимок базы
+AUTOCOMMIT = 'autocommit'  # без транзакции: нет ни BEGIN, ни COMMIT
+
+# Настройки соединения для каждого режима
+TRANSACTION_OPTIONS = {
+    READ_ONLY: {'postgresql_readonly': True},
+    SNAPSHOT: {'postgresql_readonly': True, 'isolation_level': 'REPEATABLE READ'},
+    AUTOCOMMIT: {'isolation_level': 'AUTOCOMMIT'},
+}
+
+
+def transaction_mode(mode: str):
+    """
+    Задает режим транзакции, в которой transaction_middleware выполнит обработчик.
+    """
+    def decorator(handler):
+        handler.transaction_mode = mode
+        return handler
+    return decorator
+
+
+# Обработчик только читает из базы
+read_only = transaction_mode(READ_ONLY)
+# Обработчик только читает, и его запросы должны видеть одно состояние базы
+# (например, версия для ETag и тело ответа читаются разными запросами)
+snapshot = transaction_mode(SNAPSHOT)
+# Обработчик только читает и делает один запрос, транзакция ему не нужна
+autocommit = transaction_mode(AUTOCOMMIT)
+
+
+def replica(handler):
+    """
+    Разрешает выполнить обработчик на реплике базы данных, если она не отстает от записей клиента.
+    Действует только вместе с read_only, snapshot или autocommit.
+    """
+    handler.use_replica = True
+    return handler
+
+
+@lru_cache(maxsize=32)
+def _bind(engine: AsyncEngine, mode: str) -> AsyncEngine:
+    # Движок с тем же пулом соединений; настройки сбрасываются, когда соединение возвращается в пул
+    return engine.execution_options(**TRANSACTION_OPTIONS[mode])
 
 
 @web.middleware
@@ -23,7 +80,7 @@ async def error_middleware(request: web.Request, handler):
             'detail': {}
         }), status=status_code)
     except marshmallow.exceptions.ValidationError as err:
-        logger.debug(f'validation error: {err}')
+        logger.debug('validation error: %s', err)
         status_code = 422
         return web.json_response(ErrorResponse().load({
             'message': 'validation error',
@@ -38,16 +95,83 @@ async def error_middleware(request: web.Request, handler):
         }), status=status_code)
 
 
+async def _remember_write(replicas: ReplicaSet, session: AsyncSession, resp: web.StreamResponse):
+    # Позиция после коммита, поэтому реплика, применившая ее, видит и это изменение
+    try:
+        lsn = parse_lsn(await session.scalar(WRITE_LSN_SQL))
+    except Exception as e:
+        # Изменения уже закоммичены, ответ клиенту не должен зависеть от этого запроса
+        logger.exception(e)
+        return
+    replicas.written(lsn)
+    if not resp.prepared:
+        resp.set_cookie(LSN_COOKIE, format_lsn(lsn), max_age=LSN_COOKIE_MAX_AGE, httponly=True)
+
+
 @web.middleware
 async def transaction_middleware(request: web.Request, handler):
-    async with request.app['sessionmaker']() as session:
-        session: AsyncSession
-        await session.begin()
+    """
+    Сессия базы данных запроса. Соединение из пула берется только при первом запросе к базе,
+    поэтому обработчики, которые не обращаются к базе (пинг, swagger), соединений не занимают.
+
+    Если настроены реплики, обработчики с пометкой replica читают с них, а после записи клиенту
+    выдается cookie с позицией записи в WAL, чтобы следующие чтения видели его изменения.
+
+    Запросы к базе и время фаз обработки собираются в request['timing'] (см. api.timing).
+    """
+    mode = getattr(request.match_info.handler, 'transaction_mode', READ_WRITE)
+    sessionmaker = request.app['sessionmaker']
+    replicas = request.app.get('replicas')
+    engine = sessionmaker.kw['bind']
+    if replicas is not None and mode != READ_WRITE and getattr(request.match_info.handler, 'use_replica', False):
+        engine = replicas.choose(request_lsn(request)) or engine
+    kwargs = {}
+    if mode != READ_WRITE:
+        kwargs['bind'] = _bind(engine, mode)
+
+    with request_timing(request) as timing:
+        async with sessionmaker(**kwargs) as session:
+            session: AsyncSession
+            try:
+                request['session'] = session
+                request['before_commit'] = []
+                request['on_commit'] = []
+                resp = await handler(request)
+                if session.in_transaction():
+                    for callback in request['before_commit']:
+                        await callback()
+                    await session.commit()
+                    if replicas is not None and mode == READ_WRITE and request.method not in ('GET', 'HEAD'):
+                        await _remember_write(replicas, session, resp)
+            except Exception:
+                await session.rollback()
+                raise
+
+    if timing.queries:
+        logger.debug(
+            '%s %s: %d queries, db %.1f ms, slowest %.1f ms: %s', request.method, request.path, timing.queries,
+            timing.phases['db'] * 1000, timing.slowest * 1000, timing.slowest_statement
+        )
+
+    for callback in request['on_commit']:
         try:
-            request['session'] = session
-            resp = await handler(request)
-            await session.commit()
-            return resp
-        except Exception:
-            await session.rollback()
-            raise
+            callback()
+        except Exception as e:
+            logger.exception(e)
+    return resp
+
+
+def before_commit(request: web.Request, callback: Callable[[], Awaitable[None]]):
+    """
+    Регистрирует корутину, которая будет выполнена в транзакции запроса перед ее коммитом
+    (после того, как обработчик вернул ответ). Ошибка в ней откатывает транзакцию.
+    """
+    request['before_commit'].append(callback)
+
+
+def on_commit(request: web.Request, callback: Callable[[], None]):
+    """
+    Регистрирует функцию, которая будет вызвана после успешного коммита транзакции запроса.
+    Если транзакция откатится, функция вызвана не будет.
+    """
+    request['on_commit'].append(callback)
@@ -1,17 +1,20 @@
+from __future__ import annotations
+
 import json
 import logging
+import time
 from decimal import Decimal
 from functools import partial, singledispatch
-from typing import Any
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Mapping
 
+from aiohttp import web
 from aiohttp.payload import JsonPayload as BaseJsonPayload, Payload
 from aiohttp.typedefs import JSONEncoder
 from asyncpg import Record
 
-from utils import setup_logger
+from api.timing import add_time, measure
 
 logger = logging.getLogger(__name__)
-setup_logger(logger)
 
 
 @singledispatch
@@ -65,35 +68,128 @@ class AsyncGenJSONListPayload(Payload):
     """
     Итерируется по объектам AsyncIterable, частями сериализует данные из них
     в JSON и отправляет клиенту.
+
+    Элементы могут быть как объектами для сериализации, так и уже готовыми
+    JSON в виде bytes. После списка дописывается количество элементов и поля,
+    которые вернет trailer (вызывается, когда список закончился):
+    {"data": [...], "count": N, ...}.
     """
+    # Размер части ответа, которая отправляется клиенту за один раз
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, value, encoding: str = 'utf-8',
                  content_type: str = 'application/json',
                  root_object: str = 'data',
+                 count_object: str = 'count',
+                 trailer: Callable[[], Mapping] | None = None,
                  *args, **kwargs):
         self.root_object = root_object
+        self.count_object = count_object
+        self.trailer = trailer
         super().__init__(value, content_type=content_type, encoding=encoding,
                          *args, **kwargs)
 
     async def write(self, writer):
         # Начало объекта
-        await writer.write(
-            ('{"%s":[' % self.root_object).encode(self._encoding)
-        )
+        buffer = bytearray(('{"%s":[' % self.root_object).encode(self._encoding))
 
-        first = True
+        count = 0
+        # Время сборки тела без ожидания строчек и отправки, для фазы encode в Server-Timing
+        encode = 0.0
         async for row in self._value:
-            # Перед первой строчкой запятая не нужнаа
-            if not first:
-                await writer.write(b',')
+            start = time.perf_counter()
+            # Перед первой строчкой запятая не нужна
+            if count:
+                buffer += b','
+            count += 1
+
+            if isinstance(row, bytes):
+                buffer += row
             else:
-                first = False
+                buffer += dumps(row).encode(self._encoding)
+            encode += time.perf_counter() - start
 
-            await writer.write(dumps(row).encode(self._encoding))
+            # Первую строчку отправляем сразу, остальные - частями по CHUNK_SIZE
+            if count == 1 or len(buffer) >= self.CHUNK_SIZE:
+                await writer.write(bytes(buffer))
+                buffer.clear()
 
         # Конец объекта
-        await writer.write(b']}')
+        start = time.perf_counter()
+        buffer += ('],"%s":%d' % (self.count_object, count)).encode(self._encoding)
+        if self.trailer is not None:
+            for key, value in self.trailer().items():
+                buffer += (',%s:%s' % (dumps(key), dumps(value))).encode(self._encoding)
+        buffer += b'}'
+        add_time('encode', encode + time.perf_counter() - start)
+        await writer.write(bytes(buffer))
+
+
+def json_list_body(rows: list[bytes],
+                   root_object: str = 'data',
+                   count_object: str = 'count',
+                   trailer: Mapping | None = None) -> bytes:
+    """
+    То же, что отправляет AsyncGenJSONListPayload, но целиком (для уже сериализованных строчек).
+    """
+    with measure('encode'):
+        body = b'{"%s":[%s],"%s":%d' % (root_object.encode(), b','.join(rows), count_object.encode(), len(rows))
+        if trailer:
+            body += b''.join((',%s:%s' % (dumps(key), dumps(value))).encode() for key, value in trailer.items())
+        return body + b'}'
+
+
+_END = object()
+
+
+async def _chain(first, rows: AsyncIterator) -> AsyncIterator:
+    if first is _END:
+        return
+    yield first
+    async for row in rows:
+        yield row
+
+
+async def stream_json_list(request: web.Request,
+                           rows: AsyncIterable,
+                           response: web.StreamResponse | None = None,
+                           trailer: Callable[[], Mapping] | None = None) -> web.StreamResponse:
+    """
+    Отправляет клиенту JSON список, сериализуя элементы по мере их получения.
+
+    Ответ пишется внутри обработчика, поэтому сессия базы данных запроса
+    остается открытой, пока не будет отправлена последняя строчка.
+
+    Первый элемент получается до отправки заголовков: запрос к базе уже выполнен, поэтому
+    его ошибка превращается в обычный ответ с ошибкой, а время попадает в Server-Timing.
+    """
+    if response is None:
+        response = web.StreamResponse()
+    rows = aiter(rows)
+    first = await anext(rows, _END)
+    payload = AsyncGenJSONListPayload(_chain(first, rows), trailer=trailer)
+    response.content_type = payload.content_type
+    await response.prepare(request)
+    try:
+        await payload.write(response)
+        await response.write_eof()
+    except Exception as e:
+        abort_response(request, e)
+    return response
+
+
+def abort_response(request: web.Request, error: Exception):
+    """
+    Обрывает соединение, если ошибка случилась после отправки заголовков ответа. Отправить
+    ответ с ошибкой уже нельзя, а оборванный ответ клиент не примет за полный (у потокового
+    ответа нет последней части chunked). Ошибка не передается в error_middleware,
+    который попытался бы отправить второй ответ.
+    """
+    logger.exception('response aborted after headers were sent: %r', error, exc_info=error)
+    if request.transport is not None:
+        request.transport.abort()
 
 
 __all__ = (
-    'JsonPayload', 'AsyncGenJSONListPayload'
+    'JsonPayload', 'AsyncGenJSONListPayload', 'json_list_body', 'stream_json_list', 'abort_response'
 )
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import sqlalchemy as sa
+from aiohttp import web
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+REPLICA_CHECK_INTERVAL = 1  # секунд между проверками реплик
+REPLICA_CHECK_TIMEOUT = 2  # секунд на ответ реплики, после которых она считается недоступной
+
+# Cookie с позицией в WAL последней записи клиента
+LSN_COOKIE = 'sportsmap_lsn'
+LSN_COOKIE_MAX_AGE = 30  # секунд, в течение которых чтения клиента не отстают от его записей
+
+REPLAY_LSN_SQL = sa.text(
+    'SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_insert_lsn() END::text'
+)
+WRITE_LSN_SQL = sa.text('SELECT pg_current_wal_insert_lsn()::text')
+
+
+def parse_lsn(lsn: str) -> int:
+    """
+    Позиция в WAL в текстовом виде Postgres ("16/B374D848") как число.
+    :raise ValueError: если строка не является позицией в WAL
+    """
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def format_lsn(lsn: int) -> str:
+    return f'{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}'
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.healthy = False
+        # Позиция в WAL, до которой реплика применила изменения на момент последней проверки
+        self.replay_lsn = 0
+
+
+class ReplicaSet:
+    """
+    Реплики базы данных для чтения.
+
+    Реплики периодически проверяются: недоступные исключаются, у доступных запоминается позиция
+    в WAL, до которой они применили изменения основной базы. Запрос уходит на реплику, только если
+    она уже применила нужную позицию - последнюю запись этого процесса и, если передана, последнюю
+    запись клиента. Иначе запрос выполняется на основной базе. Подходящие реплики выбираются по кругу.
+    """
+    def __init__(self, engines: list[AsyncEngine]):
+        self.replicas = [Replica(engine) for engine in engines]
+        self._next = 0
+        # Последняя запись в основную базу, сделанная этим процессом. Пока ее не применит реплика,
+        # с нее нельзя читать: иначе кеши процесса заполнились бы данными до изменения
+        self.last_write_lsn = 0
+
+    def choose(self, min_lsn: int = 0) -> AsyncEngine | None:
+        """
+        Следующая по кругу доступная реплика, применившая изменения до позиции min_lsn,
+        или None, если такой нет.
+        """
+        min_lsn = max(min_lsn, self.last_write_lsn)
+        count = len(self.replicas)
+        for i in range(count):
+            replica = self.replicas[(self._next + i) % count]
+            if replica.healthy and replica.replay_lsn >= min_lsn:
+                self._next = (self._next + i + 1) % count
+                return replica.engine
+        return None
+
+    def written(self, lsn: int):
+        self.last_write_lsn = max(self.last_write_lsn, lsn)
+
+    async def _check(self, replica: Replica):
+        try:
+            async with replica.engine.connect() as conn:
+                lsn = await asyncio.wait_for(conn.scalar(REPLAY_LSN_SQL), REPLICA_CHECK_TIMEOUT)
+            # Позиция может быть пустой, пока реплика не применила ни одной записи
+            replica.replay_lsn = parse_lsn(lsn) if lsn is not None else 0
+            if not replica.healthy:
+                logger.info('replica %r is available', replica.engine.url)
+            replica.healthy = True
+        except Exception as e:
+            if replica.healthy:
+                logger.warning('replica %r is unavailable: %r', replica.engine.url, e)
+            replica.healthy = False
+
+    async def check(self):
+        await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+
+    async def run_checks(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+def request_lsn(request: web.Request) -> int:
+    """
+    Позиция последней записи клиента из cookie, 0 если ее нет или она некорректна.
+    """
+    try:
+        return parse_lsn(request.cookies[LSN_COOKIE])
+    except (KeyError, ValueError):
+        return 0
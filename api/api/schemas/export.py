@@ -0,0 +1,7 @@
+from marshmallow import Schema, fields, validate
+
+from api.export import EXPORT_FORMATS, NDJSON
+
+
+class ExportQuery(Schema):
+    format = fields.Str(load_default=NDJSON, validate=validate.OneOf(EXPORT_FORMATS))  # ndjson, csv, geojson или arrow
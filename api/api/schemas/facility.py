@@ -1,6 +1,17 @@
-from marshmallow import Schema, fields
-
-from db.facility import FacilityTypes, FacilityPayingTypes, FacilityCoveringTypes, FacilityPropertyForms
+from marshmallow import Schema, ValidationError, fields, validate, validates_schema
+
+from db.facility import (
+    FILTER_COLUMNS,
+    KEYSET_COLUMNS,
+    RANK_ORDER,
+    FacilityTypes,
+    FacilityPayingTypes,
+    FacilityCoveringTypes,
+    FacilityPropertyForms
+)
+from db.facility_bulk import MAX_BULK_SIZE
+from api.importer import IMPORT_FORMATS
+from api.suggest import MAX_PREFIX_LENGTH, MAX_SUGGEST_LIMIT, SUGGEST_LIMIT
 
 
 class FacilityRequest(Schema):
@@ -88,24 +99,153 @@ class FacilityResponse(Schema):
 class FacilityResponseList(Schema):
     count = fields.Int(required=True, nullable=False)
     data = fields.List(fields.Nested(FacilityResponse()), required=True, nullable=False)
+    next_cursor = fields.Str(allow_none=True)  # курсор следующей страницы поиска (null - страниц больше нет)
 
 
 class FieldFilter(Schema):
-    field = fields.Str()
+    field = fields.Str(required=True, validate=validate.OneOf(FILTER_COLUMNS))
     eq = fields.Str()
-    lt = fields.Number()
-    gt = fields.Number()
+    lt = fields.Number()  # field <= lt
+    gt = fields.Number()  # field >= gt
+
+    @validates_schema
+    def validate_condition(self, data, **kwargs):
+        # Фильтр без условий подходит ко всем объектам, массовое удаление с ним удалило бы весь каталог
+        if not any(key in data for key in ('eq', 'lt', 'gt')):
+            raise ValidationError('filter requires at least one of eq, lt, gt')
 
 
 class SearchQuery(Schema):
-    q = fields.Str()
+    q = fields.Str()  # полнотекстовый поиск по имени, владельцу, примечаниям, пользователям и режиму работы
     limit = fields.Int()
     offset = fields.Int()
-    order_by = fields.Str()
+    cursor = fields.Str()  # next_cursor предыдущей страницы, заменяет offset
+    order_by = fields.Str()  # колонка или rank - по релевантности к q
     order_desc = fields.Bool()
 
     filters = fields.List(fields.Nested(FieldFilter()))
 
+    @validates_schema
+    def validate_rank(self, data, **kwargs):
+        if data.get('order_by') == RANK_ORDER and not data.get('q'):
+            raise ValidationError(f'order_by={RANK_ORDER} requires q', 'order_by')
+
+    @validates_schema
+    def validate_cursor(self, data, **kwargs):
+        if 'cursor' in data and data.get('order_by') not in KEYSET_COLUMNS:
+            raise ValidationError(
+                f'cursor is supported only for order_by in {[c for c in KEYSET_COLUMNS if c]}', 'cursor'
+            )
+
 
 class FacilityHiddenRequest(Schema):
     hidden = fields.Bool(required=True, nullable=False)
+
+
+class BBoxQuery(Schema):
+    min_x = fields.Float(required=True, nullable=False)
+    min_y = fields.Float(required=True, nullable=False)
+    max_x = fields.Float(required=True, nullable=False)
+    max_y = fields.Float(required=True, nullable=False)
+
+    @validates_schema
+    def validate_bbox(self, data, **kwargs):
+        if data['min_x'] > data['max_x']:
+            raise ValidationError('min_x must be less than or equal to max_x', 'min_x')
+        if data['min_y'] > data['max_y']:
+            raise ValidationError('min_y must be less than or equal to max_y', 'min_y')
+
+
+class ClusterQuery(BBoxQuery):
+    zoom = fields.Int(required=True, nullable=False, validate=validate.Range(min=0, max=30))  # масштаб карты
+
+
+class ClusterResponse(Schema):
+    x = fields.Float(required=True, nullable=False)  # центроид кластера
+    y = fields.Float(required=True, nullable=False)
+    count = fields.Int(required=True, nullable=False)  # количество объектов в кластере
+    types = fields.Dict(keys=fields.Str(), values=fields.Int())  # количество объектов по типам
+
+
+class ClusterResponseList(Schema):
+    count = fields.Int(required=True, nullable=False)
+    data = fields.List(fields.Nested(ClusterResponse()), required=True, nullable=False)
+
+
+class SuggestQuery(Schema):
+    prefix = fields.Str(required=True, nullable=False, validate=validate.Length(min=1, max=MAX_PREFIX_LENGTH))
+    limit = fields.Int(load_default=SUGGEST_LIMIT, validate=validate.Range(min=1, max=MAX_SUGGEST_LIMIT))
+
+
+class SuggestResponse(Schema):
+    id = fields.UUID(required=True, nullable=False)
+    name = fields.Str(required=True, nullable=False)  # имя объекта
+
+
+class SuggestResponseList(Schema):
+    count = fields.Int(required=True, nullable=False)
+    data = fields.List(fields.Nested(SuggestResponse()), required=True, nullable=False)
+
+
+class BatchRequest(Schema):
+    ids = fields.List(fields.UUID(), required=True, validate=validate.Length(min=1, max=500))  # id объектов
+
+
+class BatchResponse(Schema):
+    count = fields.Int(required=True, nullable=False)
+    data = fields.List(fields.Nested(FacilityResponse()), required=True, nullable=False)  # в порядке ids
+    missing = fields.List(fields.UUID(), required=True, nullable=False)  # id, объектов с которыми нет
+
+
+class BulkPatch(FacilityUpdateRequest):
+    class Meta:
+        # Одинаковые имя или координаты у многих объектов не имеют смысла
+        exclude = ('name', 'x', 'y')
+
+
+class BulkDeleteRequest(Schema):
+    ids = fields.List(fields.UUID(), validate=validate.Length(min=1, max=MAX_BULK_SIZE))  # id объектов
+    q = fields.Str(validate=validate.Length(min=1))  # условия, как в SearchQuery, вместо ids
+    filters = fields.List(fields.Nested(FieldFilter()), validate=validate.Length(min=1))
+    limit = fields.Int(  # сколько объектов можно изменить, если подходит больше - запрос не выполняется
+        load_default=MAX_BULK_SIZE, validate=validate.Range(min=1, max=MAX_BULK_SIZE)
+    )
+    dry_run = fields.Bool(load_default=False)  # только посчитать подходящие объекты
+
+    @validates_schema
+    def validate_selection(self, data, **kwargs):
+        if ('ids' in data) == ('q' in data or 'filters' in data):
+            raise ValidationError('either ids or q/filters must be set', 'ids')
+
+
+class BulkUpdateRequest(BulkDeleteRequest):
+    patch = fields.Nested(BulkPatch(), required=True)  # новые значения полей
+
+    @validates_schema
+    def validate_patch(self, data, **kwargs):
+        if not data.get('patch'):
+            raise ValidationError('patch must not be empty', 'patch')
+
+
+class BulkResponse(Schema):
+    count = fields.Int(required=True, nullable=False)  # объектов изменено (при dry_run - подходит)
+    ids = fields.List(fields.UUID(), required=True, nullable=False)  # id измененных объектов (при dry_run пуст)
+    dry_run = fields.Bool(required=True, nullable=False)
+
+
+class ImportQuery(Schema):
+    format = fields.Str(validate=validate.OneOf(IMPORT_FORMATS))  # формат файла, по умолчанию по Content-Type
+
+
+class ImportRowError(Schema):
+    row = fields.Int(required=True, nullable=False)  # номер строчки, начиная с 1 (без заголовка CSV)
+    errors = fields.Dict(keys=fields.Str(), values=fields.List(fields.Str()))  # ошибки полей
+
+
+class ImportResponse(Schema):
+    received = fields.Int(required=True, nullable=False)  # строчек в файле
+    inserted = fields.Int(required=True, nullable=False)  # добавлено объектов
+    updated = fields.Int(required=True, nullable=False)  # обновлено объектов
+    unchanged = fields.Int(required=True, nullable=False)  # объекты совпали с сохраненными
+    failed = fields.Int(required=True, nullable=False)  # строчек с ошибками
+    errors = fields.List(fields.Nested(ImportRowError()), required=True, nullable=False)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from typing import Any, Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class SnapshotIndex:
+    """
+    Структура данных в памяти, которая строится из снимка таблицы facility при первом обращении
+    (ensure_loaded), а дальше поддерживается по уведомлениям об изменениях объектов (см. api.changes).
+
+    Подкласс читает снимок в _read, заполняет структуру в _build и очищает ее в _clear.
+    Об изменениях, пришедших до окончания загрузки, подкласс сообщает через _changed:
+    такие объекты свежее снимка и при заполнении пропускаются.
+    """
+    def __init__(self):
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._changed_while_loading: set[uuid.UUID] = set()
+        # Увеличивается при каждом сбросе, чтобы не сохранить снимок, прочитанный до сброса
+        self._generation = 0
+
+    async def ensure_loaded(self, session: AsyncSession):
+        if self._loaded:
+            return
+        async with self._lock:
+            while not self._loaded:
+                generation = self._generation
+                self._changed_while_loading.clear()
+                rows = await self._read(session)
+                if generation != self._generation:
+                    # Сброс во время загрузки: в снимке может не оказаться изменений, о которых процесс не узнал
+                    continue
+                self._build(rows, self._changed_while_loading)
+                self._changed_while_loading.clear()
+                self._loaded = True
+
+    def reset(self):
+        """
+        Забывает все, что знал об объектах: структура строится заново при следующем обращении.
+        """
+        self._generation += 1
+        self._clear()
+        self._loaded = False
+
+    def _changed(self, ids: Iterable[uuid.UUID]):
+        if not self._loaded:
+            self._changed_while_loading.update(ids)
+
+    async def _read(self, session: AsyncSession) -> Iterable[Any]:
+        raise NotImplementedError
+
+    def _build(self, rows: Iterable[Any], skip: set[uuid.UUID]):
+        """
+        Заполняет структуру строчками снимка, кроме объектов из skip.
+        """
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
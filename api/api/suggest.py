@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import uuid
+from typing import Iterable, Iterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.changes import Change, FacilityState
+from api.snapshot import SnapshotIndex
+from db.facility import Facility
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_LIMIT = 10  # подсказок по умолчанию
+MAX_SUGGEST_LIMIT = 50
+MAX_PREFIX_LENGTH = 100
+
+
+def normalize(text: str) -> str:
+    """
+    Приведение имени и введенного текста к общему виду: регистр, ё и лишние пробелы не важны.
+    """
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def _word_suffixes(name: str) -> Iterator[str]:
+    """
+    Хвосты нормализованного имени, начинающиеся с каждого слова: "бассейн дельфин", "дельфин".
+    """
+    words = normalize(name).split(' ')
+    for i in range(len(words)):
+        yield ' '.join(words[i:])
+
+
+class FacilitySuggest(SnapshotIndex):
+    """
+    Подсказки имен видимых спортивных объектов по введенному началу слова.
+
+    Хранит отсортированный массив хвостов имен (с начала каждого слова), поэтому поиск по префиксу -
+    это двоичный поиск и просмотр соседних элементов, без запроса к базе. Массив строится один раз
+    при первом обращении (ensure_loaded) и поддерживается инкрементально после изменений объектов.
+    """
+    def __init__(self):
+        super().__init__()
+        # (хвост имени, id) в порядке сортировки
+        self._keys: list[tuple[str, uuid.UUID]] = []
+        self._names: dict[uuid.UUID, str] = {}
+
+    async def _read(self, session: AsyncSession) -> Iterable[tuple]:
+        return await Facility.get_visible_names(session)
+
+    def _build(self, rows: Iterable[tuple], skip: set[uuid.UUID]):
+        for id, name in rows:
+            if id not in skip and id not in self._names:
+                self._names[id] = name
+                self._keys.extend((suffix, id) for suffix in _word_suffixes(name))
+        self._keys.sort()
+        logger.info('suggest index is built for %d facilities', len(self._names))
+
+    def _clear(self):
+        self._keys = []
+        self._names.clear()
+
+    def facility_changed(self, before: FacilityState | None, after: FacilityState | None):
+        id = before.id if after is None else after.id
+        self._changed([id])
+        if after is None or after.hidden:
+            self._set(id, None)
+        else:
+            self._set(id, after.name)
+
+    def facilities_changed(self, changes: list[Change]):
+        """
+        Массовое изменение: один проход по массиву и сортировка вместо вставки каждого хвоста по отдельности.
+        """
+        names = {}
+        for before, after in changes:
+            id = before.id if after is None else after.id
+            names[id] = None if after is None or after.hidden else after.name
+        self._changed(names)
+
+        self._keys = [key for key in self._keys if key[1] not in names]
+        for id, name in names.items():
+            if name is None:
+                self._names.pop(id, None)
+            else:
+                self._names[id] = name
+                self._keys.extend((suffix, id) for suffix in _word_suffixes(name))
+        self._keys.sort()
+
+    def _set(self, id: uuid.UUID, name: str | None):
+        old = self._names.pop(id, None)
+        if old is not None:
+            for suffix in _word_suffixes(old):
+                i = bisect.bisect_left(self._keys, (suffix, id))
+                if i < len(self._keys) and self._keys[i] == (suffix, id):
+                    del self._keys[i]
+        if name is not None:
+            self._names[id] = name
+            for suffix in _word_suffixes(name):
+                bisect.insort(self._keys, (suffix, id))
+
+    def get(self, prefix: str, limit: int = SUGGEST_LIMIT) -> list[tuple[uuid.UUID, str]]:
+        """
+        До limit объектов (id, name), в имени которых есть слово, начинающееся с prefix.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        result = {}
+        i = bisect.bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(result) < limit:
+            suffix, id = self._keys[i]
+            if not suffix.startswith(prefix):
+                break
+            result.setdefault(id, self._names[id])
+            i += 1
+        return list(result.items())
+
+    def __len__(self) -> int:
+        return len(self._names)
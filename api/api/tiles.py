@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+from typing import Callable, NamedTuple
+
+from aiohttp import web
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.cache import LRUCache
+from api.changes import Change, FacilityState
+from db.facility import Facility
+
+logger = logging.getLogger(__name__)
+
+MAX_ZOOM = 20
+MAX_LATITUDE = 85.0511287798  # граница проекции Web Mercator
+TILES_CACHE_SIZE = 4096  # количество тайлов в памяти
+
+
+def tile_bbox(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """
+    Границы тайла (min_x, min_y, max_x, max_y) в градусах, x - долгота, y - широта.
+    Нумерация тайлов как у OpenStreetMap (Web Mercator, y растет к югу).
+    """
+    n = 1 << z
+
+    def lat(tile_y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def point_tile(z: int, lon: float, lat: float) -> tuple[int, int]:
+    """
+    Номер тайла масштаба z, в который попадает точка.
+    """
+    n = 1 << z
+    lat = math.radians(max(-MAX_LATITUDE, min(lat, MAX_LATITUDE)))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)
+    return max(0, min(x, n - 1)), max(0, min(y, n - 1))
+
+
+class Tile(NamedTuple):
+    body: bytes
+    etag: str
+
+    @staticmethod
+    def of(body: bytes) -> Tile:
+        return Tile(body=body, etag='"%s"' % hashlib.sha1(body).hexdigest())
+
+
+def _marker(state: FacilityState) -> tuple:
+    return state.x, state.y, state.type, state.hidden
+
+
+class TileStore:
+    """
+    Тайлы с маркерами видимых спортивных объектов.
+
+    Тайл строится из таблицы facility один раз, после чего хранится в LRU кеше в памяти
+    и (если задан каталог) на диске. При изменении объекта сбрасываются только тайлы,
+    в которые объект попадал до и после изменения.
+
+    Объект попадает ровно в один тайл каждого масштаба - тот, который вернет point_tile,
+    в том числе если лежит на границе тайлов: по тому же правилу тайлы и строятся, и сбрасываются.
+    """
+    def __init__(self, directory: str | None = None, cache_size: int = TILES_CACHE_SIZE):
+        self.directory = directory
+        self._cache = LRUCache(cache_size)
+        # Увеличивается при каждом сбросе, чтобы не сохранить тайл, построенный до изменения
+        self._generation = 0
+        # Удаление тайлов с диска после сброса; пока оно идет, тайлы с диска не читаются
+        self._clearing: asyncio.Future | None = None
+
+    async def get(self, session: AsyncSession, z: int, x: int, y: int) -> Tile:
+        key = (z, x, y)
+        tile = self._cache.get(key)
+        if tile is not None:
+            return tile
+
+        if self._clearing is not None:
+            await asyncio.shield(self._clearing)
+        generation = self._generation
+        loop = asyncio.get_running_loop()
+
+        body = None
+        if self.directory:
+            body = await loop.run_in_executor(None, self._read, key)
+        if body is None:
+            body = await self._build(session, z, x, y)
+            if self.directory and generation == self._generation:
+                await loop.run_in_executor(None, self._write, key, body)
+                if generation != self._generation:
+                    # объект изменился, пока тайл записывался на диск
+                    self._remove({key})
+
+        tile = Tile.of(body)
+        if generation == self._generation:
+            self._cache.set(key, tile)
+        return tile
+
+    @staticmethod
+    async def _build(session: AsyncSession, z: int, x: int, y: int) -> bytes:
+        points = await Facility.get_visible_points(session, bbox=tile_bbox(z, x, y))
+        # Область тайла включает границы, поэтому в нее попадают и объекты с границы соседних тайлов
+        markers = [
+            [str(id), px, py, type.value if type is not None else None]
+            for id, px, py, type in sorted(points, key=lambda p: p.id)
+            if point_tile(z, px, py) == (x, y)
+        ]
+        return json.dumps({
+            'fields': ['id', 'x', 'y', 'type'],
+            'markers': markers,
+        }, separators=(',', ':')).encode()
+
+    def facility_changed(self, before: FacilityState | None, after: FacilityState | None):
+        self.facilities_changed([(before, after)])
+
+    def facilities_changed(self, changes: list[Change]):
+        touched = set()
+        for before, after in changes:
+            if before is not None and after is not None and _marker(before) == _marker(after):
+                continue
+            for state in (before, after):
+                if state is None or state.hidden:
+                    continue
+                for z in range(MAX_ZOOM + 1):
+                    touched.add((z, *point_tile(z, state.x, state.y)))
+        if not touched:
+            return
+
+        self._generation += 1
+        for key in touched:
+            self._cache.delete(key)
+        if self.directory:
+            # По файлу на масштаб на каждое положение объекта: удаляются в пуле потоков,
+            # а пока удаление идет, get не читает тайлы с диска
+            self._remove_later(self._remove, touched)
+
+    def reset(self):
+        """
+        Сбрасывает все тайлы, в том числе на диске (удаляются в пуле потоков).
+        """
+        self._generation += 1
+        self._cache.clear()
+        if self.directory:
+            self._remove_later(self._remove_all)
+
+    async def clear(self):
+        """
+        То же, что reset, но дожидается удаления тайлов с диска. Вызывается при запуске: тайлы на диске
+        могли устареть, пока процесс не работал, а сбросить их было некому.
+        """
+        self.reset()
+        if self._clearing is not None:
+            await self._clearing
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    def _remove_later(self, remove: Callable, *args):
+        # Удаления выполняются по очереди: get ждет только последнего, а значит, и всех предыдущих
+        previous = self._clearing
+        loop = asyncio.get_running_loop()
+
+        async def run():
+            if previous is not None:
+                await previous
+            await loop.run_in_executor(None, remove, *args)
+        self._clearing = asyncio.ensure_future(run())
+
+    def _path(self, key: tuple[int, int, int]) -> str:
+        z, x, y = key
+        return os.path.join(self.directory, str(z), str(x), f'{y}.json')
+
+    def _read(self, key: tuple[int, int, int]) -> bytes | None:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: tuple[int, int, int], body: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл, чтобы параллельное чтение не увидело половину тайла
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def _remove(self, keys: set[tuple[int, int, int]]):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning('cannot remove tile %s: %r', key, e)
+
+    def _remove_all(self):
+        # Удаляется содержимое каталога, а не он сам: каталог может быть точкой монтирования
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # Кеш не должен останавливать чтение тайлов, оставшиеся файлы удалит следующий сброс
+                logger.warning('cannot remove %s: %r', path, e)
+
+
+async def clear_tiles(app: web.Application):
+    await app['tiles'].clear()
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator
+
+import sqlalchemy as sa
+from aiohttp import web
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Фазы обработки запроса в заголовке Server-Timing:
+# db - выполнение запросов и получение строчек из базы, orm - SQLAlchemy вне базы (компиляция запроса,
+# подготовка результата), serialize - объекты в JSON, encode - сборка тела ответа
+PHASES = ('db', 'orm', 'serialize', 'encode')
+# Ключ execution_options с формой запроса (какие условия заданы, без значений) для журнала медленных запросов
+SHAPE_OPTION = 'shape'
+SLOW_QUERY_MAX_LENGTH = 2000  # символов запроса в журнале медленных запросов
+
+
+class RequestTiming:
+    """
+    Время фаз обработки одного запроса, количество запросов к базе и самый медленный из них.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.slowest = 0.0
+        self.slowest_statement: str | None = None
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] += seconds
+
+    def query(self, statement: str, seconds: float):
+        self.queries += 1
+        self.phases['db'] += seconds
+        if seconds > self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement
+
+    def server_timing(self) -> str:
+        """
+        Значение заголовка Server-Timing: фазы и общее время с начала запроса в миллисекундах.
+        """
+        metrics = [
+            f'{phase};dur={seconds * 1000:.2f}' + (f';desc="{self.queries} queries"' if phase == 'db' else '')
+            for phase, seconds in self.phases.items()
+        ]
+        metrics.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+_current: ContextVar[RequestTiming | None] = ContextVar('request_timing', default=None)
+
+
+@contextmanager
+def request_timing(request: web.Request) -> Iterator[RequestTiming]:
+    """
+    Время фаз запроса собирается в request['timing'], пока открыт контекст. События движка и measure
+    находят его через contextvar, поэтому слоям ниже обработчика запрос передавать не нужно.
+    """
+    timing = request['timing'] = RequestTiming()
+    token = _current.set(timing)
+    try:
+        yield timing
+    finally:
+        # Запросы одного keep-alive соединения выполняются в одной задаче, контекст нужно вернуть
+        _current.reset(token)
+
+
+def add_time(phase: str, seconds: float):
+    timing = _current.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def measure(phase: str) -> Iterator[None]:
+    """
+    Прибавляет время выполнения блока к фазе текущего запроса (вне запроса ничего не делает).
+    """
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(phase, time.perf_counter() - start)
+
+
+def instrument_engine(engine: sa.engine.Engine, slow_query_ms: float | None = None, slow_query_sample: float = 1):
+    """
+    Подключает к движку учет запросов в RequestTiming текущего запроса и журнал медленных запросов.
+    :param slow_query_ms: запросы дольше этого пишутся в журнал (None - не пишутся)
+    :param slow_query_sample: доля медленных запросов, которые попадают в журнал
+    """
+    @event.listens_for(engine, 'before_execute')
+    def before_execute(conn, clauseelement, multiparams, params, execution_options):
+        timing = _current.get()
+        if timing is not None:
+            conn.info.setdefault('timing_execute', []).append((time.perf_counter(), timing.phases['db']))
+
+    @event.listens_for(engine, 'after_execute')
+    def after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+        timing = _current.get()
+        stack = conn.info.get('timing_execute')
+        if timing is not None and stack:
+            start, db = stack.pop()
+            # Время SQLAlchemy вокруг запроса за вычетом самого запроса в базе
+            timing.add('orm', time.perf_counter() - start - (timing.phases['db'] - db))
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('timing_cursor', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # after_* событий после ошибки не будет
+        if context.connection is not None:
+            context.connection.info.pop('timing_execute', None)
+            context.connection.info.pop('timing_cursor', None)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['timing_cursor'].pop()
+        timing = _current.get()
+        if timing is not None:
+            timing.query(statement, seconds)
+        if slow_query_ms is not None and seconds * 1000 >= slow_query_ms and random.random() < slow_query_sample:
+            shape = context.execution_options.get(SHAPE_OPTION) if context is not None else None
+            logger.warning(
+                'slow query %.1f ms%s: %s',
+                seconds * 1000, f' [{shape}]' if shape else '', statement[:SLOW_QUERY_MAX_LENGTH]
+            )
+
+
+async def timed_partitions(partitions: AsyncIterator[list]) -> AsyncIterator[list]:
+    """
+    Пачки строчек серверного курсора. Следующие пачки забираются из базы без событий движка,
+    поэтому ожидание каждой пачки (кроме уже учтенного событиями) прибавляется к фазе db.
+    """
+    timing = _current.get()
+    while True:
+        start = time.perf_counter()
+        counted = timing.phases['db'] + timing.phases['orm'] if timing is not None else 0
+        try:
+            rows = await partitions.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            if timing is not None:
+                counted = timing.phases['db'] + timing.phases['orm'] - counted
+                timing.add('db', time.perf_counter() - start - counted)
+        yield rows
+
+
+async def add_server_timing(request: web.Request, response: web.StreamResponse):
+    """
+    Обработчик on_response_prepare: заголовок отправляется вместе с началом ответа, поэтому
+    у потоковых ответов в нем только то, что было сделано до отправки первой части.
+    """
+    timing = request.get('timing')
+    if timing is not None:
+        response.headers['Server-Timing'] = timing.server_timing()
@@ -0,0 +1,9 @@
+"""
+Замеры производительности, запускаются вручную:
+
+python3 -m benchmarks.micro
+python3 -m benchmarks.serializer
+API_DB_URL=... python3 -m benchmarks.read_path
+API_DB_URL=... python3 -m benchmarks.dataset --size 100k
+API_DB_URL=... python3 -m benchmarks.load --output load.json
+"""
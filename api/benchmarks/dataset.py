@@ -0,0 +1,259 @@
+"""
+Синтетический набор спортивных объектов для нагрузочных замеров (benchmarks.load).
+
+Набор детерминирован: одинаковые --size и --seed дают одинаковые объекты с одинаковыми id,
+поэтому замеры на разных машинах и в разных версиях идут на одних и тех же данных.
+Объекты похожи на настоящие: координаты сгущаются вокруг районов Санкт-Петербурга,
+значения перечислений распределены неравномерно (площадок и залов больше, чем тиров),
+часть необязательных полей не заполнена.
+
+Объекты набора отмечены ссылкой (link), которая начинается с DATASET_LINK, перед загрузкой
+объекты прошлого набора удаляются. Остальные объекты в базе не затрагиваются.
+Нужна база с примененными миграциями (API_DB_URL).
+
+Пример использования:
+
+API_DB_URL=... python3 -m benchmarks.dataset --size 100k --seed 0
+API_DB_URL=... python3 -m benchmarks.dataset --clear
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Iterator, NamedTuple
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from db.facility import FacilityCoveringTypes, FacilityPayingTypes, FacilityPropertyForms, FacilityTypes
+from db.facility_import import CONVERTERS, COPY_COLUMNS
+from settings import Settings
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+COPY_BATCH_SIZE = 10_000  # строчек в одном COPY
+
+# Ссылка, по которой объекты набора отличаются от остальных
+DATASET_LINK = 'https://sportsmap.example/benchmark/'
+
+
+class District(NamedTuple):
+    name: str
+    x: float  # центр района: долгота
+    y: float  # и широта
+    spread: float  # стандартное отклонение координат от центра в градусах долготы
+    weight: float  # доля объектов района
+
+
+DISTRICTS = (
+    District('Центральный', 30.36, 59.932, 0.018, 10),
+    District('Адмиралтейский', 30.30, 59.915, 0.015, 6),
+    District('Василеостровский', 30.25, 59.940, 0.020, 7),
+    District('Петроградский', 30.30, 59.965, 0.015, 6),
+    District('Приморский', 30.25, 60.000, 0.035, 12),
+    District('Выборгский', 30.33, 60.040, 0.040, 9),
+    District('Калининский', 30.41, 60.000, 0.025, 9),
+    District('Красногвардейский', 30.45, 59.960, 0.025, 7),
+    District('Невский', 30.46, 59.880, 0.035, 10),
+    District('Фрунзенский', 30.39, 59.860, 0.025, 8),
+    District('Московский', 30.32, 59.850, 0.025, 7),
+    District('Кировский', 30.25, 59.870, 0.025, 7),
+    District('Красносельский', 30.12, 59.840, 0.040, 6),
+    District('Колпинский', 30.58, 59.750, 0.030, 2),
+    District('Пушкинский', 30.40, 59.720, 0.030, 2),
+    District('Петродворцовый', 29.90, 59.880, 0.040, 1.5),
+    District('Курортный', 29.95, 60.150, 0.060, 1),
+    District('Кронштадтский', 29.77, 60.000, 0.010, 0.5),
+)
+# Доля объектов, разбросанных равномерно по области вокруг города (не в районах)
+SCATTERED_SHARE = 0.03
+SCATTERED_BBOX = (29.6, 59.6, 30.8, 60.25)  # x1, y1, x2, y2
+
+# Значения перечислений с весами: распределение сильно неравномерное, как у настоящих объектов
+TYPE_WEIGHTS = {
+    FacilityTypes.Flat: 38,
+    FacilityTypes.Gym: 26,
+    FacilityTypes.Outdoor: 14,
+    FacilityTypes.Other: 10,
+    FacilityTypes.Pool: 6,
+    FacilityTypes.SkatingRink: 5,
+    FacilityTypes.Shooting: 1,
+}
+PROPERTY_FORM_WEIGHTS = {
+    FacilityPropertyForms.Municipal: 45,
+    FacilityPropertyForms.RussianFederationSubject: 25,
+    FacilityPropertyForms.Private: 20,
+    FacilityPropertyForms.Federal: 6,
+    FacilityPropertyForms.Other: 4,
+}
+COVERING_TYPE_WEIGHTS = {
+    FacilityCoveringTypes.Synthetic: 40,
+    FacilityCoveringTypes.RubberTile: 25,
+    FacilityCoveringTypes.Polymer: 15,
+    FacilityCoveringTypes.Printed: 12,
+    FacilityCoveringTypes.RubberBitumen: 8,
+}
+PAYING_TYPE_WEIGHTS = {
+    FacilityPayingTypes.FullFree: 50,
+    FacilityPayingTypes.PartlyFree: 30,
+    FacilityPayingTypes.NotFree: 20,
+}
+# Покрытие есть только у открытых площадок
+COVERED_TYPES = (FacilityTypes.Flat, FacilityTypes.Outdoor)
+
+TYPE_TITLES = {
+    FacilityTypes.Flat: ('Спортивная площадка', 'Плоскостное сооружение', 'Футбольное поле'),
+    FacilityTypes.Gym: ('Спортивный зал', 'Тренажерный зал', 'Зал единоборств'),
+    FacilityTypes.Outdoor: ('Стадион', 'Воркаут площадка', 'Лыжная трасса'),
+    FacilityTypes.Other: ('Спортивный комплекс', 'Физкультурно-оздоровительный комплекс'),
+    FacilityTypes.Pool: ('Бассейн', 'Плавательный бассейн'),
+    FacilityTypes.SkatingRink: ('Каток', 'Ледовая арена'),
+    FacilityTypes.Shooting: ('Тир', 'Стрелковый клуб'),
+}
+# Слова в именах по убыванию частоты: частота слова номер n пропорциональна 1 / n (закон Ципфа),
+# поэтому поиск по первым словам находит много объектов, по последним - мало
+NAME_WORDS = (
+    'Спартак', 'Динамо', 'Зенит', 'Нева', 'Олимп', 'Звезда', 'Юность', 'Атлант', 'Локомотив', 'Смена',
+    'Буревестник', 'Факел', 'Волна', 'Аврора', 'Балтика', 'Торпедо', 'Радуга', 'Лидер', 'Заря', 'Северный',
+    'Чемпион', 'Старт', 'Невский', 'Петровский', 'Витязь', 'Фортуна', 'Дельфин', 'Ладога', 'Пулково', 'Исток',
+)
+NAME_WORD_WEIGHTS = tuple(1 / rank for rank in range(1, len(NAME_WORDS) + 1))
+OWNERS = (
+    'СПб ГБУ «Центр физической культуры, спорта и здоровья»', 'ГБОУ СОШ', 'ГБУ ДО СДЮСШОР',
+    'СПб ГАУ «Центр комплексного благоустройства»', 'ООО «Фитнес Групп»', 'ИП Иванов Иван Иванович',
+    'ГБУ «Жилищное агентство»', 'ФГБОУ ВО «Университет»', 'АНО «Спортивный клуб»',
+)
+WHO_CAN_USE = ('Все желающие', 'Учащиеся', 'Члены клуба', 'Сборные команды', 'Дети и подростки')
+OPEN_HOURS = (
+    'Круглосуточно', 'Ежедневно 8:00-22:00', 'Пн-Пт 9:00-21:00, Сб-Вс 10:00-18:00', 'Пн-Сб 7:00-23:00',
+    'По расписанию',
+)
+NOTES = (
+    'Раздевалки, душевые', 'Освещение', 'Трибуны на 500 мест', 'Прокат инвентаря', 'Парковка',
+    'Медицинский кабинет', 'Раздевалки', 'Ограждение',
+)
+OPTIONAL_SHARE = 0.85  # доля объектов, у которых заполнено необязательное поле
+
+
+def weighted_choice(rnd: random.Random, weights: dict):
+    return rnd.choices(tuple(weights), weights=tuple(weights.values()))[0]
+
+
+def _optional(rnd: random.Random, value):
+    return value if rnd.random() < OPTIONAL_SHARE else None
+
+
+def random_point(rnd: random.Random) -> tuple[float, float]:
+    if rnd.random() < SCATTERED_SHARE:
+        x1, y1, x2, y2 = SCATTERED_BBOX
+        return rnd.uniform(x1, x2), rnd.uniform(y1, y2)
+    district = rnd.choices(DISTRICTS, weights=[district.weight for district in DISTRICTS])[0]
+    # Градус широты в Петербурге почти вдвое длиннее градуса долготы, разброс по широте меньше
+    return rnd.gauss(district.x, district.spread), rnd.gauss(district.y, district.spread / 2)
+
+
+def generate(size: int, seed: int = 0) -> Iterator[dict]:
+    """
+    Объекты набора (колонки facility без дат и поискового вектора), детерминированные seed.
+    """
+    rnd = random.Random(seed)
+    for number in range(size):
+        facility_type = weighted_choice(rnd, TYPE_WEIGHTS)
+        x, y = random_point(rnd)
+        length = round(rnd.uniform(10, 110), 1)
+        width = round(rnd.uniform(8, 70), 1)
+        yield {
+            'id': uuid.UUID(int=rnd.getrandbits(128), version=4),
+            # Номер делает имя уникальным
+            'name': f'{rnd.choice(TYPE_TITLES[facility_type])} '
+                    f'«{rnd.choices(NAME_WORDS, weights=NAME_WORD_WEIGHTS)[0]}» №{number + 1}',
+            'x': x,
+            'y': y,
+            'type': facility_type,
+            'owner_name': _optional(rnd, rnd.choice(OWNERS)),
+            'property_form': _optional(rnd, weighted_choice(rnd, PROPERTY_FORM_WEIGHTS)),
+            'length': _optional(rnd, length),
+            'width': _optional(rnd, width),
+            'area': _optional(rnd, round(length * width, 1)),
+            'actual_workload': _optional(rnd, int(rnd.paretovariate(1.5) * 100)),
+            'annual_capacity': _optional(rnd, int(rnd.paretovariate(1.2) * 1000)),
+            'notes': _optional(rnd, ', '.join(rnd.sample(NOTES, rnd.randint(1, 3)))),
+            'height': None,
+            'size': None,
+            'depth': round(rnd.uniform(1.2, 5), 1) if facility_type is FacilityTypes.Pool else None,
+            'converting_type':
+                _optional(rnd, weighted_choice(rnd, COVERING_TYPE_WEIGHTS)) if facility_type in COVERED_TYPES else None,
+            'is_accessible_for_disabled': _optional(rnd, rnd.random() < 0.4),
+            'paying_type': _optional(rnd, weighted_choice(rnd, PAYING_TYPE_WEIGHTS)),
+            'who_can_use': _optional(rnd, rnd.choice(WHO_CAN_USE)),
+            'link': f'{DATASET_LINK}{number + 1}',
+            'phone_number': _optional(rnd, f'+7 812 {rnd.randint(200, 999)}-{rnd.randint(10, 99)}-'
+                                           f'{rnd.randint(10, 99)}'),
+            'open_hours': _optional(rnd, rnd.choice(OPEN_HOURS)),
+            'eps': _optional(rnd, min(int(rnd.expovariate(1 / 3)) + 1, 10)),
+            'hidden': rnd.random() < 0.03,
+        }
+
+
+def _records(facilities: list[dict]) -> list[tuple]:
+    return [
+        (facility['id'], *(convert(facility[column]) for column, convert in CONVERTERS))
+        for facility in facilities
+    ]
+
+
+async def clear(conn: AsyncConnection) -> int:
+    result = await conn.execute(
+        sa.text('DELETE FROM facility WHERE link LIKE :prefix'), {'prefix': f'{DATASET_LINK}%'}
+    )
+    return result.rowcount
+
+
+async def run(db_url: str, size: int | None, seed: int):
+    engine = create_async_engine(db_url)
+    try:
+        async with engine.begin() as conn:
+            started = time.perf_counter()
+            deleted = await clear(conn)
+            print(f'deleted {deleted:,} facilities of the previous dataset')
+            if size is None:
+                return
+
+            # COPY есть только у asyncpg, SQLAlchemy его не поддерживает
+            raw = await conn.get_raw_connection()
+            driver_connection = raw.driver_connection
+            batch = []
+            for facility in generate(size, seed):
+                batch.append(facility)
+                if len(batch) == COPY_BATCH_SIZE:
+                    await driver_connection.copy_records_to_table('facility', records=_records(batch),
+                                                                  columns=COPY_COLUMNS)
+                    batch.clear()
+            if batch:
+                await driver_connection.copy_records_to_table('facility', records=_records(batch),
+                                                              columns=COPY_COLUMNS)
+        async with engine.connect() as conn:
+            # Статистика планировщика для новых строчек, иначе первые замеры идут с неудачными планами
+            await conn.execute(sa.text('ANALYZE facility'))
+        print(f'inserted {size:,} facilities (seed {seed}) in {time.perf_counter() - started:.1f} s')
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', default=None, help='адрес базы данных (по умолчанию API_DB_URL)')
+    parser.add_argument('--size', choices=SIZES, default='100k', help='количество объектов')
+    parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора')
+    parser.add_argument('--clear', action='store_true', help='только удалить объекты набора')
+    args = parser.parse_args()
+
+    size = None if args.clear else SIZES[args.size]
+    asyncio.run(run(args.db_url or Settings.new().API_DB_URL, size, args.seed))
+
+
+if __name__ == '__main__':
+    main()
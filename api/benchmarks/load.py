@@ -0,0 +1,479 @@
+"""
+Нагрузочный замер API смешанным потоком запросов.
+
+Несколько пользователей (--concurrency) в течение --duration секунд без пауз отправляют запросы
+сценариев в пропорциях --mix:
+
+list     - листает список объектов по имени страницами по 50 (POST /facility/search с курсором)
+get      - объект по id (GET /facility/{id}), id выбираются из объектов в базе
+search   - полнотекстовый поиск с фильтрами по типу, платности и ЕПС (POST /facility/search)
+write    - изменение и скрытие объектов администратором (PUT и PATCH /facility/{id})
+refresh  - обновление токенов (POST /admin/token/refresh)
+
+Первые --warmup секунд не учитываются. По каждому сценарию и по всем запросам выводятся
+p50/p95/p99 времени ответа и пропускная способность, по пулам соединений - время ожидания
+соединения (из /metrics за время замера). Результаты сохраняются в JSON (--output),
+с результатами прошлого запуска можно сравнить (--compare).
+
+По умолчанию приложение (create_app) запускается в этом же процессе с настройками из переменных
+окружения. Тогда клиент и сервер делят процессор и event loop, и времена завышены: для точных
+замеров лучше запустить сервер отдельно (в том числе с API_WORKERS) и передать его адрес в --url.
+В режиме pre-fork /metrics отдает метрики одного процесса, время ожидания соединения - только по нему.
+
+Объекты в базе нужно создать заранее (benchmarks.dataset). Сценарий write меняет только
+объекты, которые создает для себя и удаляет в конце.
+
+Пример использования:
+
+API_DB_URL=... python3 -m benchmarks.dataset --size 100k
+API_DB_URL=... python3 -m benchmarks.load --concurrency 16 --duration 30 --output before.json
+API_DB_URL=... python3 -m benchmarks.load --concurrency 16 --duration 30 --output after.json --compare before.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import subprocess
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+import aiohttp
+from aiohttp import web
+
+from api.app import create_app
+from api.metrics import POOL_WAIT_BUCKETS
+from benchmarks.dataset import (
+    DATASET_LINK, NAME_WORD_WEIGHTS, NAME_WORDS, NOTES, OPEN_HOURS, PAYING_TYPE_WEIGHTS, TYPE_WEIGHTS, random_point,
+    weighted_choice,
+)
+from settings import Settings
+
+SCENARIOS = ('list', 'get', 'search', 'write', 'refresh')
+DEFAULT_MIX = 'list=20,get=45,search=25,write=5,refresh=5'
+PERCENTILES = (50, 95, 99)
+
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGES = 10  # страниц, которые пользователь пролистывает, прежде чем начать сначала
+SEARCH_LIMIT = 20
+SAMPLE_IDS = 1000  # объектов, из которых выбираются id для сценария get
+WRITE_FACILITIES = 20  # объектов, которые создаются для сценария write
+
+USER_EMAIL = 'benchmark@sportsmap.example'
+USER_PASSWORD = 'benchmark'
+
+METRIC_LINE = re.compile(r'^db_pool_wait_seconds_(bucket|sum|count)\{pool="([^"]*)"(?:,le="([^"]*)")?\} (\S+)$')
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    """
+    'list=20,get=45' -> {'list': 20.0, 'get': 45.0}
+    """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}, expected one of {", ".join(SCENARIOS)}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'wrong weight of scenario {name!r}: {weight!r}')
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('all scenario weights are zero')
+    return mix
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Перцентиль по ближайшему рангу, values отсортированы.
+    """
+    if not values:
+        return 0.0
+    rank = max(int(len(values) * q / 100 + 0.5), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+class Recorder:
+    """
+    Времена ответов (в секундах) и ошибки по сценариям. Учитываются запросы, отправленные
+    после начала замера (start).
+    """
+    def __init__(self):
+        self.start: float | None = None
+        self.latencies: dict[str, list[float]] = {name: [] for name in SCENARIOS}
+        self.errors: dict[str, int] = dict.fromkeys(SCENARIOS, 0)
+
+    def record(self, scenario: str, started: float, seconds: float, ok: bool):
+        if self.start is None or started < self.start:
+            return
+        self.latencies[scenario].append(seconds)
+        if not ok:
+            self.errors[scenario] += 1
+
+    @staticmethod
+    def _summary(latencies: list[float], errors: int, duration: float) -> dict:
+        latencies = sorted(latencies)
+        summary = {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput': len(latencies) / duration,
+            'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        }
+        for q in PERCENTILES:
+            summary[f'p{q}_ms'] = percentile(latencies, q) * 1000
+        return summary
+
+    def summary(self, duration: float) -> dict:
+        scenarios = {
+            name: self._summary(latencies, self.errors[name], duration)
+            for name, latencies in self.latencies.items() if latencies
+        }
+        total = self._summary(
+            [seconds for latencies in self.latencies.values() for seconds in latencies],
+            sum(self.errors.values()),
+            duration
+        )
+        return {'total': total, 'scenarios': scenarios}
+
+
+def parse_pool_wait(text: str) -> dict[str, dict]:
+    """
+    Гистограммы db_pool_wait_seconds по пулам из выгрузки /metrics:
+    {pool: {'buckets': [накопленное количество по POOL_WAIT_BUCKETS и +Inf], 'sum': ..., 'count': ...}}
+    """
+    pools: dict[str, dict] = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match is None:
+            continue
+        kind, pool, _, value = match.groups()
+        histogram = pools.setdefault(pool, {'buckets': [], 'sum': 0.0, 'count': 0})
+        if kind == 'bucket':
+            histogram['buckets'].append(int(value))
+        elif kind == 'sum':
+            histogram['sum'] = float(value)
+        else:
+            histogram['count'] = int(value)
+    return pools
+
+
+def pool_wait_summary(before: dict[str, dict], after: dict[str, dict]) -> dict[str, dict]:
+    """
+    Время ожидания соединения за время замера по пулам. Перцентили - верхние границы корзин гистограммы,
+    в которые они попали (None - больше последней границы).
+    """
+    summary = {}
+    for pool, histogram in after.items():
+        previous = before.get(pool, {'buckets': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0})
+        count = histogram['count'] - previous['count']
+        buckets = [now - then for now, then in zip(histogram['buckets'], previous['buckets'])]
+        pool_summary = {
+            'count': count,
+            'mean_ms': (histogram['sum'] - previous['sum']) / count * 1000 if count else 0.0,
+        }
+        for q in PERCENTILES:
+            bound = None
+            for upper, cumulative in zip(POOL_WAIT_BUCKETS, buckets):
+                if count and cumulative >= count * q / 100:
+                    bound = upper * 1000
+                    break
+            pool_summary[f'p{q}_le_ms'] = bound if count else 0.0
+        summary[pool] = pool_summary
+    return summary
+
+
+class User:
+    """
+    Состояние одного пользователя: токены и страница, до которой он долистал список.
+    """
+    def __init__(self, rnd: random.Random):
+        self.rnd = rnd
+        self.access_token: str | None = None
+        self.refresh_token: str | None = None
+        self.cursor: str | None = None
+        self.pages = 0
+
+    def headers(self) -> dict:
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+
+class LoadTest:
+    def __init__(self, session: aiohttp.ClientSession, url: str, seed: int):
+        self.session = session
+        self.url = url.rstrip('/')
+        self.seed = seed
+        self.recorder = Recorder()
+        self.ids: list[str] = []
+        self.writable: list[str] = []
+
+    async def request(self, scenario: str | None, method: str, path: str, **kwargs) -> tuple[int, bytes]:
+        """
+        Отправляет запрос и читает ответ целиком. Время запросов сценариев (scenario) записывается.
+        """
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, self.url + path, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            status, body = 0, b''
+        if scenario is not None:
+            self.recorder.record(scenario, started, time.perf_counter() - started, 200 <= status < 300)
+        return status, body
+
+    async def login(self, user: User):
+        status, body = await self.request(
+            None, 'POST', '/admin/login', json={'email': USER_EMAIL, 'password': USER_PASSWORD}
+        )
+        if status != 200:
+            raise RuntimeError(f'login failed: {status} {body[:200]!r}')
+        tokens = json.loads(body)
+        user.access_token, user.refresh_token = tokens['access_token'], tokens['refresh_token']
+
+    async def prepare(self, admin: User):
+        """
+        Пользователь-администратор, id объектов для сценария get и объекты для сценария write.
+        """
+        status, body = await self.request(
+            None, 'POST', '/admin/users', json={'email': USER_EMAIL, 'password': USER_PASSWORD}
+        )
+        if status not in (201, 409):
+            raise RuntimeError(f'registration failed: {status} {body[:200]!r}')
+        await self.login(admin)
+
+        status, body = await self.request(
+            None, 'POST', '/facility/search', json={'limit': SAMPLE_IDS, 'order_by': 'id'}
+        )
+        if status != 200:
+            raise RuntimeError(f'search failed: {status} {body[:200]!r}')
+        self.ids = [facility['id'] for facility in json.loads(body)['data']]
+        if not self.ids:
+            raise RuntimeError('there are no facilities, create them with benchmarks.dataset')
+
+        rnd = random.Random(self.seed)
+        for number in range(WRITE_FACILITIES):
+            x, y = random_point(rnd)
+            status, body = await self.request(None, 'POST', '/facility', headers=admin.headers(), json={
+                'name': f'Нагрузочный замер {uuid.uuid4()}',
+                'x': x,
+                'y': y,
+                'type': 'Gym',
+                # Как у объектов набора: удаляются вместе с ним, если не удалились в конце замера
+                'link': f'{DATASET_LINK}load/{number}',
+            })
+            if status != 201:
+                raise RuntimeError(f'facility creation failed: {status} {body[:200]!r}')
+            self.writable.append(json.loads(body)['id'])
+
+    async def cleanup(self, admin: User):
+        for facility_id in self.writable:
+            await self.request(None, 'DELETE', f'/facility/{facility_id}', headers=admin.headers())
+
+    async def scenario_list(self, user: User):
+        query = {'limit': LIST_PAGE_SIZE, 'order_by': 'name'}
+        if user.cursor is not None:
+            query['cursor'] = user.cursor
+        status, body = await self.request('list', 'POST', '/facility/search', json=query)
+        user.pages += 1
+        user.cursor = json.loads(body).get('next_cursor') if status == 200 else None
+        if user.cursor is None or user.pages >= LIST_MAX_PAGES:
+            user.cursor, user.pages = None, 0
+
+    async def scenario_get(self, user: User):
+        await self.request('get', 'GET', f'/facility/{user.rnd.choice(self.ids)}')
+
+    async def scenario_search(self, user: User):
+        rnd = user.rnd
+        # Слова ищутся так же часто, как встречаются в именах: популярные запросы находят много объектов
+        query = {
+            'q': rnd.choices(NAME_WORDS, weights=NAME_WORD_WEIGHTS)[0],
+            'order_by': 'rank',
+            'limit': SEARCH_LIMIT,
+        }
+        filters = []
+        if rnd.random() < 0.5:
+            filters.append({'field': 'type', 'eq': weighted_choice(rnd, TYPE_WEIGHTS).name})
+        if rnd.random() < 0.3:
+            filters.append({'field': 'paying_type', 'eq': weighted_choice(rnd, PAYING_TYPE_WEIGHTS).name})
+        if rnd.random() < 0.3:
+            low = rnd.randint(1, 5)
+            filters.append({'field': 'eps', 'gt': low, 'lt': low + rnd.randint(0, 3)})
+        if filters:
+            query['filters'] = filters
+        await self.request('search', 'POST', '/facility/search', json=query)
+
+    async def scenario_write(self, user: User):
+        rnd = user.rnd
+        facility_id = rnd.choice(self.writable)
+        if rnd.random() < 0.8:
+            await self.request('write', 'PUT', f'/facility/{facility_id}', headers=user.headers(), json={
+                'notes': ', '.join(rnd.sample(NOTES, rnd.randint(1, 3))),
+                'open_hours': rnd.choice(OPEN_HOURS),
+            })
+        else:
+            await self.request('write', 'PATCH', f'/facility/{facility_id}', headers=user.headers(), json={
+                'hidden': rnd.random() < 0.5,
+            })
+
+    async def scenario_refresh(self, user: User):
+        status, body = await self.request('refresh', 'POST', '/admin/token/refresh', json={
+            'access_token': user.access_token,
+            'refresh_token': user.refresh_token,
+        })
+        if status == 200:
+            tokens = json.loads(body)
+            user.access_token, user.refresh_token = tokens['access_token'], tokens['refresh_token']
+
+    async def user_loop(self, user: User, mix: dict[str, float], deadline: float):
+        scenarios = [getattr(self, f'scenario_{name}') for name in mix]
+        weights = list(mix.values())
+        while time.perf_counter() < deadline:
+            await user.rnd.choices(scenarios, weights=weights)[0](user)
+
+    async def pool_wait(self) -> dict[str, dict]:
+        status, body = await self.request(None, 'GET', '/metrics')
+        return parse_pool_wait(body.decode()) if status == 200 else {}
+
+    async def run(self, mix: dict[str, float], concurrency: int, duration: float, warmup: float) -> dict:
+        admin = User(random.Random(self.seed))
+        users = [User(random.Random(self.seed * 1_000_003 + number)) for number in range(concurrency)]
+        try:
+            await self.prepare(admin)
+            for user in users:
+                await self.login(user)
+
+            deadline = time.perf_counter() + warmup + duration
+            loops = asyncio.gather(*(self.user_loop(user, mix, deadline) for user in users))
+            try:
+                await asyncio.sleep(warmup)
+                before = await self.pool_wait()
+                self.recorder.start = time.perf_counter()
+                await loops
+            except BaseException:
+                loops.cancel()
+                raise
+            measured = time.perf_counter() - self.recorder.start
+            after = await self.pool_wait()
+        finally:
+            await self.cleanup(admin)
+
+        return {
+            **self.recorder.summary(measured),
+            'duration': measured,
+            'pool_wait': pool_wait_summary(before, after),
+        }
+
+
+@asynccontextmanager
+async def serve() -> AsyncIterator[str]:
+    """
+    Запускает приложение в этом процессе на свободном порту, возвращает его адрес.
+    """
+    runner = web.AppRunner(create_app(Settings.new()), access_log=None)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        yield f'http://{host}:{port}'
+    finally:
+        await runner.cleanup()
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _change(now: float, before: float | None) -> str:
+    if not before:
+        return ''
+    return f' ({(now / before - 1) * 100:+.0f}%)'
+
+
+def report(result: dict, baseline: dict | None):
+    """
+    Таблица результатов; если передан baseline - с изменением относительно него.
+    """
+    def row(name: str, summary: dict, previous: dict | None):
+        previous = previous or {}
+        cells = [f'{name:8}', f'{summary["requests"]:8}', f'{summary["errors"]:6}']
+        for key in ('throughput', *(f'p{q}_ms' for q in PERCENTILES)):
+            cells.append(f'{summary[key]:9.1f}{_change(summary[key], previous.get(key)):8}')
+        print('  '.join(cells))
+
+    print(
+        f'{"":8}  {"requests":>8}  {"errors":>6}  {"req/s":>17}' + ''.join(f'  {f"p{q} ms":>17}' for q in PERCENTILES)
+    )
+    baseline_scenarios = baseline['scenarios'] if baseline else {}
+    for name, summary in result['scenarios'].items():
+        row(name, summary, baseline_scenarios.get(name))
+    row('total', result['total'], baseline['total'] if baseline else None)
+
+    for pool, wait in result['pool_wait'].items():
+        bounds = ', '.join(
+            f'p{q} <= {wait[f"p{q}_le_ms"]} ms' if wait[f'p{q}_le_ms'] is not None
+            else f'p{q} > {POOL_WAIT_BUCKETS[-1] * 1000} ms'
+            for q in PERCENTILES
+        )
+        print(f'pool {pool} wait: {wait["count"]} connections, mean {wait["mean_ms"]:.3f} ms, {bounds}')
+
+
+async def run(args: argparse.Namespace) -> dict:
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+        if args.url:
+            load_test = LoadTest(session, args.url, args.seed)
+            return await load_test.run(args.mix, args.concurrency, args.duration, args.warmup)
+        async with serve() as url:
+            load_test = LoadTest(session, url, args.seed)
+            return await load_test.run(args.mix, args.concurrency, args.duration, args.warmup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help='адрес запущенного сервера (по умолчанию запускается здесь)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f'сценарии и их веса ({DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=8, help='количество одновременных пользователей')
+    parser.add_argument('--duration', type=float, default=30, help='длительность замера в секундах')
+    parser.add_argument('--warmup', type=float, default=5, help='неучитываемое начало замера в секундах')
+    parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора запросов')
+    parser.add_argument('--output', default=None, help='файл, в который сохраняются результаты (JSON)')
+    parser.add_argument('--compare', default=None, help='файл с результатами прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    result = {
+        'started_at': started_at,
+        'commit': _commit(),
+        'url': args.url,
+        'mix': args.mix,
+        'concurrency': args.concurrency,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        **asyncio.run(run(args)),
+    }
+    report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+Микро-замеры частей API, на которые уходит больше всего процессорного времени,
+со сравнением с сохраненным в репозитории базовым замером (benchmarks/baseline.json).
+
+Каждый замер выполняется в цикле, число повторений подбирается так, чтобы попытка длилась
+не меньше 0.2 секунды. Чтобы базовый замер можно было сравнивать с замерами на другой машине,
+время делится на время калибровочного замера (чистый Python без API) и сравниваются отношения.
+Калибровочная попытка выполняется перед каждой попыткой замера, так что отношение считается
+для двух соседних по времени попыток и не зависит от того, как меняется частота процессора
+за время запуска; берется медиана отношений --repeat попыток.
+
+Базовый замер собирается из BASELINE_REPEAT попыток. Вместе с ним сохраняется разброс попыток
+каждого замера, допустимое замедление для замера - наибольшее из --tolerance и SPREAD_FACTOR
+разбросов: шумные замеры не должны валить проверку.
+
+Результаты каждого запуска сохраняются в --results-dir в файл с именем коммита (git describe).
+Если замер медленнее базового больше чем на допустимое замедление, программа завершается с кодом 1.
+
+Пример использования:
+
+python3 -m benchmarks.micro
+python3 -m benchmarks.micro --cases facility_dump,payloads_dumps --repeat 9
+python3 -m benchmarks.micro --save-baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+from typing import Callable
+
+from aiohttp.test_utils import make_mocked_request
+from marshmallow import ValidationError
+
+from api.jwt import JWT
+from api.middlewares import error_middleware
+from api.payloads import dumps
+from api.schemas.facility import FacilityResponse
+from benchmarks.serializer import make_facilities
+from db.facility import Facility
+from db.user import User
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+DEFAULT_TOLERANCE = 0.25  # допустимое замедление относительно базового замера
+DEFAULT_REPEAT = 7
+BASELINE_REPEAT = 15  # попыток для базового замера
+SPREAD_FACTOR = 2  # во сколько раз допустимое замедление больше разброса базового замера
+ROWS = 1000  # объектов в замерах сериализации списка
+CALIBRATION = 'calibration'
+
+# Замер: функция, которая готовит данные и возвращает измеряемую функцию без аргументов
+CASES: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    def register(setup: Callable[[], Callable[[], object]]):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def run_coroutine(coroutine):
+    """
+    Выполняет корутину, которая ничего не ждет, без event loop.
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError('coroutine is suspended, it needs an event loop')
+
+
+@case(CALIBRATION)
+def calibration():
+    values = list(range(1000))
+
+    def run():
+        total = 0
+        for value in values:
+            total += value * value % 7
+        return sorted(values, key=lambda value: -value)[0] + total
+    return run
+
+
+@case('facility_dump')
+def facility_dump():
+    facilities = make_facilities(ROWS)
+    return lambda: FacilityResponse(many=True).dump(facilities)
+
+
+@case('payloads_dumps')
+def payloads_dumps():
+    data = {'count': ROWS, 'data': FacilityResponse(many=True).dump(make_facilities(ROWS))}
+    return lambda: dumps(data)
+
+
+@case('search_stmt')
+def search_stmt():
+    filters = [
+        {'field': 'type', 'eq': 'Gym'},
+        {'field': 'paying_type', 'eq': 'FullFree'},
+        {'field': 'eps', 'gt': 2, 'lt': 8},
+        {'field': 'area', 'gt': 100},
+        {'field': 'actual_workload', 'lt': 500},
+        {'field': 'x', 'gt': 30.1, 'lt': 30.5},
+        {'field': 'y', 'gt': 59.8, 'lt': 60.1},
+    ]
+    return lambda: Facility.search_stmt(
+        q='стадион зенит', filters=filters, order_by='rank', order_desc=True, limit=20, offset=40
+    )
+
+
+def _token() -> tuple[JWT, str]:
+    jwt = JWT([('benchmark', 'benchmark-secret')])
+    access_token, _, _ = jwt.create_jwt('benchmark@sportsmap.example')
+    return jwt, access_token
+
+
+@case('jwt_verify')
+def jwt_verify():
+    # Первая проверка токена: декодирование и проверка подписи
+    jwt, access_token = _token()
+
+    def run():
+        jwt._verified.clear()
+        return jwt.verify_access_token(access_token)
+    return run
+
+
+@case('jwt_verify_cached')
+def jwt_verify_cached():
+    jwt, access_token = _token()
+    jwt.verify_access_token(access_token)
+    return lambda: jwt.verify_access_token(access_token)
+
+
+@case('hash_password')
+def hash_password():
+    return lambda: User.hash_password('correct horse battery staple')
+
+
+@case('error_middleware_422')
+def error_middleware_422():
+    request = make_mocked_request('POST', '/facility/search')
+    messages = {
+        'limit': ['Not a valid integer.'],
+        'filters': {0: {'lt': ['Not a valid number.']}, 2: {'eq': ['Not a valid string.']}},
+    }
+
+    async def handler(request):
+        raise ValidationError(messages)
+
+    return lambda: run_coroutine(error_middleware(request, handler))
+
+
+def measure(run: Callable[[], object], calibration_run: Callable[[], object], repeat: int) -> list[float]:
+    """
+    Отношения времени run ко времени калибровочного замера в repeat попытках.
+    """
+    timer, calibration_timer = timeit.Timer(run), timeit.Timer(calibration_run)
+    # Повторений в попытке столько, чтобы она длилась не меньше 0.2 секунды
+    number, _ = timer.autorange()
+    calibration_number, _ = calibration_timer.autorange()
+    ratios = []
+    for _ in range(repeat):
+        calibration_seconds = calibration_timer.timeit(calibration_number) / calibration_number
+        ratios.append(timer.timeit(number) / number / calibration_seconds)
+    return ratios
+
+
+def spread(ratios: list[float]) -> float:
+    """
+    Разброс попыток: межквартильный размах в долях медианы. Единичные выбросы
+    (попытка, прерванная другим процессом) на него не влияют.
+    """
+    first, _, third = statistics.quantiles(ratios, n=4)
+    return (third - first) / statistics.median(ratios)
+
+
+def _describe() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_cases(names: list[str], repeat: int) -> dict:
+    """
+    Результаты замеров: медиана и разброс отношений ко времени калибровочного замера.
+    """
+    calibration_run = CASES[CALIBRATION]()
+    calibration_seconds = min(timeit.Timer(calibration_run).repeat(repeat=repeat, number=1000)) / 1000
+    cases = {}
+    for name in names:
+        ratios = measure(CASES[name](), calibration_run, repeat)
+        relative = statistics.median(ratios)
+        cases[name] = {'seconds': relative * calibration_seconds, 'relative': relative, 'spread': spread(ratios)}
+    return {
+        'commit': _describe(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'calibration_seconds': calibration_seconds,
+        'cases': cases,
+    }
+
+
+def compare(result: dict, baseline: dict | None, tolerance: float) -> list[str]:
+    """
+    Печатает таблицу результатов.
+    :return: замеры, которые медленнее базовых больше чем на допустимое замедление:
+             наибольшее из tolerance и SPREAD_FACTOR разбросов базового замера
+    """
+    regressions = []
+    print(f'{"":22}  {"us/op":>12}  {"relative":>10}  {"baseline":>10}  {"change":>8}  {"allowed":>8}')
+    for name, current in result['cases'].items():
+        line = f'{name:22}  {current["seconds"] * 1e6:12.2f}  {current["relative"]:10.3f}'
+        base = (baseline or {}).get('cases', {}).get(name)
+        if base is not None:
+            change = current['relative'] / base['relative'] - 1
+            allowed = max(tolerance, SPREAD_FACTOR * base.get('spread', 0))
+            line += f'  {base["relative"]:10.3f}  {change * 100:+7.1f}%  {allowed * 100:7.1f}%'
+            if change > allowed:
+                regressions.append(name)
+                line += '  SLOWER'
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=None,
+                        help=f'замеры через запятую (по умолчанию все): {", ".join(CASES)}')
+    parser.add_argument('--repeat', type=int, default=None,
+                        help=f'количество попыток (по умолчанию {DEFAULT_REPEAT}, '
+                             f'для базового замера {BASELINE_REPEAT})')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='допустимое замедление относительно базового замера (0.25 - на 25%%)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='файл базового замера')
+    parser.add_argument('--results-dir', default=RESULTS_DIR, help='каталог для результатов запусков')
+    parser.add_argument('--save-baseline', action='store_true', help='сохранить результаты как базовый замер')
+    args = parser.parse_args()
+
+    names = [name for name in CASES if name != CALIBRATION]
+    if args.cases:
+        names = [name.strip() for name in args.cases.split(',')]
+        unknown = [name for name in names if name not in CASES]
+        if unknown:
+            parser.error(f'unknown cases: {", ".join(unknown)}')
+
+    repeat = args.repeat or (BASELINE_REPEAT if args.save_baseline else DEFAULT_REPEAT)
+    result = run_cases(names, repeat)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(result, baseline, args.tolerance)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    with open(os.path.join(args.results_dir, f'{result["commit"]}.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+    elif regressions:
+        print(f'slower than baseline by more than allowed: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
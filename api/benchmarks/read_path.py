@@ -0,0 +1,105 @@
+"""
+Сравнение процессорного времени на чтение и сериализацию списка спортивных объектов:
+через ORM (Facility.stream) и через строчки без ORM (FacilityRows.stream).
+
+Нужна база с примененными миграциями (API_DB_URL), объекты для замера создаются
+в транзакции, которая в конце откатывается.
+
+Пример использования:
+
+API_DB_URL=... python3 -m benchmarks.read_path --rows 10000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import AsyncIterator, Callable
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from api.serializers import serialize_facility, serialize_facility_row
+from db.facility import Facility, FacilityTypes
+from db.facility_rows import FacilityRows
+from settings import Settings
+
+
+async def insert_facilities(session: AsyncSession, count: int):
+    rnd = random.Random(0)
+    await session.execute(sa.insert(Facility), [
+        {
+            'id': uuid.UUID(int=rnd.getrandbits(128)),
+            'name': f'benchmark {uuid.uuid4()}',
+            'x': rnd.uniform(30, 40),
+            'y': rnd.uniform(50, 60),
+            'type': rnd.choice(list(FacilityTypes)),
+            'owner_name': 'Иванов Иван Иванович',
+            'notes': 'Раздевалки, душевые',
+            'hidden': False,
+        }
+        for _ in range(count)
+    ])
+
+
+async def measure(
+        session: AsyncSession,
+        stream: Callable[[], AsyncIterator],
+        serializer: Callable[[object], bytes],
+        repeat: int
+) -> tuple[float, float]:
+    """
+    Лучшее из repeat попыток (процессорное время, время) на чтение и сериализацию всех строчек, в секундах.
+    """
+    best_cpu, best_wall = float('inf'), float('inf')
+    for _ in range(repeat):
+        started_cpu, started_wall = time.process_time(), time.perf_counter()
+        async for facility in stream():
+            serializer(facility)
+        best_cpu = min(best_cpu, time.process_time() - started_cpu)
+        best_wall = min(best_wall, time.perf_counter() - started_wall)
+        # Объекты из прошлой попытки не должны браться из identity map
+        session.expunge_all()
+    return best_cpu, best_wall
+
+
+async def run(db_url: str, rows: int, repeat: int):
+    engine = create_async_engine(db_url)
+    try:
+        async with engine.connect() as conn:
+            transaction = await conn.begin()
+            session = AsyncSession(bind=conn)
+            await insert_facilities(session, rows)
+
+            orm_stmt = Facility.search_stmt(limit=rows)
+            orm = await measure(
+                session, lambda: Facility.stream(session, orm_stmt), serialize_facility, repeat
+            )
+            rows_stmt = FacilityRows.search_stmt(limit=rows)
+            core = await measure(
+                session, lambda: FacilityRows.stream(session, rows_stmt), serialize_facility_row, repeat
+            )
+
+            await session.close()
+            await transaction.rollback()
+    finally:
+        await engine.dispose()
+
+    for name, (cpu, wall) in (('orm', orm), ('rows', core)):
+        print(f'{name:5} cpu {cpu * 1000:9.1f} ms  wall {wall * 1000:9.1f} ms  {rows / cpu:12,.0f} rows/cpu-sec')
+    print(f'cpu per request: {(core[0] / orm[0] - 1) * 100:+.0f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', default=None, help='адрес базы данных (по умолчанию API_DB_URL)')
+    parser.add_argument('--rows', type=int, default=10000, help='количество объектов')
+    parser.add_argument('--repeat', type=int, default=5, help='количество попыток')
+    args = parser.parse_args()
+
+    asyncio.run(run(args.db_url or Settings.new().API_DB_URL, args.rows, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
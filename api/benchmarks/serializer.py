@@ -0,0 +1,78 @@
+"""
+Сравнение скорости сериализации спортивных объектов в JSON:
+marshmallow (FacilityResponse().dump + dumps) и сгенерированный serialize_facility.
+
+Пример использования:
+
+python3 -m benchmarks.serializer --rows 10000 --repeat 5
+"""
+
+import argparse
+import random
+import time
+import uuid
+from typing import Callable
+
+from api.payloads import dumps
+from api.schemas.facility import FacilityResponse
+from api.serializers import serialize_facility
+from db.facility import Facility, FacilityPayingTypes, FacilityTypes
+
+
+def make_facilities(count: int) -> list[Facility]:
+    rnd = random.Random(0)
+    facilities = []
+    for i in range(count):
+        facility = Facility(
+            name=f'Спортивный объект №{i}',
+            x=rnd.uniform(30, 40),
+            y=rnd.uniform(50, 60),
+            type=rnd.choice(list(FacilityTypes)),
+            owner_name='Иванов Иван Иванович',
+            paying_type=rnd.choice(list(FacilityPayingTypes)),
+            area=rnd.uniform(10, 1000),
+            actual_workload=rnd.randint(0, 1000),
+            notes='Раздевалки, душевые' if i % 2 else None,
+            is_accessible_for_disabled=bool(i % 3),
+            open_hours='с 9:00 до 21:00',
+            hidden=False
+        )
+        facility.id = uuid.UUID(int=rnd.getrandbits(128))
+        facilities.append(facility)
+    return facilities
+
+
+def marshmallow_serializer(facility: Facility) -> bytes:
+    return dumps(FacilityResponse().dump(facility)).encode()
+
+
+def measure(serializer: Callable[[Facility], bytes], facilities: list[Facility], repeat: int) -> float:
+    """
+    Лучшая из repeat попыток скорость сериализации, строчек в секунду.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for facility in facilities:
+            serializer(facility)
+        best = min(best, time.perf_counter() - started)
+    return len(facilities) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='количество объектов')
+    parser.add_argument('--repeat', type=int, default=5, help='количество попыток')
+    args = parser.parse_args()
+
+    facilities = make_facilities(args.rows)
+    before = measure(marshmallow_serializer, facilities, args.repeat)
+    after = measure(serialize_facility, facilities, args.repeat)
+
+    print(f'marshmallow:        {before:12,.0f} rows/sec')
+    print(f'serialize_facility: {after:12,.0f} rows/sec')
+    print(f'speedup:            {after / before:12.1f}x')
+
+
+if __name__ == '__main__':
+    main()
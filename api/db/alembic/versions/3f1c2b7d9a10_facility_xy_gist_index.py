@@ -0,0 +1,24 @@
+"""facility xy gist index
+
+Revision ID: 3f1c2b7d9a10
+Revises: 97267f6b304b
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2b7d9a10'
+down_revision = '97267f6b304b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix__facility__xy', 'facility', [sa.text('point(x, y)')], unique=False, postgresql_using='gist')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__xy', table_name='facility', postgresql_using='gist')
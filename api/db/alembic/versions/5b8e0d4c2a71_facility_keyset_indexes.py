@@ -0,0 +1,27 @@
+"""facility keyset indexes
+
+Revision ID: 5b8e0d4c2a71
+Revises: 3f1c2b7d9a10
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e0d4c2a71'
+down_revision = '3f1c2b7d9a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix__facility__name_id', 'facility', ['name', 'id'], unique=False, postgresql_using='btree')
+    op.create_index('ix__facility__x_id', 'facility', ['x', 'id'], unique=False, postgresql_using='btree')
+    op.create_index('ix__facility__y_id', 'facility', ['y', 'id'], unique=False, postgresql_using='btree')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__y_id', table_name='facility', postgresql_using='btree')
+    op.drop_index('ix__facility__x_id', table_name='facility', postgresql_using='btree')
+    op.drop_index('ix__facility__name_id', table_name='facility', postgresql_using='btree')
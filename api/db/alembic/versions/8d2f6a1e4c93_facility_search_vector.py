@@ -0,0 +1,38 @@
+"""facility search vector
+
+Revision ID: 8d2f6a1e4c93
+Revises: 5b8e0d4c2a71
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6a1e4c93'
+down_revision = '5b8e0d4c2a71'
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(owner_name, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(who_can_use, '')), 'C') || "
+    "setweight(to_tsvector('russian', coalesce(notes, '')), 'D') || "
+    "setweight(to_tsvector('russian', coalesce(open_hours, '')), 'D')"
+)
+
+
+def upgrade() -> None:
+    op.add_column(
+        'facility',
+        sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(SEARCH_VECTOR_SQL, persisted=True))
+    )
+    op.create_index('ix__facility__search_vector', 'facility', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__search_vector', table_name='facility', postgresql_using='gin')
+    op.drop_column('facility', 'search_vector')
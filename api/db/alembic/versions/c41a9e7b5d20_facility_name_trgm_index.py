@@ -0,0 +1,28 @@
+"""facility name trgm index
+
+Revision ID: c41a9e7b5d20
+Revises: 8d2f6a1e4c93
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41a9e7b5d20'
+down_revision = '8d2f6a1e4c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix__facility__name_trgm', 'facility', ['name'], unique=False,
+        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    # Расширение не удаляем: им могут пользоваться и другие объекты базы
+    op.drop_index('ix__facility__name_trgm', table_name='facility', postgresql_using='gin')
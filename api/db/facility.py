@@ -2,15 +2,41 @@ from __future__ import annotations
 
 import enum
 import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
 
 import sqlalchemy as sa
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 
 from .schema import Base
 
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+STREAM_CHUNK_SIZE = 500  # сколько строчек серверный курсор получает за раз
+# Колонки, по которым возможна keyset пагинация (значения не бывают NULL, есть индекс (колонка, id))
+KEYSET_COLUMNS = (None, 'id', 'name', 'x', 'y')
+# Сортировка поиска по релевантности (ts_rank), возможна только вместе с q
+RANK_ORDER = 'rank'
+# Конфигурация полнотекстового поиска и веса полей (A - самый важный)
+SEARCH_CONFIG = 'russian'
+SEARCH_WEIGHTS = (
+    ('name', 'A'),
+    ('owner_name', 'B'),
+    ('who_can_use', 'C'),
+    ('notes', 'D'),
+    ('open_hours', 'D'),
+)
+SEARCH_VECTOR_SQL = ' || '.join(
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({column}, '')), '{weight}')"
+    for column, weight in SEARCH_WEIGHTS
+)
+# Порог word_similarity нечеткого поиска по имени: при стандартном 0.6 опечатка в коротком слове не находится
+SUGGEST_SIMILARITY = 0.3
+
+
 class FacilityTypes(enum.Enum):
     Flat = 'Flat'
     Gym = 'Gym'
@@ -43,6 +69,28 @@ class FacilityPayingTypes(enum.Enum):
     NotFree = 'NotFree'
 
 
+class CatalogVersion:
+    """
+    Версия каталога, накапливаемая по уже загруженным объектам;
+    совпадает с тем, что возвращает Facility.get_catalog_version.
+    """
+    __slots__ = ('count', 'max_modified_at', 'checksum')
+
+    def __init__(self):
+        self.count = 0
+        self.max_modified_at = None
+        self.checksum = 0
+
+    def add(self, modified_at: datetime):
+        self.count += 1
+        self.checksum += (modified_at - EPOCH) // timedelta(microseconds=1)
+        if self.max_modified_at is None or modified_at > self.max_modified_at:
+            self.max_modified_at = modified_at
+
+    def tuple(self) -> tuple[int, datetime | None, int]:
+        return self.count, self.max_modified_at, self.checksum
+
+
 class Facility(Base):
     __tablename__ = 'facility'
 
@@ -71,6 +119,10 @@ class Facility(Base):
     open_hours = sa.Column('open_hours', sa.String)  # режим работы
     eps = sa.Column('eps', sa.Integer)  # ЕПС (что бы это ни было)
     hidden = sa.Column('hidden', sa.Boolean, default=False)  # видимость
+    # Поисковый вектор, вычисляется базой из текстовых полей; не загружается вместе с объектом
+    search_vector = deferred(
+        sa.Column('search_vector', TSVECTOR, sa.Computed(SEARCH_VECTOR_SQL, persisted=True))
+    )
 
     created_at = sa.Column('created_at', sa.DateTime(timezone=True), server_default=func.now())
     updated_at = sa.Column('updated_at', sa.DateTime(timezone=True), onupdate=func.now())
@@ -79,6 +131,17 @@ class Facility(Base):
     ix_name = sa.Index('ix__facility__name', name, postgresql_using='hash')
     ix_x = sa.Index('ix__facility__x', x, postgresql_using='btree')
     ix_y = sa.Index('ix__facility__y', y, postgresql_using='btree')
+    # GiST индекс по точке (x, y) для запросов по прямоугольной области карты
+    ix_xy = sa.Index('ix__facility__xy', sa.func.point(x, y), postgresql_using='gist')
+    # Индексы для keyset пагинации поиска: WHERE (колонка, id) > (...) ORDER BY колонка, id
+    ix_name_id = sa.Index('ix__facility__name_id', name, id, postgresql_using='btree')
+    ix_x_id = sa.Index('ix__facility__x_id', x, id, postgresql_using='btree')
+    ix_y_id = sa.Index('ix__facility__y_id', y, id, postgresql_using='btree')
+    ix_search_vector = sa.Index('ix__facility__search_vector', search_vector.columns[0], postgresql_using='gin')
+    # Триграммный индекс для нечеткого поиска по имени (подсказки с опечатками)
+    ix_name_trgm = sa.Index(
+        'ix__facility__name_trgm', name, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+    )
 
     def __init__(self, **kwargs):
         self.name = kwargs.get('name')
@@ -113,17 +176,30 @@ class Facility(Base):
         return f'Facility(name={self.name} id={self.id})'
 
     @staticmethod
-    async def search(
-            session: AsyncSession,
+    def search_stmt(
             q: str | None = None,
             limit: int | None = None,
             offset: int | None = None,
             order_by: str | None = None,
             order_desc: bool | None = None,
-            filters: list[dict] | None = None
-    ):
+            filters: list[dict] | None = None,
+            after: tuple | None = None
+    ) -> sa.sql.Select:
+        """
+        :param q: строка поиска по имени, владельцу, примечаниям, пользователям и режиму работы
+            (синтаксис websearch_to_tsquery: слова, "фраза", or, -исключение)
+        :param order_by: колонка сортировки или RANK_ORDER - по релевантности, самые подходящие первыми
+        :param after: (значение order_by, id) последнего объекта предыдущей страницы; если передан,
+            страница начинается сразу после него (keyset пагинация, offset не нужен)
+        """
         stmt = sa.select(Facility)
 
+        query = None
+        if q:
+            query = sa.func.websearch_to_tsquery(sa.literal_column(f"'{SEARCH_CONFIG}'::regconfig"), q)
+            # @@ по поисковому вектору идет через GIN индекс ix__facility__search_vector
+            stmt = stmt.where(Facility.search_vector.op('@@')(query))
+
         if filters is not None:
             conditions = []
             for f in filters:
@@ -132,30 +208,126 @@ class Facility(Base):
                 eq = f.get('eq')
                 lt = f.get('lt')
                 gt = f.get('gt')
-                if eq:
+                # 0 и пустая строка - тоже условия; фильтр без условий подошел бы ко всем объектам
+                if eq is not None:
                     cc.append(getattr(Facility, field) == eq)
-                if lt:
+                if lt is not None:
                     cc.append(getattr(Facility, field) <= lt)
-                if gt:
+                if gt is not None:
                     cc.append(getattr(Facility, field) >= gt)
+                if not cc:
+                    raise ValueError(f'filter by {field} has none of eq, lt, gt')
                 conditions.append(sa.and_(*cc))
             stmt = stmt.where(sa.or_(*conditions))
 
-        if order_by:
-            if order_desc:
-                stmt = stmt.order_by(sa.desc(order_by))
+        if after is not None:
+            if order_by not in KEYSET_COLUMNS:
+                raise ValueError(f'keyset pagination is not supported for order_by={order_by}')
+            after_value, after_id = after
+            after_id = uuid.UUID(str(after_id))
+            if order_by in (None, 'id'):
+                left, right = Facility.id, sa.literal(after_id, Facility.id.type)
             else:
-                stmt = stmt.order_by(order_by)
+                column = getattr(Facility, order_by)
+                # (order_by, id) > (значение, id) - сравнение строк, идет по индексу (order_by, id)
+                left = sa.tuple_(column, Facility.id)
+                right = sa.tuple_(sa.literal(after_value, column.type), sa.literal(after_id, Facility.id.type))
+            stmt = stmt.where(left < right if order_desc else left > right)
+
+        # id в конце сортировки делает порядок однозначным, без этого страницы могут пересекаться
+        if order_by == RANK_ORDER:
+            if query is None:
+                raise ValueError('order by rank requires q')
+            stmt = stmt.order_by(sa.desc(sa.func.ts_rank(Facility.search_vector, query)), Facility.id)
+        elif order_desc:
+            stmt = stmt.order_by(*[sa.desc(c) for c in (order_by, Facility.id) if c is not None])
+        else:
+            stmt = stmt.order_by(*[c for c in (order_by, Facility.id) if c is not None])
 
         if limit:
             stmt = stmt.limit(limit)
-        if offset:
+        if offset and after is None:
             stmt = stmt.offset(offset)
 
+        # Форма поиска без значений: по ней в журнале медленных запросов видно, какие условия были заданы
+        shape = Facility.search_shape(q, limit, offset, order_by, order_desc, filters, after)
+        return stmt.execution_options(shape=shape)
+
+    @staticmethod
+    def search_shape(
+            q: str | None = None,
+            limit: int | None = None,
+            offset: int | None = None,
+            order_by: str | None = None,
+            order_desc: bool | None = None,
+            filters: list[dict] | None = None,
+            after: tuple | None = None
+    ) -> str:
+        """
+        Условия search_stmt без значений, например "search q filters=[eps:gt,type:eq] order_by=rank limit".
+        """
+        parts = ['search']
+        if q:
+            parts.append('q')
+        if filters is not None:
+            conditions = [
+                f['field'] + ':' + '+'.join(op for op in ('eq', 'lt', 'gt') if f.get(op)) for f in filters
+            ]
+            parts.append(f'filters=[{",".join(conditions)}]')
+        if order_by:
+            parts.append(f'order_by={order_by}')
+        if order_desc:
+            parts.append('desc')
+        if limit:
+            parts.append('limit')
+        if after is not None:
+            parts.append('after')
+        elif offset:
+            parts.append('offset')
+        return ' '.join(parts)
+
+    @staticmethod
+    def sort_key(facility: Facility | sa.engine.Row, order_by: str | None = None) -> tuple:
+        """
+        Значение, которое нужно передать в search_stmt(after=...), чтобы продолжить выдачу после объекта.
+        """
+        return getattr(facility, order_by or 'id'), facility.id
+
+    @staticmethod
+    async def search(
+            session: AsyncSession,
+            q: str | None = None,
+            limit: int | None = None,
+            offset: int | None = None,
+            order_by: str | None = None,
+            order_desc: bool | None = None,
+            filters: list[dict] | None = None
+    ):
+        stmt = Facility.search_stmt(
+            q=q,
+            limit=limit,
+            offset=offset,
+            order_by=order_by,
+            order_desc=order_desc,
+            filters=filters
+        )
+
         facilities = (await session.execute(stmt)).scalars().all()
 
         return facilities
 
+    @staticmethod
+    async def stream(session: AsyncSession, stmt: sa.sql.Select | None = None) -> AsyncIterator[Facility]:
+        """
+        Построчное получение объектов через серверный курсор: в памяти одновременно
+        находится не больше STREAM_CHUNK_SIZE объектов, сколько бы их ни было в таблице.
+        """
+        if stmt is None:
+            stmt = sa.select(Facility)
+        result = await session.stream(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        async for facility in result.scalars():
+            yield facility
+
     @staticmethod
     async def get_by_id(session: AsyncSession, id: str) -> Facility | None:
         facility = (
@@ -166,6 +338,129 @@ class Facility(Base):
         ).scalars().first()
         return facility
 
+    @staticmethod
+    def in_bbox(min_x: float, min_y: float, max_x: float, max_y: float):
+        """
+        Условие попадания объекта в прямоугольную область.
+        Записано в виде `point(x, y) <@ box(...)`, чтобы запрос шел по GiST индексу ix__facility__xy.
+        """
+        return sa.func.point(Facility.x, Facility.y).op('<@')(
+            sa.func.box(sa.func.point(min_x, min_y), sa.func.point(max_x, max_y))
+        )
+
+    @staticmethod
+    async def get_by_bbox(
+            session: AsyncSession,
+            min_x: float,
+            min_y: float,
+            max_x: float,
+            max_y: float
+    ) -> list[Facility]:
+        """
+        Получение объектов, попадающих в прямоугольную область (например, в видимую часть карты).
+        """
+        facilities = (
+            await session.execute(
+                sa.select(Facility)
+                .where(Facility.in_bbox(min_x, min_y, max_x, max_y))
+            )
+        ).scalars().all()
+        return facilities
+
+    @staticmethod
+    async def get_visible_points(
+            session: AsyncSession,
+            bbox: tuple[float, float, float, float] | None = None
+    ) -> list[sa.engine.Row]:
+        """
+        Получение (id, x, y, type) всех не скрытых объектов.
+        :param bbox: (min_x, min_y, max_x, max_y) - если передан, только объекты из этой области
+        """
+        stmt = (
+            sa.select(Facility.id, Facility.x, Facility.y, Facility.type)
+            .where(Facility.hidden.isnot(True))
+        )
+        if bbox is not None:
+            stmt = stmt.where(Facility.in_bbox(*bbox))
+        points = (await session.execute(stmt)).all()
+        return points
+
+    @staticmethod
+    async def get_visible_names(session: AsyncSession) -> list[sa.engine.Row]:
+        """
+        Получение (id, name) всех не скрытых объектов.
+        """
+        names = (
+            await session.execute(
+                sa.select(Facility.id, Facility.name)
+                .where(Facility.hidden.isnot(True))
+            )
+        ).all()
+        return names
+
+    @staticmethod
+    async def suggest(session: AsyncSession, prefix: str, limit: int) -> list[sa.engine.Row]:
+        """
+        Нечеткий поиск (id, name) не скрытых объектов, в имени которых есть слово, похожее на prefix (pg_trgm).
+        Находит имена с опечатками; `prefix <% name` идет по GIN индексу ix__facility__name_trgm.
+        """
+        await session.execute(
+            sa.select(sa.func.set_config('pg_trgm.word_similarity_threshold', str(SUGGEST_SIMILARITY), True))
+        )
+        prefix = sa.literal(prefix, sa.String)
+        names = (
+            await session.execute(
+                sa.select(Facility.id, Facility.name)
+                .where(Facility.hidden.isnot(True))
+                .where(prefix.op('<%')(Facility.name))
+                .order_by(prefix.op('<<->')(Facility.name), Facility.id)
+                .limit(limit)
+            )
+        ).all()
+        return names
+
+    @property
+    def modified_at(self) -> datetime | None:
+        """
+        Время последнего изменения объекта (updated_at пуст, пока объект ни разу не обновлялся).
+        """
+        return self.updated_at or self.created_at
+
+    @staticmethod
+    async def get_modified_at(session: AsyncSession, id: str) -> datetime | None:
+        """
+        Время последнего изменения объекта без загрузки самого объекта.
+        """
+        modified_at = (
+            await session.execute(
+                sa.select(sa.func.coalesce(Facility.updated_at, Facility.created_at))
+                .where(Facility.id == id)
+            )
+        ).scalar()
+        return modified_at
+
+    @staticmethod
+    async def get_catalog_version(session: AsyncSession) -> tuple[int, datetime | None, int]:
+        """
+        Версия всего каталога без загрузки объектов: (количество объектов, время последнего изменения,
+        сумма времен изменения в микросекундах). Сумма меняется при любом изменении, даже если транзакция
+        с более ранним now() закоммитилась позже и не сдвинула максимум.
+        """
+        modified_at = sa.func.coalesce(Facility.updated_at, Facility.created_at)
+        # До PostgreSQL 14 extract возвращает double: каждое слагаемое приводится к bigint,
+        # чтобы сумма считалась точно и совпадала с CatalogVersion
+        modified_us = sa.cast(sa.extract('epoch', modified_at) * 1000000, sa.BigInteger)
+        count, max_modified_at, checksum = (
+            await session.execute(
+                sa.select(
+                    sa.func.count(),
+                    sa.func.max(modified_at),
+                    sa.func.coalesce(sa.func.sum(modified_us), 0)
+                ).select_from(Facility)
+            )
+        ).one()
+        return count, max_modified_at, int(checksum)
+
     @staticmethod
     async def get_all(session: AsyncSession) -> list[Facility]:
         facilities = (
@@ -201,3 +496,13 @@ class Facility(Base):
             "eps": self.eps,
             "hidden": self.hidden,
         }
+
+
+# Расширение pg_trgm нужно для индекса ix__facility__name_trgm и Facility.suggest
+sa.event.listen(Facility.__table__, 'before_create', sa.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+# Колонки, по которым можно фильтровать в search_stmt (filters)
+FILTER_COLUMNS = tuple(
+    column.key for column in Facility.__table__.columns
+    if column.key not in ('id', 'search_vector', 'created_at', 'updated_at')
+)
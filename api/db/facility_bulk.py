@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .facility import Facility
+from .facility_import import STATE_COLUMNS
+
+MAX_BULK_SIZE = 1000  # объектов, которые можно изменить или удалить одним запросом
+
+
+def _state(table: sa.Table) -> list[sa.Column]:
+    return [table.c[column] for column in STATE_COLUMNS]
+
+
+def _ids(ids: list[uuid.UUID]) -> sa.sql.ColumnElement:
+    # Один параметр-массив вместо IN (...) с параметром на каждый id
+    return Facility.id == sa.any_(sa.bindparam('ids', ids, type_=ARRAY(UUID(as_uuid=True))))
+
+
+class FacilityBulk:
+    """
+    Массовые изменения спортивных объектов в обход ORM: объекты не загружаются, а изменяются
+    одним запросом UPDATE или DELETE ... RETURNING.
+
+    Объекты выбираются списком id или условиями поиска, как в Facility.search_stmt. Перед изменением
+    подходящие объекты блокируются (lock), поэтому их число можно проверить до выполнения,
+    а изменение затрагивает ровно заблокированные объекты, даже если подходящие появились после.
+    """
+    @staticmethod
+    def where(
+            ids: list[uuid.UUID] | None = None,
+            q: str | None = None,
+            filters: list[dict] | None = None
+    ) -> sa.sql.ColumnElement:
+        """
+        Условие выбора объектов: по списку id, если он передан, иначе по строке поиска и фильтрам.
+        """
+        if ids is not None:
+            return _ids(ids)
+        whereclause = Facility.search_stmt(q=q, filters=filters).whereclause
+        return whereclause if whereclause is not None else sa.true()
+
+    @staticmethod
+    async def count(session: AsyncSession, where: sa.sql.ColumnElement) -> int:
+        count = (
+            await session.execute(
+                sa.select(sa.func.count()).select_from(Facility).where(where)
+            )
+        ).scalar()
+        return count
+
+    @staticmethod
+    async def lock(session: AsyncSession, where: sa.sql.ColumnElement, limit: int) -> list[sa.engine.Row]:
+        """
+        Блокирует (FOR UPDATE) не больше limit объектов, подходящих под условие.
+        :return: состояние (STATE_COLUMNS) заблокированных объектов в порядке id
+        """
+        rows = (
+            await session.execute(
+                sa.select(*_state(Facility.__table__))
+                .where(where)
+                .order_by(Facility.id)
+                .limit(limit)
+                .with_for_update()
+            )
+        ).all()
+        return rows
+
+    @staticmethod
+    async def update(session: AsyncSession, ids: list[uuid.UUID], values: dict) -> list[sa.engine.Row]:
+        """
+        Присваивает values колонкам объектов с переданными id.
+        :return: состояние (STATE_COLUMNS) измененных объектов после изменения
+        """
+        if not ids:
+            return []
+        table = Facility.__table__
+        rows = (
+            await session.execute(
+                sa.update(table)
+                .where(_ids(ids))
+                .values(**values, updated_at=sa.func.now())
+                .returning(*_state(table))
+            )
+        ).all()
+        return rows
+
+    @staticmethod
+    async def delete(session: AsyncSession, ids: list[uuid.UUID]) -> list[sa.engine.Row]:
+        """
+        Удаляет объекты с переданными id.
+        :return: состояние (STATE_COLUMNS) удаленных объектов
+        """
+        if not ids:
+            return []
+        table = Facility.__table__
+        rows = (
+            await session.execute(
+                sa.delete(table)
+                .where(_ids(ids))
+                .returning(*_state(table))
+            )
+        ).all()
+        return rows
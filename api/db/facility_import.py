@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import enum
+import uuid
+from typing import Iterable
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .facility import Facility
+
+STAGING_TABLE = 'facility_import'
+# Колонки, которые загружаются из файла (даты и поисковый вектор заполняет база)
+IMPORT_COLUMNS = tuple(
+    column.key for column in Facility.__table__.columns
+    if column.key not in ('id', 'search_vector', 'created_at', 'updated_at')
+)
+COPY_COLUMNS = ('id', *IMPORT_COLUMNS)
+# Поля объекта, которые нужны наблюдателям (см. api.changes.FacilityState)
+STATE_COLUMNS = ('id', 'name', 'x', 'y', 'type', 'hidden')
+
+
+def _enum_name(value: enum.Enum | None) -> str | None:
+    return value.name if value is not None else None
+
+
+def _same(value):
+    return value
+
+
+# Преобразование значения колонки для COPY: enum колонки хранят имена членов перечисления
+CONVERTERS = tuple(
+    (column, _enum_name if isinstance(Facility.__table__.c[column].type, sa.Enum) else _same)
+    for column in IMPORT_COLUMNS
+)
+
+staging = sa.table(STAGING_TABLE, *(sa.column(column) for column in COPY_COLUMNS))
+
+
+class FacilityImport:
+    """
+    Массовая загрузка спортивных объектов: строчки пишутся через COPY во временную таблицу,
+    после чего одним запросом переносятся в facility. Объект с уже существующим именем обновляется,
+    если в файле он отличается от сохраненного, иначе остается нетронутым.
+
+    Все шаги выполняются в транзакции сессии, временная таблица удаляется при ее завершении.
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.copied = 0
+
+    async def _driver_connection(self):
+        # COPY есть только у asyncpg, SQLAlchemy его не поддерживает
+        connection = await self.session.connection()
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def create_staging(self):
+        await self.session.execute(sa.text(
+            f'CREATE TEMP TABLE {STAGING_TABLE} (LIKE facility INCLUDING DEFAULTS) ON COMMIT DROP'
+        ))
+
+    async def copy(self, rows: Iterable[dict]):
+        """
+        Копирует пачку уже проверенных строчек (поля FacilityRequest) во временную таблицу.
+        """
+        records = [
+            (uuid.uuid4(), *(convert(row.get(column)) for column, convert in CONVERTERS))
+            for row in rows
+        ]
+        if not records:
+            return
+        driver_connection = await self._driver_connection()
+        await driver_connection.copy_records_to_table(STAGING_TABLE, records=records, columns=COPY_COLUMNS)
+        self.copied += len(records)
+
+    async def merge(self) -> tuple[list[sa.engine.Row], list[sa.engine.Row]]:
+        """
+        Переносит строчки из временной таблицы в facility.
+        :return: состояние (STATE_COLUMNS) обновленных объектов до изменения и состояние
+            добавленных и обновленных объектов после него (с колонкой inserted)
+        """
+        if not self.copied:
+            return [], []
+        table = Facility.__table__
+        state = [table.c[column] for column in STATE_COLUMNS]
+
+        # Блокируем объекты, которые будут обновлены, чтобы их прежнее состояние не изменилось до переноса
+        before = (await self.session.execute(
+            sa.select(*state)
+            .join_from(table, staging, table.c.name == staging.c.name)
+            .with_for_update(of=table)
+        )).all()
+
+        stmt = postgresql.insert(table).from_select(
+            list(COPY_COLUMNS), sa.select(*(staging.c[column] for column in COPY_COLUMNS))
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={**{column: stmt.excluded[column] for column in IMPORT_COLUMNS}, 'updated_at': sa.func.now()},
+            # Объекты, которые в файле такие же, как в базе, не трогаем
+            where=sa.tuple_(*(table.c[column] for column in IMPORT_COLUMNS)).is_distinct_from(
+                sa.tuple_(*(stmt.excluded[column] for column in IMPORT_COLUMNS))
+            )
+        ).returning(*state, sa.literal_column(f'{table.name}.xmax = 0', sa.Boolean).label('inserted'))
+        after = (await self.session.execute(stmt)).all()
+        return before, after
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import uuid
+from typing import AsyncIterator
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .facility import STREAM_CHUNK_SIZE, Facility
+
+
+class FacilityRows:
+    """
+    Чтение спортивных объектов для отдачи клиенту в обход ORM.
+
+    Запросы выбирают колонки, а не Facility, поэтому результат - легкие строчки (Row) с доступом
+    к полям по имени, как у объекта, но без identity map, инструментированных атрибутов и
+    Facility.__init__. Объекты, которые нужно изменять, по-прежнему загружаются через Facility.
+    """
+    @staticmethod
+    def columns() -> list[sa.sql.ColumnElement]:
+        """
+        Колонки facility (кроме поискового вектора) и время последнего изменения modified_at.
+        """
+        return [
+            *(column for column in Facility.__table__.columns if column.key != 'search_vector'),
+            sa.func.coalesce(Facility.updated_at, Facility.created_at).label('modified_at'),
+        ]
+
+    @staticmethod
+    def keys() -> list[str]:
+        """
+        Имена полей строчки по порядку.
+        """
+        return [column.key for column in FacilityRows.columns()]
+
+    @staticmethod
+    def select() -> sa.sql.Select:
+        return sa.select(*FacilityRows.columns())
+
+    @staticmethod
+    def search_stmt(**kwargs) -> sa.sql.Select:
+        """
+        То же, что Facility.search_stmt, но выбирает строчки вместо объектов.
+        """
+        return Facility.search_stmt(**kwargs).with_only_columns(*FacilityRows.columns())
+
+    @staticmethod
+    async def get_by_id(session: AsyncSession, id: str) -> sa.engine.Row | None:
+        row = (
+            await session.execute(
+                FacilityRows.select()
+                .where(Facility.id == id)
+            )
+        ).first()
+        return row
+
+    @staticmethod
+    async def get_by_ids(session: AsyncSession, ids: list[uuid.UUID]) -> list[sa.engine.Row]:
+        """
+        Объекты с данными id (в любом порядке) одним запросом.
+        Массив передается одним параметром (id = ANY($1)), поэтому текст запроса не зависит от количества id
+        и подготовленный запрос переиспользуется.
+        """
+        ids_param = sa.bindparam('ids', ids, type_=ARRAY(UUID(as_uuid=True)))
+        rows = (
+            await session.execute(
+                FacilityRows.select()
+                .where(Facility.id == sa.any_(ids_param))
+            )
+        ).all()
+        return rows
+
+    @staticmethod
+    async def get_by_bbox(
+            session: AsyncSession,
+            min_x: float,
+            min_y: float,
+            max_x: float,
+            max_y: float
+    ) -> list[sa.engine.Row]:
+        rows = (
+            await session.execute(
+                FacilityRows.select()
+                .where(Facility.in_bbox(min_x, min_y, max_x, max_y))
+            )
+        ).all()
+        return rows
+
+    @staticmethod
+    async def partitions(
+            session: AsyncSession,
+            stmt: sa.sql.Select | None = None,
+            chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[list[sa.engine.Row]]:
+        """
+        Получение через серверный курсор пачками по chunk_size строчек:
+        в памяти одновременно находится не больше одной пачки, сколько бы строчек ни было в таблице.
+        """
+        if stmt is None:
+            stmt = FacilityRows.select()
+        result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions():
+            yield rows
+
+    @staticmethod
+    async def stream(session: AsyncSession, stmt: sa.sql.Select | None = None) -> AsyncIterator[sa.engine.Row]:
+        """
+        Построчное получение через серверный курсор, как Facility.stream.
+        Строчки забираются пачками, а не по одной, чтобы не переключаться в greenlet SQLAlchemy на каждой.
+        """
+        async for rows in FacilityRows.partitions(session, stmt):
+            for row in rows:
+                yield row
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from aiohttp.web_log import AccessLogger
+
+from settings import Settings
+
+TEXT_FORMAT = '%(asctime)s | %(levelname)s | %(name)s - %(message)s'
+# Атрибуты любой записи журнала; остальные атрибуты переданы через extra и пишутся в JSON отдельными полями
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись журнала - объект JSON на одной строчке: время, уровень, журнал, сообщение,
+    поля из extra (например, у журнала доступа - адрес, статус, время ответа) и исключение.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь как есть. QueueHandler форматирует сообщение перед тем, как положить
+    запись в очередь, чтобы ее можно было передать в другой процесс; очередь здесь в том же процессе,
+    поэтому сообщение форматирует поток QueueListener, а не event loop.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SampledAccessLogger(AccessLogger):
+    """
+    Журнал доступа aiohttp, в который попадает доля запросов sample. Строчка журнала
+    для пропущенных запросов не собирается.
+    """
+    sample = 1.0
+
+    def log(self, request, response, time: float):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        if self.sample < 1 and random.random() >= self.sample:
+            return
+        super().log(request, response, time)
+
+
+def access_logger_class(sample: float) -> type[AccessLogger]:
+    """
+    Класс журнала доступа для web.run_app (access_log_class), пишущий долю запросов sample.
+    """
+    if sample >= 1:
+        return SampledAccessLogger
+    return type('SampledAccessLogger', (SampledAccessLogger,), {'sample': sample})
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(settings: Settings, queued: bool = True):
+    """
+    Настраивает журнал процесса: уровни из настроек и вывод в stderr текстом или JSON.
+
+    Если queued, записи из обработчиков только кладутся в очередь, а форматирует и пишет их
+    отдельный поток, чтобы вывод не останавливал event loop. Поток не переживает fork,
+    поэтому в режиме pre-fork журнал настраивается в каждом процессе заново.
+
+    Уровень по умолчанию - INFO: вызовы logger.debug на горячем пути ничего не делают, если
+    сообщение передано шаблоном с аргументами, а не готовой f-строкой.
+    """
+    global _listener
+    _stop_listener()
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if settings.API_LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    if queued:
+        records = queue.SimpleQueue()
+        root.addHandler(LocalQueueHandler(records))
+        _listener = QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(handler)
+
+    root.setLevel(settings.API_LOG_LEVEL)
+    for name, level in settings.API_LOG_LEVELS:
+        logging.getLogger(name).setLevel(level)
+
+
+# Записи, оставшиеся в очереди, дописываются при завершении процесса
+atexit.register(_stop_listener)
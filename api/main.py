@@ -1,19 +1,38 @@
 import logging
+from functools import partial
 
 from aiohttp import web
 
 from settings import Settings
 from api.app import create_app
-from utils import setup_logger
+from logs import TEXT_FORMAT, access_logger_class, setup_logging
+from prefork import run_workers
 
-logger = logging.getLogger(__name__)
-setup_logger(logger)
+
+def serve(settings: Settings):
+    setup_logging(settings)
+    app = create_app(settings)
+    web.run_app(
+        app,
+        host=settings.API_HOST,
+        port=settings.API_PORT,
+        access_log_class=access_logger_class(settings.API_ACCESS_LOG_SAMPLE),
+        keepalive_timeout=5,
+        # Процессы pre-fork слушают один порт, каждый своим сокетом
+        reuse_port=settings.API_WORKERS > 1,
+    )
 
 
 def main():
+    # Журнал для предупреждений о настройках, пока он не настроен по ним
+    logging.basicConfig(format=TEXT_FORMAT)
     settings = Settings.new()
-    app = create_app(settings)
-    web.run_app(app, host=settings.API_HOST, port=settings.API_PORT, access_log=logger, keepalive_timeout=5)
+    if settings.API_WORKERS > 1:
+        # Родитель только следит за процессами, ему поток для журнала не нужен
+        setup_logging(settings, queued=False)
+        run_workers(partial(serve, settings), settings.API_WORKERS)
+    else:
+        serve(settings)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+import gc
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+WORKER_RESTART_DELAY = 1  # секунд перед перезапуском упавшего процесса, чтобы не перезапускать его в цикле
+
+
+def _worker(target: Callable[[], None]):
+    # Обработчики сигналов родителя не нужны процессу: aiohttp сам завершается по SIGINT и SIGTERM
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target()
+
+
+def run_workers(target: Callable[[], None], workers: int):
+    """
+    Pre-fork: запускает target в workers дочерних процессах и ждет их завершения.
+    Процессы, завершившиеся сами, перезапускаются. SIGINT и SIGTERM передаются всем процессам.
+
+    Каждый процесс - отдельное приложение со своим event loop и соединениями с базой. Чтобы процессы
+    делили входящие соединения, target должен слушать порт с SO_REUSEPORT: ядро само распределяет
+    соединения между сокетами процессов.
+
+    Структуры в памяти (кластеры, подсказки, тайлы, кеш каталога) у каждого процесса свои,
+    процессы сообщают друг другу об изменениях объектов через api.channel.
+    """
+    context = multiprocessing.get_context('fork')
+
+    # Все, что создано до fork (модули, классы, настройки), сборщик мусора больше не обходит.
+    # Иначе он пишет в заголовки этих объектов, и общие с родителем страницы памяти копируются в каждый процесс
+    gc.collect()
+    gc.freeze()
+
+    processes: dict[int, multiprocessing.Process] = {}
+    stopping = False
+
+    def start(number: int):
+        process = context.Process(target=_worker, args=(target,), name=f'worker-{number}')
+        process.start()
+        processes[number] = process
+        logger.info('%s started, pid %s', process.name, process.pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for number in range(workers):
+        start(number)
+
+    while processes:
+        multiprocessing.connection.wait([process.sentinel for process in processes.values()])
+        for number, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            del processes[number]
+            if stopping:
+                logger.info('%s stopped', process.name)
+                continue
+            logger.warning('%s exited with code %s, restarting', process.name, process.exitcode)
+            time.sleep(WORKER_RESTART_DELAY)
+            start(number)
@@ -2,13 +2,67 @@ from __future__ import annotations
 
 import logging
 import os
+import secrets
 
 from dataclasses import dataclass
 
-from utils import setup_logger
-
 logger = logging.getLogger(__name__)
-setup_logger(logger)
+
+# kid ключа, который генерируется, если ключи подписи токенов не заданы
+RANDOM_JWT_KID = 'random'
+# Форматы журнала: строчки для чтения человеком или JSON на каждой строчке для сборщиков журналов
+LOG_FORMATS = ('text', 'json')
+
+
+def parse_jwt_keys(text: str) -> list[tuple[str, str]]:
+    """
+    Ключи подписи токенов из строки вида "kid1:secret1,kid2:secret2" (в файле ключи можно писать
+    по одному на строчке, строчки с # пропускаются). Первым ключом подписываются новые токены,
+    остальные только проверяются - так ключ меняется без разлогина пользователей.
+    :raise ValueError: если ключ записан неправильно или kid повторяется
+    """
+    keys = []
+    for line in text.splitlines():
+        if line.strip().startswith('#'):
+            continue
+        for item in line.split(','):
+            if not item.strip():
+                continue
+            kid, sep, secret = item.strip().partition(':')
+            if not sep or not kid or not secret:
+                raise ValueError(f'CONFIG: JWT key must be "kid:secret", got {kid!r}')
+            if kid in dict(keys):
+                raise ValueError(f'CONFIG: duplicate JWT key id {kid!r}')
+            keys.append((kid, secret))
+    if not keys:
+        raise ValueError('CONFIG: JWT keys are empty')
+    return keys
+
+
+def parse_log_level(text: str) -> int:
+    """
+    :raise ValueError: если такого уровня журнала нет
+    """
+    level = logging.getLevelName(text.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f'CONFIG: unknown log level {text!r}')
+    return level
+
+
+def parse_log_levels(text: str) -> list[tuple[str, int]]:
+    """
+    Уровни отдельных журналов из строки вида "api.timing=DEBUG,aiohttp.access=WARNING".
+    :raise ValueError: если уровень записан неправильно
+    """
+    levels = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, separator, level = item.partition('=')
+        if not separator or not name.strip():
+            raise ValueError(f'CONFIG: log level must be "logger=LEVEL", got {item.strip()!r}')
+        levels.append((name.strip(), parse_log_level(level)))
+    return levels
 
 
 @dataclass
@@ -17,6 +71,16 @@ class Settings:
     API_PORT: int | None
     API_DB_URL: str
     API_DB_USE_SSL: bool
+    API_DB_REPLICA_URLS: list[str]
+    API_TILES_DIR: str | None
+    API_JWT_KEYS: list[tuple[str, str]]
+    API_WORKERS: int
+    API_SLOW_QUERY_MS: float | None
+    API_SLOW_QUERY_SAMPLE: float
+    API_LOG_LEVEL: int
+    API_LOG_LEVELS: list[tuple[str, int]]
+    API_LOG_FORMAT: str
+    API_ACCESS_LOG_SAMPLE: float
 
     @staticmethod
     def new() -> Settings:
@@ -42,9 +106,96 @@ class Settings:
         else:
             api_db_use_ssl = True
 
+        api_db_replica_urls = os.getenv('API_DB_REPLICA_URLS')
+        if api_db_replica_urls is None:
+            logger.warning('API_DB_REPLICA_URLS is none, all queries go to API_DB_URL')
+            api_db_replica_urls = []
+        else:
+            api_db_replica_urls = [url.strip() for url in api_db_replica_urls.split(',') if url.strip()]
+
+        api_tiles_dir = os.getenv('API_TILES_DIR')
+        if api_tiles_dir is None:
+            logger.warning('API_TILES_DIR is none, map tiles are cached in memory only')
+
+        api_jwt_keys = os.getenv('API_JWT_KEYS')
+        api_jwt_keys_file = os.getenv('API_JWT_KEYS_FILE')
+        if api_jwt_keys is not None:
+            api_jwt_keys = parse_jwt_keys(api_jwt_keys)
+        elif api_jwt_keys_file is not None:
+            with open(api_jwt_keys_file) as f:
+                api_jwt_keys = parse_jwt_keys(f.read())
+        else:
+            logger.warning('API_JWT_KEYS and API_JWT_KEYS_FILE are none, tokens are signed with a random key '
+                           'and become invalid after restart')
+            api_jwt_keys = [(RANDOM_JWT_KID, secrets.token_urlsafe(64))]
+
+        api_workers = os.getenv('API_WORKERS')
+        if api_workers is None:
+            logger.warning('API_WORKERS is none, use 1 by default')
+            api_workers = 1
+        else:
+            api_workers = int(api_workers)
+            if api_workers < 0:
+                raise ValueError(f'CONFIG: API_WORKERS must be 0 or more, got {api_workers}')
+            # 0 - по процессу на каждое ядро
+            api_workers = api_workers or os.cpu_count() or 1
+
+        api_slow_query_ms = os.getenv('API_SLOW_QUERY_MS')
+        if api_slow_query_ms is None:
+            logger.warning('API_SLOW_QUERY_MS is none, use 500 by default')
+            api_slow_query_ms = 500
+        else:
+            # Пустое значение выключает журнал медленных запросов
+            api_slow_query_ms = float(api_slow_query_ms) if api_slow_query_ms else None
+
+        api_slow_query_sample = os.getenv('API_SLOW_QUERY_SAMPLE')
+        if api_slow_query_sample is None:
+            logger.warning('API_SLOW_QUERY_SAMPLE is none, log every slow query by default')
+            api_slow_query_sample = 1
+        else:
+            api_slow_query_sample = float(api_slow_query_sample)
+
+        api_log_level = os.getenv('API_LOG_LEVEL')
+        if api_log_level is None:
+            logger.warning('API_LOG_LEVEL is none, use INFO by default')
+            api_log_level = logging.INFO
+        else:
+            api_log_level = parse_log_level(api_log_level)
+
+        api_log_levels = os.getenv('API_LOG_LEVELS')
+        if api_log_levels is None:
+            logger.warning('API_LOG_LEVELS is none, all loggers use API_LOG_LEVEL')
+            api_log_levels = []
+        else:
+            api_log_levels = parse_log_levels(api_log_levels)
+
+        api_log_format = os.getenv('API_LOG_FORMAT')
+        if api_log_format is None:
+            logger.warning('API_LOG_FORMAT is none, use text by default')
+            api_log_format = 'text'
+        elif api_log_format not in LOG_FORMATS:
+            raise ValueError(f'CONFIG: API_LOG_FORMAT must be one of {", ".join(LOG_FORMATS)}')
+
+        api_access_log_sample = os.getenv('API_ACCESS_LOG_SAMPLE')
+        if api_access_log_sample is None:
+            logger.warning('API_ACCESS_LOG_SAMPLE is none, log every request by default')
+            api_access_log_sample = 1
+        else:
+            api_access_log_sample = float(api_access_log_sample)
+
         return Settings(
             API_HOST=api_host,
             API_PORT=api_port,
             API_DB_URL=api_db_url,
-            API_DB_USE_SSL=api_db_use_ssl
+            API_DB_USE_SSL=api_db_use_ssl,
+            API_DB_REPLICA_URLS=api_db_replica_urls,
+            API_TILES_DIR=api_tiles_dir,
+            API_JWT_KEYS=api_jwt_keys,
+            API_WORKERS=api_workers,
+            API_SLOW_QUERY_MS=api_slow_query_ms,
+            API_SLOW_QUERY_SAMPLE=api_slow_query_sample,
+            API_LOG_LEVEL=api_log_level,
+            API_LOG_LEVELS=api_log_levels,
+            API_LOG_FORMAT=api_log_format,
+            API_ACCESS_LOG_SAMPLE=api_access_log_sample
         )
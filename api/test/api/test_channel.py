@@ -0,0 +1,150 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+import sqlalchemy as sa
+from aiohttp import web
+from aiohttp.test_utils import TestClient
+
+from api.app import create_app
+from api.changes import FacilityState, dump_changes, load_changes
+from api.import_facilities import run
+from api.snapshot import SnapshotIndex
+from db.facility import FacilityTypes
+from settings import Settings
+
+CLUSTERS_PARAMS = {'min_x': -90, 'min_y': -90, 'max_x': 90, 'max_y': 90, 'zoom': 0}
+
+
+@pytest.fixture
+def other_cli(loop, aiohttp_client, setup_db):
+    # Другой процесс API с той же базой
+    app: web.Application = create_app(Settings.new())
+
+    app.cleanup_ctx.pop()
+    app['sessionmaker'] = setup_db
+
+    return loop.run_until_complete(aiohttp_client(app))
+
+
+async def eventually(check, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not await check():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.05)
+
+
+async def clusters_count(cli: TestClient) -> int:
+    resp = await cli.get('/facility/clusters', params=CLUSTERS_PARAMS)
+    assert resp.status == 200
+    return sum(cluster['count'] for cluster in (await resp.json())['data'])
+
+
+def test_dump_changes():
+    state = FacilityState(id=uuid.uuid4(), name='Зал', x=1.5, y=2, type=FacilityTypes.Gym, hidden=False)
+    moved = state._replace(x=3.0, type=None)
+    assert load_changes(dump_changes('a', [(None, state), (state, moved), (moved, None)])) == (
+        'a', [(None, state), (state, moved), (moved, None)]
+    )
+
+    # Изменения, которые не помещаются в уведомление, заменяются сбросом
+    many = [(None, state._replace(id=uuid.uuid4(), name=f'Зал {i}')) for i in range(1000)]
+    assert load_changes(dump_changes(None, many)) == (None, None)
+
+
+async def test_channel(cli: TestClient, other_cli: TestClient):
+    user_data = {'email': 'user@example.com', 'password': 'hackme'}
+    resp = await cli.post('/admin/users', data=user_data)
+    assert resp.status == 201
+    resp = await cli.post('/admin/login', data=user_data)
+    headers = {'Authorization': f'Bearer {(await resp.json()).get("access_token")}'}
+
+    # Другой процесс построил кластеры и закешировал каталог до изменения
+    assert await clusters_count(other_cli) == 0
+    resp = await other_cli.get('/facility')
+    assert (await resp.json())['count'] == 0
+
+    resp = await cli.post('/facility', data={'name': 'Бассейн Дельфин', 'x': 1, 'y': 2}, headers=headers)
+    assert resp.status == 201
+    facility_id = (await resp.json())['id']
+
+    async def other_sees_facility():
+        return await clusters_count(other_cli) == 1
+    await eventually(other_sees_facility)
+
+    resp = await other_cli.get('/facility')
+    assert [facility['id'] for facility in (await resp.json())['data']] == [facility_id]
+    resp = await other_cli.get('/facility/suggest', params={'prefix': 'дельф'})
+    assert [facility['id'] for facility in (await resp.json())['data']] == [facility_id]
+
+    resp = await cli.delete(f'/facility/{facility_id}', headers=headers)
+    assert resp.status == 204
+
+    async def other_forgets_facility():
+        return await clusters_count(other_cli) == 0
+    await eventually(other_forgets_facility)
+
+
+async def test_channel_import(cli: TestClient, tmp_path):
+    # Импорт из командной строки отправляет уведомление работающим процессам API
+    assert await clusters_count(cli) == 0
+    path = tmp_path / 'facilities.csv'
+    path.write_text('name,x,y\nЗал 1,1,2\nЗал 2,3,4\n')
+    report = await run(Settings.new().API_DB_URL, str(path), 'csv')
+    assert report.inserted == 2
+
+    async def imported():
+        return await clusters_count(cli) == 2
+    await eventually(imported)
+
+
+async def test_channel_reconnect(cli: TestClient, setup_db):
+    channel = cli.server.app['facility_channel']
+    clusters = cli.server.app['clusters']
+    assert await clusters_count(cli) == 0
+    assert clusters._loaded
+
+    # После разрыва соединения процесс мог пропустить изменения: структуры в памяти сбрасываются
+    async with setup_db() as session:
+        await session.execute(sa.text(
+            "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+            "WHERE query LIKE 'LISTEN %' AND pid <> pg_backend_pid()"
+        ))
+
+    async def reconnected():
+        return channel.connected.is_set() and not clusters._loaded
+    await eventually(reconnected)
+
+
+async def test_snapshot_index_reset_while_loading():
+    class Index(SnapshotIndex):
+        def __init__(self):
+            super().__init__()
+            self.reads = 0
+            self.ids = set()
+
+        async def _read(self, session):
+            self.reads += 1
+            if self.reads == 1:
+                # Процесс переподключился к каналу, пока читался снимок
+                self.reset()
+            else:
+                # Уведомление об изменении пришло, пока читался снимок
+                self._changed([second])
+            return [first, second]
+
+        def _build(self, rows, skip):
+            self.ids.update(id for id in rows if id not in skip)
+
+        def _clear(self):
+            self.ids.clear()
+
+    first, second = uuid.uuid4(), uuid.uuid4()
+    index = Index()
+    await index.ensure_loaded(None)
+
+    # Снимок, прочитанный до сброса, отброшен; объект, изменившийся во время загрузки, свежее снимка
+    assert index.reads == 2
+    assert index.ids == {first}
+    assert index._loaded
@@ -0,0 +1,87 @@
+import gzip
+
+import pytest
+from aiohttp.test_utils import ClientSession
+
+from api.compression import BROTLI, GZIP, CompressedBodies, choose_encoding, compress
+
+
+def test_choose_encoding():
+    assert choose_encoding(None) is None
+    assert choose_encoding('identity', brotli=True) is None
+    assert choose_encoding('gzip, deflate', brotli=True) == GZIP
+    assert choose_encoding('gzip, deflate, br', brotli=True) == BROTLI
+    assert choose_encoding('gzip, deflate, br', brotli=False) == GZIP
+    assert choose_encoding('br;q=0.5, gzip;q=0.8', brotli=True) == GZIP
+    assert choose_encoding('gzip;q=0, *', brotli=False) is None
+    assert choose_encoding('*;q=0.1', brotli=True) == BROTLI
+    assert choose_encoding('GZIP;q=bad, deflate', brotli=False) is None
+
+
+async def test_compressed_bodies():
+    bodies = CompressedBodies()
+    body = b'{"data": []}' * 100
+    first, second = [await bodies.get('"etag"', GZIP, body) for _ in range(2)]
+    assert first is second
+    assert gzip.decompress(first) == body
+    assert bodies.stats()['hits'] == 1
+
+
+def test_compress_brotli():
+    brotli = pytest.importorskip('brotli')
+    body = b'{"data": []}' * 100
+    assert brotli.decompress(compress(body, BROTLI)) == body
+
+
+async def test_compression_middleware(cli: ClientSession):
+    user_data = {'email': 'user@example.com', 'password': 'hackme'}
+    resp = await cli.post('/admin/users', data=user_data)
+    assert resp.status == 201
+    resp = await cli.post('/admin/login', data=user_data)
+    headers = {'Authorization': f'Bearer {(await resp.json()).get("access_token")}'}
+    for i in range(10):
+        resp = await cli.post('/facility', data={'name': f'gym {i}', 'x': 1, 'y': 2}, headers=headers)
+        assert resp.status == 201
+    facility_id = (await resp.json()).get('id')
+
+    # Без Accept-Encoding ответ не сжимается, ETag сильный
+    resp = await cli.get('/facility', headers={'Accept-Encoding': 'identity'})
+    assert resp.status == 200
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    etag = resp.headers['ETag']
+    assert not etag.startswith('W/')
+    body = await resp.read()
+    assert len(body) >= 1024
+
+    # Сжатый вариант каталога считается один раз и берется из кеша
+    for _ in range(2):
+        resp = await cli.get('/facility', headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 200
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert resp.headers['ETag'] == f'W/{etag}'
+        assert await resp.read() == body
+    assert cli.server.app['compressed'].stats()['hits'] == 1
+
+    # Слабый ETag подходит для If-None-Match
+    resp = await cli.get('/facility', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'W/{etag}'})
+    assert resp.status == 304
+    assert resp.headers['ETag'] == f'W/{etag}'
+
+    # Маленький ответ не сжимается
+    resp = await cli.get(f'/facility/{facility_id}', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 200
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['ETag'].startswith('W/')
+
+    # Результаты поиска сжимаются по мере отправки
+    resp = await cli.post('/facility/search', json={'q': 'gym', 'limit': 10}, headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 200
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert (await resp.json())['count'] == 10
+
+    # Ошибки не сжимаются
+    resp = await cli.get('/facility/00000000-0000-0000-0000-000000000000', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 400
+    assert 'Content-Encoding' not in resp.headers
@@ -1,5 +1,18 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
 from aiohttp.test_utils import ClientSession
 
+from api.changes import MAX_APPLIED_CHANGES, FacilityState
+from api.cursor import encode_cursor
+from api.importer import MAX_RECORD_SIZE
+from api.tiles import TileStore, point_tile
+from db.facility import CatalogVersion, Facility
+
 
 async def test_facility_create(cli: ClientSession):
     # Успешное создание пользователя
@@ -535,3 +548,1020 @@ async def test_facility_search(cli: ClientSession):
     # Успешный поиск
     resp = await cli.post('/facility/search', data={})
     assert resp.status == 200
+
+
+async def test_facility_get_by_bbox(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    # Создание объектов внутри и снаружи области
+    for name, x, y in [('gym inside 1', 10, 20), ('gym inside 2', 15, 25), ('gym outside', 100, 200)]:
+        resp = await cli.post('/facility', data={'name': name, 'x': x, 'y': y, 'type': 'Gym'}, headers=headers)
+        assert resp.status == 201
+
+    # Успешное получение объектов в области
+    resp = await cli.get('/facility/bbox', params={'min_x': 0, 'min_y': 0, 'max_x': 50, 'max_y': 50})
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert resp_json.get('count') == 2
+    assert {f['name'] for f in resp_json.get('data')} == {'gym inside 1', 'gym inside 2'}
+
+    # Неудачное получение объектов (перепутаны границы области)
+    resp = await cli.get('/facility/bbox', params={'min_x': 50, 'min_y': 0, 'max_x': 0, 'max_y': 50})
+    assert resp.status == 422
+    assert (await resp.json()).get('message') == 'validation error'
+
+    # Неудачное получение объектов (нет границ области)
+    resp = await cli.get('/facility/bbox')
+    assert resp.status == 422
+
+
+async def test_facility_clusters(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    # Два объекта рядом друг с другом и один далеко
+    resp = await cli.post('/facility', data={'name': 'gym 1', 'x': 30.30, 'y': 59.90, 'type': 'Gym'}, headers=headers)
+    assert resp.status == 201
+    resp = await cli.post('/facility', data={'name': 'pool 1', 'x': 30.32, 'y': 59.92, 'type': 'Pool'}, headers=headers)
+    assert resp.status == 201
+    pool_id = (await resp.json()).get('id')
+    resp = await cli.post('/facility', data={'name': 'gym 2', 'x': -70, 'y': -10, 'type': 'Gym'}, headers=headers)
+    assert resp.status == 201
+
+    params = {'min_x': 0, 'min_y': 0, 'max_x': 90, 'max_y': 90, 'zoom': 3}
+
+    # Два близких объекта попадают в один кластер, далекий объект в область не попадает
+    resp = await cli.get('/facility/clusters', params=params)
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert resp_json.get('count') == 1
+    cluster = resp_json.get('data')[0]
+    assert cluster['count'] == 2
+    assert cluster['types'] == {'Gym': 1, 'Pool': 1}
+    assert abs(cluster['x'] - 30.31) < 1e-6
+    assert abs(cluster['y'] - 59.91) < 1e-6
+
+    # На крупном масштабе объекты разделяются
+    resp = await cli.get('/facility/clusters', params={**params, 'zoom': 16})
+    assert resp.status == 200
+    assert (await resp.json()).get('count') == 2
+
+    # Кластеры обновляются после изменения объектов
+    resp = await cli.patch(f'/facility/{pool_id}', data={'hidden': True}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.get('/facility/clusters', params=params)
+    assert (await resp.json()).get('data')[0]['types'] == {'Gym': 1}
+
+    resp = await cli.patch(f'/facility/{pool_id}', data={'hidden': False}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.put(f'/facility/{pool_id}', data={'x': -70.01, 'y': -10.01}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.get('/facility/clusters', params={**params, 'min_x': -90, 'min_y': -90, 'max_x': 0, 'max_y': 0})
+    assert (await resp.json()).get('data')[0]['types'] == {'Gym': 1, 'Pool': 1}
+
+    resp = await cli.delete(f'/facility/{pool_id}', headers=headers)
+    assert resp.status == 204
+    resp = await cli.get('/facility/clusters', params={**params, 'min_x': -90, 'min_y': -90, 'max_x': 0, 'max_y': 0})
+    assert (await resp.json()).get('data')[0]['count'] == 1
+
+    # Неудачное получение кластеров (без масштаба)
+    resp = await cli.get('/facility/clusters', params={'min_x': 0, 'min_y': 0, 'max_x': 90, 'max_y': 90})
+    assert resp.status == 422
+
+
+async def test_facility_tile(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    resp = await cli.post('/facility', data={'name': 'gym 1', 'x': 30.3, 'y': 59.9, 'type': 'Gym'}, headers=headers)
+    assert resp.status == 201
+    facility_id = (await resp.json()).get('id')
+
+    z = 12
+    x, y = point_tile(z, 30.3, 59.9)
+
+    # Успешное получение тайла
+    resp = await cli.get(f'/facility/tiles/{z}/{x}/{y}')
+    assert resp.status == 200
+    etag = resp.headers['ETag']
+    assert resp.headers['Cache-Control'] == 'public, no-cache'
+    resp_json = await resp.json()
+    assert resp_json['markers'] == [[facility_id, 30.3, 59.9, 'Gym']]
+
+    # Тайл не изменился
+    resp = await cli.get(f'/facility/tiles/{z}/{x}/{y}', headers={'If-None-Match': etag})
+    assert resp.status == 304
+
+    # Версионированный URL можно кешировать бессрочно
+    resp = await cli.get(f'/facility/tiles/{z}/{x}/{y}', params={'v': etag.strip('"')})
+    assert resp.status == 200
+    assert 'immutable' in resp.headers['Cache-Control']
+
+    # Изменение названия не влияет на маркеры
+    resp = await cli.put(f'/facility/{facility_id}', data={'name': 'gym 2'}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.get(f'/facility/tiles/{z}/{x}/{y}', headers={'If-None-Match': etag})
+    assert resp.status == 304
+
+    # Перемещение объекта сбрасывает тайл
+    resp = await cli.put(f'/facility/{facility_id}', data={'x': 37.6, 'y': 55.7}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.get(f'/facility/tiles/{z}/{x}/{y}', headers={'If-None-Match': etag})
+    assert resp.status == 200
+    assert (await resp.json())['markers'] == []
+
+    # Несуществующий тайл
+    resp = await cli.get('/facility/tiles/1/2/0')
+    assert resp.status == 400
+
+    # Объект на границе тайлов попадает только в тот тайл, который сбрасывается при его изменении
+    resp = await cli.post('/facility', data={'name': 'gym 3', 'x': 0, 'y': 10, 'type': 'Gym'}, headers=headers)
+    assert resp.status == 201
+    border_id = (await resp.json()).get('id')
+    assert point_tile(1, 0, 10) == (1, 0)
+    resp = await cli.get('/facility/tiles/1/0/0')
+    assert border_id not in [marker[0] for marker in (await resp.json())['markers']]
+    resp = await cli.get('/facility/tiles/1/1/0')
+    assert border_id in [marker[0] for marker in (await resp.json())['markers']]
+
+
+async def test_tile_store_clear(tmp_path):
+    tiles = TileStore(str(tmp_path))
+    tiles._write((1, 0, 0), b'{}')
+    (tmp_path / 'stale.tmp').write_bytes(b'')
+    assert tiles._read((1, 0, 0)) == b'{}'
+
+    await tiles.clear()
+    assert tiles._read((1, 0, 0)) is None
+    assert list(tmp_path.iterdir()) == []
+
+    # Тайлы изменившегося объекта удаляются с диска в пуле потоков
+    state = FacilityState(id=uuid.uuid4(), name='gym', x=10, y=20, type=None, hidden=False)
+    key = (5, *point_tile(5, state.x, state.y))
+    tiles._write(key, b'{}')
+    tiles._write((5, 0, 0), b'{}')
+    tiles.facility_changed(None, state)
+    await tiles._clearing
+    assert tiles._read(key) is None
+    assert tiles._read((5, 0, 0)) == b'{}'
+
+
+async def test_facility_cache(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    resp = await cli.post('/facility', data={'name': 'gym 1', 'x': 1, 'y': 2}, headers=headers)
+    assert resp.status == 201
+    facility_id = (await resp.json()).get('id')
+
+    cache = cli.server.app['facility_cache']
+
+    # Повторные чтения отдаются из кеша
+    for _ in range(3):
+        resp = await cli.get(f'/facility/{facility_id}')
+        assert (await resp.json()).get('name') == 'gym 1'
+        resp = await cli.get('/facility')
+        assert (await resp.json()).get('count') == 1
+    assert cache.stats()['misses'] == 2
+    assert cache.stats()['hits'] == 4
+
+    # После изменения объекта кеш сбрасывается
+    resp = await cli.put(f'/facility/{facility_id}', data={'name': 'gym 2'}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.get(f'/facility/{facility_id}')
+    assert (await resp.json()).get('name') == 'gym 2'
+    resp = await cli.get('/facility')
+    assert (await resp.json()).get('data')[0]['name'] == 'gym 2'
+
+    resp = await cli.post('/facility', data={'name': 'gym 3', 'x': 1, 'y': 2}, headers=headers)
+    assert resp.status == 201
+    resp = await cli.get('/facility')
+    assert (await resp.json()).get('count') == 2
+
+    resp = await cli.delete(f'/facility/{facility_id}', headers=headers)
+    assert resp.status == 204
+    resp = await cli.get(f'/facility/{facility_id}')
+    assert resp.status == 400
+
+
+async def test_facility_conditional_get(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    for name in ['gym 1', 'gym 2']:
+        resp = await cli.post('/facility', data={'name': name, 'x': 1, 'y': 2}, headers=headers)
+        assert resp.status == 201
+    facility_id = (await resp.json()).get('id')
+
+    resp = await cli.get('/facility')
+    assert resp.status == 200
+    catalog_etag = resp.headers['ETag']
+    assert resp.headers['Last-Modified']
+    resp = await cli.get(f'/facility/{facility_id}')
+    assert resp.status == 200
+    facility_etag = resp.headers['ETag']
+
+    # Актуальная версия: 304 как из кеша, так и по версии из базы
+    for _ in range(2):
+        resp = await cli.get('/facility', headers={'If-None-Match': catalog_etag})
+        assert resp.status == 304
+        assert resp.headers['ETag'] == catalog_etag
+        resp = await cli.get(f'/facility/{facility_id}', headers={'If-None-Match': facility_etag})
+        assert resp.status == 304
+        cli.server.app['facility_cache']._cache.clear()
+
+    resp = await cli.get('/facility', headers={'If-None-Match': '"outdated"'})
+    assert resp.status == 200
+    assert resp.headers['ETag'] == catalog_etag
+
+    # После изменения объекта версии меняются
+    resp = await cli.patch(f'/facility/{facility_id}', data={'hidden': True}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.get('/facility', headers={'If-None-Match': catalog_etag})
+    assert resp.status == 200
+    assert resp.headers['ETag'] != catalog_etag
+    resp = await cli.get(f'/facility/{facility_id}', headers={'If-None-Match': facility_etag})
+    assert resp.status == 200
+    assert (await resp.json()).get('hidden')
+
+
+async def test_facility_search_cursor(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    for i in range(7):
+        resp = await cli.post('/facility', data={'name': f'gym {i}', 'x': i % 3, 'y': 2}, headers=headers)
+        assert resp.status == 201
+
+    # Постраничная выдача по курсору: страницы не пересекаются и покрывают все объекты
+    for order_by, order_desc in [('name', False), ('x', True), (None, False)]:
+        query = {'limit': 3, 'order_desc': order_desc}
+        if order_by:
+            query['order_by'] = order_by
+        seen = []
+        pages = 0
+        while True:
+            resp = await cli.post('/facility/search', data=query)
+            assert resp.status == 200
+            resp_json = await resp.json()
+            seen += [f['id'] for f in resp_json['data']]
+            pages += 1
+            if resp_json['next_cursor'] is None:
+                break
+            query['cursor'] = resp_json['next_cursor']
+        assert pages == 3
+        assert len(seen) == len(set(seen)) == 7
+
+    resp = await cli.post('/facility/search', data={'limit': 3, 'order_by': 'name'})
+    cursor = (await resp.json())['next_cursor']
+    names = [f['name'] for f in (await resp.json())['data']]
+    assert names == ['gym 0', 'gym 1', 'gym 2']
+    resp = await cli.post('/facility/search', data={'limit': 3, 'order_by': 'name', 'cursor': cursor})
+    assert [f['name'] for f in (await resp.json())['data']] == ['gym 3', 'gym 4', 'gym 5']
+
+    # Курсор от другой сортировки
+    resp = await cli.post('/facility/search', data={'limit': 3, 'order_by': 'x', 'cursor': cursor})
+    assert resp.status == 422
+
+    # Некорректный курсор
+    resp = await cli.post('/facility/search', data={'limit': 3, 'order_by': 'name', 'cursor': 'INVALID'})
+    assert resp.status == 422
+
+    # Сортировка без keyset индекса
+    resp = await cli.post('/facility/search', data={'limit': 3, 'order_by': 'owner_name', 'cursor': cursor})
+    assert resp.status == 422
+
+    # Подделанный курсор правильного вида: id не UUID, значение не того типа, что колонка сортировки
+    for order_by, value, id in [
+        ('name', 'gym 2', 'not-a-uuid'),
+        ('name', 12, str(uuid.uuid4())),
+        ('x', 'not-a-number', str(uuid.uuid4())),
+        ('x', True, str(uuid.uuid4())),
+        ('id', 'not-a-uuid', str(uuid.uuid4())),
+        ('rank', 0.5, str(uuid.uuid4())),
+    ]:
+        forged = encode_cursor(order_by, False, (value, id))
+        resp = await cli.post('/facility/search', data={'limit': 3, 'order_by': order_by, 'cursor': forged})
+        assert resp.status == 422, (order_by, value, id)
+        assert 'cursor' in (await resp.json())['detail']
+
+
+async def test_facility_search_text(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    facilities = [
+        {'name': 'Бассейн Дельфин', 'x': 1, 'y': 1, 'owner_name': 'Иванов Иван'},
+        {'name': 'Стадион Труд', 'x': 2, 'y': 2, 'notes': 'Рядом с бассейном'},
+        {'name': 'Спортивный зал', 'x': 3, 'y': 3, 'who_can_use': 'Школьники', 'open_hours': 'с 9 до 21'},
+    ]
+    for facility in facilities:
+        resp = await cli.post('/facility', data=facility, headers=headers)
+        assert resp.status == 201
+
+    # Поиск по разным полям с учетом словоформ
+    resp = await cli.post('/facility/search', data={'q': 'бассейны'})
+    assert resp.status == 200
+    assert {f['name'] for f in (await resp.json())['data']} == {'Бассейн Дельфин', 'Стадион Труд'}
+
+    resp = await cli.post('/facility/search', data={'q': 'Иванов'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Бассейн Дельфин']
+
+    resp = await cli.post('/facility/search', data={'q': 'школьник'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Спортивный зал']
+
+    resp = await cli.post('/facility/search', data={'q': 'теннис'})
+    assert (await resp.json())['count'] == 0
+
+    # Сортировка по релевантности: совпадение в имени важнее совпадения в примечаниях
+    resp = await cli.post('/facility/search', data={'q': 'бассейн', 'order_by': 'rank'})
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert [f['name'] for f in resp_json['data']] == ['Бассейн Дельфин', 'Стадион Труд']
+    assert resp_json['next_cursor'] is None
+
+    # Изменение объекта обновляет поисковый вектор
+    facility_id = resp_json['data'][1]['id']
+    resp = await cli.put(f'/facility/{facility_id}', data={'notes': 'Теннисный корт'}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.post('/facility/search', data={'q': 'корты'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Стадион Труд']
+
+    # Сортировка по релевантности без строки поиска
+    resp = await cli.post('/facility/search', data={'order_by': 'rank'})
+    assert resp.status == 422
+
+
+async def test_facility_suggest(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    ids = {}
+    for name in ['Бассейн Дельфин', 'Бассейн Волна', 'Стадион Труд', 'Ледовая арена']:
+        resp = await cli.post('/facility', data={'name': name, 'x': 1, 'y': 1}, headers=headers)
+        assert resp.status == 201
+        ids[name] = (await resp.json())['id']
+
+    # Поиск по началу имени и по началу любого слова, без учета регистра
+    resp = await cli.get('/facility/suggest', params={'prefix': 'бАсс'})
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert resp_json['count'] == 2
+    assert [f['name'] for f in resp_json['data']] == ['Бассейн Волна', 'Бассейн Дельфин']
+    assert resp_json['data'][0]['id'] == ids['Бассейн Волна']
+
+    resp = await cli.get('/facility/suggest', params={'prefix': 'дел'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Бассейн Дельфин']
+
+    resp = await cli.get('/facility/suggest', params={'prefix': 'бассейн в'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Бассейн Волна']
+
+    resp = await cli.get('/facility/suggest', params={'prefix': 'б', 'limit': 1})
+    assert (await resp.json())['count'] == 1
+
+    # Подсказки следят за изменениями объектов
+    resp = await cli.put(f'/facility/{ids["Стадион Труд"]}', data={'name': 'Стадион Бастион'}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.patch(f'/facility/{ids["Бассейн Волна"]}', data={'hidden': True}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.delete(f'/facility/{ids["Ледовая арена"]}', headers=headers)
+    assert resp.status == 204
+
+    resp = await cli.get('/facility/suggest', params={'prefix': 'бас'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Бассейн Дельфин', 'Стадион Бастион']
+    resp = await cli.get('/facility/suggest', params={'prefix': 'стадион'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Стадион Бастион']
+
+    # Ошибки валидации
+    resp = await cli.get('/facility/suggest')
+    assert resp.status == 422
+    resp = await cli.get('/facility/suggest', params={'prefix': 'бас', 'limit': 1000})
+    assert resp.status == 422
+
+
+async def test_facility_suggest_typo(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    for name in ['Бассейн Дельфин', 'Стадион Труд']:
+        resp = await cli.post('/facility', data={'name': name, 'x': 1, 'y': 1}, headers=headers)
+        assert resp.status == 201
+
+    # Имя с опечаткой находится нечетким поиском по триграммам
+    resp = await cli.get('/facility/suggest', params={'prefix': 'басеин'})
+    assert resp.status == 200
+    assert [f['name'] for f in (await resp.json())['data']] == ['Бассейн Дельфин']
+
+    resp = await cli.get('/facility/suggest', params={'prefix': 'дельфинн'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Бассейн Дельфин']
+
+
+async def test_facility_import(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    # Без аутентификации импорт запрещен
+    resp = await cli.post('/facility/import?format=csv', data=b'name,x,y\n')
+    assert resp.status == 401
+
+    # CSV: значение с переводом строки, строчка с ошибкой и повтор имени
+    body = (
+        'name,x,y,type,notes,hidden\n'
+        'Бассейн Дельфин,30.1,59.9,Pool,"Раздевалки,\nдушевые",\n'
+        'Стадион Труд,30.2,59.8,Other,,false\n'
+        'Ледовая арена,not a number,59.7,,,\n'
+        'Бассейн Дельфин,30.3,59.6,,,\n'
+    ).encode()
+    resp = await cli.post('/facility/import', data=body, headers={**headers, 'Content-Type': 'text/csv'})
+    assert resp.status == 200
+    report = await resp.json()
+    assert {k: report[k] for k in ('received', 'inserted', 'updated', 'unchanged', 'failed')} == {
+        'received': 4, 'inserted': 2, 'updated': 0, 'unchanged': 0, 'failed': 2
+    }
+    assert [e['row'] for e in report['errors']] == [3, 4]
+    assert 'x' in report['errors'][0]['errors']
+    assert 'name' in report['errors'][1]['errors']
+
+    resp = await cli.get('/facility')
+    facilities = {f['name']: f for f in (await resp.json())['data']}
+    assert set(facilities) == {'Бассейн Дельфин', 'Стадион Труд'}
+    assert facilities['Бассейн Дельфин']['notes'] == 'Раздевалки,\nдушевые'
+    assert facilities['Бассейн Дельфин']['type'] == 'FacilityTypes.Pool'
+    assert facilities['Бассейн Дельфин']['hidden'] is False
+
+    # NDJSON: обновление, объект без изменений, GeoJSON Feature и неправильный JSON
+    lines = [
+        {'name': 'Бассейн Дельфин', 'x': 30.1, 'y': 59.9, 'type': 'Pool', 'notes': 'Раздевалки,\nдушевые'},
+        {'name': 'Стадион Труд', 'x': 31, 'y': 59.8, 'type': 'Other'},
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [30.5, 59.5]},
+         'properties': {'name': 'Ледовая арена', 'type': 'SkatingRink'}},
+    ]
+    body = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines) + '{not json\n'
+    resp = await cli.post('/facility/import?format=ndjson', data=body.encode(), headers=headers)
+    assert resp.status == 200
+    report = await resp.json()
+    assert {k: report[k] for k in ('received', 'inserted', 'updated', 'unchanged', 'failed')} == {
+        'received': 4, 'inserted': 1, 'updated': 1, 'unchanged': 1, 'failed': 1
+    }
+    assert report['errors'] == [{'row': 4, 'errors': {'_schema': ['invalid JSON']}}]
+
+    resp = await cli.get('/facility')
+    facilities = {f['name']: f for f in (await resp.json())['data']}
+    assert facilities['Стадион Труд']['x'] == 31
+    assert facilities['Ледовая арена']['x'] == 30.5
+    assert facilities['Ледовая арена']['y'] == 59.5
+
+    # GeoJSON FeatureCollection, геометрия не точка
+    collection = {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [30.6, 59.4]},
+             'properties': {'name': 'Теннисный корт'}},
+            {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[30, 59], [31, 60]]},
+             'properties': {'name': 'Беговая дорожка'}},
+        ],
+    }
+    resp = await cli.post(
+        '/facility/import', data=json.dumps(collection).encode(),
+        headers={**headers, 'Content-Type': 'application/geo+json'}
+    )
+    assert resp.status == 200
+    report = await resp.json()
+    assert report['inserted'] == 1
+    assert report['errors'] == [{'row': 2, 'errors': {'geometry': ['geometry must be a Point']}}]
+
+    # Структуры данных в памяти узнают об импортированных объектах
+    resp = await cli.get('/facility/suggest', params={'prefix': 'тенн'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Теннисный корт']
+    resp = await cli.get('/facility/clusters', params={'min_x': 30, 'min_y': 59, 'max_x': 32, 'max_y': 60, 'zoom': 0})
+    assert sum(c['count'] for c in (await resp.json())['data']) == 4
+
+    # Неизвестный формат и документ, который не разобрать
+    resp = await cli.post('/facility/import', data=b'name,x,y\n', headers=headers)
+    assert resp.status == 422
+    resp = await cli.post('/facility/import?format=xml', data=b'<facility/>', headers=headers)
+    assert resp.status == 422
+    resp = await cli.post('/facility/import?format=geojson', data=b'[]', headers=headers)
+    assert resp.status == 422
+
+
+async def test_facility_import_large_body(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    # Записи длиннее 128 КиБ (предела строчки StreamReader) загружаются,
+    # записи длиннее MAX_RECORD_SIZE попадают в отчет как ошибки строчек
+    notes = 'court ' * 30000
+    too_large = 'x' * (MAX_RECORD_SIZE + 1)
+
+    body = f'name,x,y,notes\nКорт 1,30.1,59.9,{notes}\nКорт 2,30.2,59.8,{too_large}\nКорт 3,30.3,59.7,\n'
+    resp = await cli.post('/facility/import?format=csv', data=body.encode(), headers=headers)
+    assert resp.status == 200
+    report = await resp.json()
+    assert (report['inserted'], report['failed']) == (2, 1)
+    assert report['errors'] == [{'row': 2, 'errors': {'_schema': [f'row is larger than {MAX_RECORD_SIZE} bytes']}}]
+
+    lines = [
+        {'name': 'Корт 4', 'x': 30.4, 'y': 59.6, 'notes': notes},
+        {'name': 'Корт 5', 'x': 30.5, 'y': 59.5, 'notes': too_large},
+        {'name': 'Корт 6', 'x': 30.6, 'y': 59.4},
+    ]
+    body = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+    resp = await cli.post('/facility/import?format=ndjson', data=body.encode(), headers=headers)
+    assert resp.status == 200
+    report = await resp.json()
+    assert (report['inserted'], report['failed']) == (2, 1)
+    assert [e['row'] for e in report['errors']] == [2]
+
+    # Документ GeoJSON без переводов строки разбирается целиком
+    collection = {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [30.7 + i / 1000, 59.3]},
+             'properties': {'name': f'Площадка {i}', 'notes': 'court ' * 100}}
+            for i in range(300)
+        ],
+    }
+    body = json.dumps(collection, separators=(',', ':')).encode()
+    assert len(body) > 128 * 1024 and b'\n' not in body
+    resp = await cli.post('/facility/import?format=geojson', data=body, headers=headers)
+    assert resp.status == 200
+    report = await resp.json()
+    assert (report['inserted'], report['failed']) == (300, 0)
+
+    resp = await cli.get('/facility', params={'limit': 1000})
+    facilities = {f['name']: f for f in (await resp.json())['data']}
+    assert len(facilities) == 304
+    assert facilities['Корт 1']['notes'] == notes
+    assert facilities['Корт 4']['notes'] == notes
+
+
+async def test_facility_import_many(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    clusters_params = {'min_x': -90, 'min_y': -90, 'max_x': 90, 'max_y': 90, 'zoom': 0}
+    resp = await cli.get('/facility/clusters', params=clusters_params)
+    assert (await resp.json())['data'] == []
+    clusters = cli.server.app['clusters']
+    assert clusters._loaded
+
+    # При массовом изменении структуры в памяти не применяют изменения по одному, а перестраиваются
+    count = MAX_APPLIED_CHANGES + 1
+    body = 'name,x,y\n' + ''.join(f'Площадка {i},{i % 90},{i % 45}\n' for i in range(count))
+    resp = await cli.post('/facility/import?format=csv', data=body.encode(), headers=headers)
+    assert (await resp.json())['inserted'] == count
+    assert not clusters._loaded
+
+    resp = await cli.get('/facility/clusters', params=clusters_params)
+    assert sum(c['count'] for c in (await resp.json())['data']) == count
+    resp = await cli.get('/facility/suggest', params={'prefix': 'площадка 1000'})
+    assert [f['name'] for f in (await resp.json())['data']] == ['Площадка 1000']
+
+
+async def test_facility_export(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    facilities = [
+        {'name': 'Бассейн "Дельфин", корпус 2', 'x': 30.1, 'y': 59.9, 'type': 'Pool', 'notes': 'Раздевалки\nдушевые'},
+        {'name': 'Стадион Труд', 'x': 30.2, 'y': 59.8, 'eps': 12, 'is_accessible_for_disabled': True},
+    ]
+    for facility in facilities:
+        resp = await cli.post('/facility', data=facility, headers=headers)
+        assert resp.status == 201
+
+    resp = await cli.get('/facility')
+    expected = {f['name']: f for f in (await resp.json())['data']}
+
+    # NDJSON: объекты такие же, как в ответах API
+    resp = await cli.get('/facility/export')
+    assert resp.status == 200
+    assert resp.content_type == 'application/x-ndjson'
+    assert 'facilities.ndjson' in resp.headers['Content-Disposition']
+    lines = (await resp.read()).decode().splitlines()
+    assert {f['name']: f for f in map(json.loads, lines)} == expected
+
+    # GeoJSON
+    resp = await cli.get('/facility/export', params={'format': 'geojson'})
+    assert resp.status == 200
+    collection = await resp.json(content_type=None)
+    assert collection['type'] == 'FeatureCollection'
+    features = {f['properties']['name']: f for f in collection['features']}
+    assert {name: f['properties'] for name, f in features.items()} == expected
+    pool = features['Бассейн "Дельфин", корпус 2']
+    assert pool['geometry'] == {'type': 'Point', 'coordinates': [30.1, 59.9]}
+    assert pool['id'] == expected['Бассейн "Дельфин", корпус 2']['id']
+
+    # CSV: enum именами, его можно загрузить обратно импортом
+    resp = await cli.get('/facility/export', params={'format': 'csv'}, headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 200
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    rows = list(csv.DictReader(io.StringIO((await resp.read()).decode())))
+    assert len(rows) == 2
+    rows = {row['name']: row for row in rows}
+    assert rows['Бассейн "Дельфин", корпус 2']['type'] == 'Pool'
+    assert rows['Бассейн "Дельфин", корпус 2']['notes'] == 'Раздевалки\nдушевые'
+    assert rows['Стадион Труд']['is_accessible_for_disabled'] == 'true'
+    assert rows['Стадион Труд']['type'] == ''
+
+    # Без колонки id выгрузка загружается обратно без изменений
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, [field for field in next(iter(rows.values())) if field != 'id'])
+    writer.writeheader()
+    writer.writerows([{k: v for k, v in row.items() if k != 'id'} for row in rows.values()])
+    resp = await cli.post('/facility/import?format=csv', data=buffer.getvalue().encode(), headers=headers)
+    report = await resp.json()
+    assert (report['unchanged'], report['failed']) == (2, 0)
+
+    # Неизвестный формат
+    resp = await cli.get('/facility/export', params={'format': 'xml'})
+    assert resp.status == 422
+    assert 'format' in (await resp.json())['detail']
+
+
+async def test_facility_export_arrow(cli: ClientSession):
+    pa = pytest.importorskip('pyarrow')
+
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+    resp = await cli.post('/admin/login', data=create_user_data)
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    for facility in [
+        {'name': 'Бассейн Дельфин', 'x': 30.1, 'y': 59.9, 'type': 'Pool', 'eps': 12},
+        {'name': 'Стадион Труд', 'x': 30.2, 'y': 59.8, 'hidden': True},
+    ]:
+        resp = await cli.post('/facility', data=facility, headers=headers)
+        assert resp.status == 201
+
+    resp = await cli.get('/facility/export', params={'format': 'arrow'})
+    assert resp.status == 200
+    assert resp.content_type == 'application/vnd.apache.arrow.stream'
+    table = pa.ipc.open_stream(await resp.read()).read_all()
+    assert table.num_rows == 2
+    assert table.schema.field('x').type == pa.float64()
+    assert table.schema.field('type').type == pa.dictionary(pa.int8(), pa.string())
+    rows = {row['name']: row for row in table.to_pylist()}
+    assert rows['Бассейн Дельфин']['type'] == 'Pool'
+    assert rows['Бассейн Дельфин']['eps'] == 12
+    assert rows['Стадион Труд']['type'] is None
+    assert rows['Стадион Труд']['hidden'] is True
+
+
+async def test_facility_batch(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    ids = []
+    for i in range(5):
+        resp = await cli.post('/facility', data={'name': f'gym {i}', 'x': i, 'y': i}, headers=headers)
+        assert resp.status == 201
+        ids.append((await resp.json())['id'])
+
+    # Один объект уже в кеше, остальные загружаются одним запросом
+    resp = await cli.get(f'/facility/{ids[1]}')
+    assert resp.status == 200
+    cached = await resp.json()
+
+    missing = '00000000-0000-0000-0000-000000000000'
+    requested = [ids[3], ids[1], missing, ids[0], ids[3]]
+    resp = await cli.post('/facility/batch', data={'ids': requested})
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert resp_json['count'] == 3
+    assert [f['id'] for f in resp_json['data']] == [ids[3], ids[1], ids[0]]
+    assert resp_json['data'][1] == cached
+    assert resp_json['missing'] == [missing]
+
+    # Изменение объекта видно и в пакетном получении
+    resp = await cli.put(f'/facility/{ids[1]}', data={'name': 'gym renamed'}, headers=headers)
+    assert resp.status == 200
+    resp = await cli.post('/facility/batch', data={'ids': [ids[1]]})
+    assert (await resp.json())['data'][0]['name'] == 'gym renamed'
+
+    # Ошибки валидации
+    resp = await cli.post('/facility/batch', data={'ids': []})
+    assert resp.status == 422
+    resp = await cli.post('/facility/batch', data={'ids': ['not uuid']})
+    assert resp.status == 422
+    resp = await cli.post('/facility/batch', data={'ids': [missing] * 501})
+    assert resp.status == 422
+
+
+async def test_facility_bulk(cli: ClientSession):
+    # Успешное создание пользователя
+    create_user_data = {
+        'email': 'user@example.com',
+        'password': 'hackme'
+    }
+    resp = await cli.post('/admin/users', data=create_user_data)
+    assert resp.status == 201
+
+    # Успешная аутентификация
+    resp = await cli.post('/admin/login', data=create_user_data)
+    assert resp.status == 200
+    access_token = (await resp.json()).get('access_token')
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    ids = []
+    for i in range(6):
+        resp = await cli.post('/facility', data={'name': f'gym {i}', 'x': i, 'y': i, 'eps': i}, headers=headers)
+        assert resp.status == 201
+        ids.append((await resp.json())['id'])
+
+    # Кластеры до изменения уже построены
+    clusters_params = {'min_x': -1, 'min_y': -1, 'max_x': 10, 'max_y': 10, 'zoom': 0}
+    resp = await cli.get('/facility/clusters', params=clusters_params)
+    assert resp.status == 200
+    assert sum(c['count'] for c in (await resp.json())['data']) == 6
+
+    # Без токена нельзя
+    resp = await cli.post('/facility/bulk/update', data={'ids': ids, 'patch': {'hidden': True}})
+    assert resp.status == 401
+
+    # dry_run только считает подходящие объекты
+    bulk_data = {'filters': [{'field': 'eps', 'gt': 4}], 'patch': {'hidden': True}, 'dry_run': True}
+    resp = await cli.post('/facility/bulk/update', data=bulk_data, headers=headers)
+    assert resp.status == 200
+    assert await resp.json() == {'count': 2, 'ids': [], 'dry_run': True}
+    resp = await cli.get(f'/facility/{ids[4]}')
+    assert (await resp.json()).get('hidden') is not True
+
+    # Подходит больше объектов, чем limit - ничего не изменяется
+    bulk_data = {'filters': [{'field': 'eps', 'gt': 4}], 'patch': {'hidden': True}, 'limit': 1}
+    resp = await cli.post('/facility/bulk/update', data=bulk_data, headers=headers)
+    assert resp.status == 422
+    resp = await cli.get(f'/facility/{ids[4]}')
+    assert (await resp.json()).get('hidden') is not True
+
+    # Изменение по условиям
+    bulk_data = {'filters': [{'field': 'eps', 'gt': 4}], 'patch': {'hidden': True, 'type': 'Gym'}}
+    resp = await cli.post('/facility/bulk/update', data=bulk_data, headers=headers)
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert resp_json['count'] == 2
+    assert sorted(resp_json['ids']) == sorted(ids[4:])
+    for id in ids[4:]:
+        resp = await cli.get(f'/facility/{id}')
+        assert resp.status == 200
+        resp_json = await resp.json()
+        assert resp_json['hidden'] is True
+        assert resp_json['type'] == 'FacilityTypes.Gym'
+
+    # Наблюдатели узнали об изменении: спрятанные объекты пропали из кластеров
+    resp = await cli.get('/facility/clusters', params=clusters_params)
+    assert sum(c['count'] for c in (await resp.json())['data']) == 4
+
+    # Удаление по списку id, несуществующие id не считаются
+    missing = '00000000-0000-0000-0000-000000000000'
+    resp = await cli.post('/facility/bulk/delete', data={'ids': [ids[0], ids[1], missing]}, headers=headers)
+    assert resp.status == 200
+    resp_json = await resp.json()
+    assert resp_json['count'] == 2
+    assert sorted(resp_json['ids']) == sorted(ids[:2])
+    resp = await cli.get(f'/facility/{ids[0]}')
+    assert resp.status == 400
+    resp = await cli.get('/facility/clusters', params=clusters_params)
+    assert sum(c['count'] for c in (await resp.json())['data']) == 2
+
+    # Ошибки валидации
+    for bulk_data in (
+            {'patch': {'hidden': True}},  # не выбраны объекты
+            {'ids': ids, 'q': 'gym', 'patch': {'hidden': True}},  # и ids, и условия
+            {'ids': ids, 'patch': {}},  # пустой patch
+            {'ids': ids, 'patch': {'name': 'same name'}},  # имя нельзя менять массово
+            {'ids': ids, 'patch': {'hidden': True}, 'limit': 1001},
+            {'filters': [], 'patch': {'hidden': True}},
+    ):
+        resp = await cli.post('/facility/bulk/update', data=bulk_data, headers=headers)
+        assert resp.status == 422, bulk_data
+
+    # Фильтр без условий или по неизвестному полю не удаляет объекты
+    for filters in (
+            [{'field': 'eps'}],
+            [{'field': 'eps', 'gt': 4}, {'field': 'x'}],
+            [{'field': 'no_such_column', 'gt': 0}],
+            [{'field': 'search_vector', 'eq': 'gym'}],
+            [{'gt': 0}],
+    ):
+        resp = await cli.post('/facility/bulk/delete', data={'filters': filters}, headers=headers)
+        assert resp.status == 422, filters
+        resp = await cli.post('/facility/search', data={'filters': filters})
+        assert resp.status == 422, filters
+    resp = await cli.post('/facility/bulk/delete', data={'filters': [{'field': 'eps', 'gt': 0}], 'dry_run': True},
+                          headers=headers)
+    assert (await resp.json())['count'] == 4
+
+    # Условие с нулем - тоже условие
+    resp = await cli.post('/facility/search', data={'filters': [{'field': 'eps', 'lt': 0}]})
+    assert resp.status == 200
+    assert (await resp.json())['count'] == 0
+
+
+async def test_catalog_version(setup_db):
+    # Сумма времен изменения больше 2^53 микросекунд и должна считаться в базе точно
+    start = datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+    version = CatalogVersion()
+    async with setup_db() as session:
+        for i in range(10):
+            modified_at = start + timedelta(days=i, microseconds=i * 7919)
+            facility = Facility(name=f'gym {i}', x=1, y=2)
+            facility.updated_at = modified_at
+            session.add(facility)
+            version.add(modified_at)
+        await session.commit()
+        assert await Facility.get_catalog_version(session) == version.tuple()
@@ -0,0 +1,58 @@
+import jwt as pyjwt
+import pytest
+
+from api.jwt import JWT, JWTException
+from settings import parse_jwt_keys
+
+
+def test_parse_jwt_keys():
+    assert parse_jwt_keys('new:secret2, old:secret1') == [('new', 'secret2'), ('old', 'secret1')]
+    assert parse_jwt_keys('# ключи\nnew:a:b\n\nold:c\n') == [('new', 'a:b'), ('old', 'c')]
+
+    for text in ('', 'secret', ':secret', 'kid:', 'a:1,a:2'):
+        with pytest.raises(ValueError):
+            parse_jwt_keys(text)
+
+
+def test_jwt_keys():
+    old = JWT([('old', 'secret1')])
+    access_token, refresh_token, _ = old.create_jwt('user@example.com')
+
+    # Токен принимает любой экземпляр с теми же ключами
+    assert JWT([('old', 'secret1')]).verify_access_token(access_token) == 'user@example.com'
+
+    # После смены ключа старые токены еще принимаются, а новые подписываются новым ключом
+    rotated = JWT([('new', 'secret2'), ('old', 'secret1')])
+    assert rotated.verify_access_token(access_token) == 'user@example.com'
+    new_access_token, _, _ = rotated.refresh_jwt(access_token, refresh_token)
+    assert rotated.verify_access_token(new_access_token) == 'user@example.com'
+
+    # Токен, подписанный ключом, которого нет, или с чужой подписью, не принимается
+    with pytest.raises(JWTException):
+        old.verify_access_token(new_access_token)
+    with pytest.raises(JWTException):
+        JWT([('old', 'other secret')]).verify_access_token(access_token)
+    with pytest.raises(JWTException):
+        JWT([('new', 'secret2')]).verify_access_token(access_token)
+
+
+def test_verify_access_token(monkeypatch):
+    jwt = JWT([('key', 'secret')])
+    access_token, _, _ = jwt.create_jwt('user@example.com')
+    assert jwt.verify_access_token(access_token) == 'user@example.com'
+
+    # Проверенный токен больше не декодируется
+    def decode(*args, **kwargs):
+        raise AssertionError('token is decoded again')
+    with monkeypatch.context() as m:
+        m.setattr(pyjwt, 'decode', decode)
+        assert jwt.verify_access_token(access_token) == 'user@example.com'
+
+    # Истекший токен не принимается и не запоминается
+    jwt.TOKEN_TTL_SECONDS = -1
+    expired_access_token, _, _ = jwt.create_jwt('user@example.com')
+    for _ in range(2):
+        with pytest.raises(JWTException):
+            jwt.verify_access_token(expired_access_token)
+    with pytest.raises(JWTException):
+        jwt.verify_access_token('not a token')
@@ -0,0 +1,81 @@
+import dataclasses
+import json
+import logging
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from aiohttp.web_log import AccessLogger
+
+import logs
+from logs import JsonFormatter, access_logger_class, setup_logging
+from settings import Settings, parse_log_levels
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    logs._stop_listener()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    logging.getLogger('test.logs').setLevel(logging.NOTSET)
+
+
+def test_parse_log_levels():
+    assert parse_log_levels('api.timing=debug, aiohttp.access=WARNING,') == [
+        ('api.timing', logging.DEBUG), ('aiohttp.access', logging.WARNING)
+    ]
+    for text in ('api.timing', '=DEBUG', 'api.timing=LOUD'):
+        with pytest.raises(ValueError):
+            parse_log_levels(text)
+
+
+def test_json_formatter():
+    try:
+        raise ValueError('ошибка')
+    except ValueError as e:
+        record = logging.getLogger('test.logs').makeRecord(
+            'test.logs', logging.ERROR, __file__, 1, 'failed %s', ('запрос',), (type(e), e, e.__traceback__),
+            extra={'status': 500}
+        )
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['level'] == 'ERROR'
+    assert entry['logger'] == 'test.logs'
+    assert entry['message'] == 'failed запрос'
+    assert entry['status'] == 500
+    assert 'ValueError: ошибка' in entry['exception']
+    assert 'args' not in entry and 'msg' not in entry
+
+
+def test_setup_logging(restore_logging, capsys):
+    settings = dataclasses.replace(
+        Settings.new(), API_LOG_LEVEL=logging.INFO, API_LOG_LEVELS=[('test.logs', logging.DEBUG)], API_LOG_FORMAT='json'
+    )
+    setup_logging(settings)
+
+    logging.getLogger('test.logs').debug('debug %d', 1)
+    logging.getLogger('test.other').debug('skipped')
+    logging.getLogger('test.other').info('info')
+    # Остановка дописывает записи из очереди
+    logs._stop_listener()
+
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [(line['logger'], line['message']) for line in lines] == [('test.logs', 'debug 1'), ('test.other', 'info')]
+
+
+def test_access_log_sample(caplog):
+    request = make_mocked_request('GET', '/ping')
+    response = web.Response()
+    with caplog.at_level(logging.INFO, logger='aiohttp.access'):
+        access_logger_class(0)(logging.getLogger('aiohttp.access'), AccessLogger.LOG_FORMAT).log(
+            request, response, 0.01
+        )
+        assert not caplog.records
+
+        access_logger_class(1)(logging.getLogger('aiohttp.access'), AccessLogger.LOG_FORMAT).log(
+            request, response, 0.01
+        )
+        assert len(caplog.records) == 1
+        assert '"GET /ping HTTP/1.1" 200' in caplog.records[0].getMessage()
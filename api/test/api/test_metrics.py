@@ -0,0 +1,77 @@
+import sqlalchemy as sa
+from aiohttp.test_utils import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from api.metrics import Histogram, TimedPool
+from settings import Settings
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    metrics = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            metrics[name] = float(value)
+    return metrics
+
+
+def test_histogram():
+    histogram = Histogram((1, 10))
+    for value in (0.5, 1, 5, 100):
+        histogram.observe(value)
+    lines = []
+    histogram.render('size', 'route="/"', lines)
+    assert lines == [
+        'size_bucket{route="/",le="1"} 2',
+        'size_bucket{route="/",le="10"} 3',
+        'size_bucket{route="/",le="+Inf"} 4',
+        'size_sum{route="/"} 106.5',
+        'size_count{route="/"} 4',
+    ]
+
+
+async def test_metrics(cli: TestClient):
+    resp = await cli.post('/facility/batch', data={'ids': ['00000000-0000-0000-0000-000000000000']})
+    assert resp.status == 200
+    for _ in range(2):
+        resp = await cli.get('/facility/00000000-0000-0000-0000-000000000000')
+        assert resp.status == 400
+    resp = await cli.get('/no/such/path')
+    assert resp.status == 404
+
+    resp = await cli.get('/metrics')
+    assert resp.status == 200
+    assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    metrics = parse_metrics(await resp.text())
+
+    # Маршрут в метриках - путь из таблицы маршрутов, а не запрошенный
+    route = 'route="/facility/{id}",method="GET"'
+    assert metrics[f'http_requests_total{{{route},status="400"}}'] == 2
+    assert metrics[f'http_request_duration_seconds_count{{{route}}}'] == 2
+    assert metrics[f'http_requests_in_flight{{{route}}}'] == 0
+    assert metrics['http_requests_total{route="unmatched",method="GET",status="404"}'] == 1
+
+    batch = 'route="/facility/batch",method="POST"'
+    assert metrics[f'http_requests_total{{{batch},status="200"}}'] == 1
+    assert metrics[f'http_request_size_bytes_sum{{{batch}}}'] > 0
+    assert metrics[f'http_response_size_bytes_bucket{{{batch},le="100"}}'] == 1
+
+    # Запрос к /metrics в процессе обработки, пока метрики выгружаются
+    assert metrics['http_requests_in_flight{route="/metrics",method="GET"}'] == 1
+
+    assert metrics['db_pool_checked_out{pool="primary"}'] == 0
+    assert metrics['cache_misses_total{cache="facility"}'] >= 1
+    assert 'cache_hit_ratio{cache="tiles"}' in metrics
+
+
+async def test_timed_pool(setup_db):
+    engine = create_async_engine(Settings.new().API_DB_URL, poolclass=TimedPool, pool_size=1, max_overflow=0)
+    try:
+        for _ in range(3):
+            async with engine.connect() as conn:
+                await conn.execute(sa.text('SELECT 1'))
+        wait = engine.sync_engine.pool.wait
+        assert sum(wait.counts) == 3
+        assert wait.sum > 0
+    finally:
+        await engine.dispose()
@@ -0,0 +1,96 @@
+import logging
+
+import pytest
+import sqlalchemy as sa
+from aiohttp import ClientPayloadError, web
+
+from api.middlewares import autocommit, error_middleware, read_only, snapshot, transaction_middleware
+from api.payloads import stream_json_list
+
+
+def _state_handler():
+    # Отдельная функция на каждый маршрут: декоратор режима записывает его в атрибут обработчика
+    async def handler(request: web.Request) -> web.Response:
+        return await _state(request)
+    return handler
+
+
+async def _state(request: web.Request) -> web.Response:
+    session = request['session']
+    read_only_setting = (await session.execute(sa.text('SHOW transaction_read_only'))).scalar()
+    isolation = (await session.execute(sa.text('SHOW transaction_isolation'))).scalar()
+    first = (await session.execute(sa.text('SELECT txid_current()'))).scalar()
+    second = (await session.execute(sa.text('SELECT txid_current()'))).scalar()
+    return web.json_response({
+        'read_only': read_only_setting, 'isolation': isolation, 'same_transaction': first == second
+    })
+
+
+async def _nothing(request: web.Request) -> web.Response:
+    return web.json_response({})
+
+
+async def test_transaction_modes(aiohttp_client, setup_db):
+    app = web.Application(middlewares=[transaction_middleware])
+    app['sessionmaker'] = setup_db
+    app.router.add_get('/read_write', _state_handler())
+    app.router.add_get('/read_only', read_only(_state_handler()))
+    app.router.add_get('/snapshot', snapshot(_state_handler()))
+    app.router.add_get('/autocommit', autocommit(_state_handler()))
+    app.router.add_get('/nothing', _nothing)
+    cli = await aiohttp_client(app)
+
+    checkouts = []
+    pool = setup_db.kw['bind'].sync_engine.pool
+    sa.event.listen(pool, 'checkout', lambda *args: checkouts.append(args))
+
+    # Обычная транзакция
+    resp = await cli.get('/read_write')
+    assert resp.status == 200
+    assert await resp.json() == {'read_only': 'off', 'isolation': 'read committed', 'same_transaction': True}
+
+    # Транзакция READ ONLY
+    resp = await cli.get('/read_only')
+    assert resp.status == 200
+    assert await resp.json() == {'read_only': 'on', 'isolation': 'read committed', 'same_transaction': True}
+
+    # Транзакция READ ONLY со снимком базы на все запросы
+    resp = await cli.get('/snapshot')
+    assert resp.status == 200
+    assert await resp.json() == {'read_only': 'on', 'isolation': 'repeatable read', 'same_transaction': True}
+
+    # Без транзакции каждый запрос выполняется отдельно
+    resp = await cli.get('/autocommit')
+    assert resp.status == 200
+    assert await resp.json() == {'read_only': 'off', 'isolation': 'read committed', 'same_transaction': False}
+
+    # Настройки режима не остаются на соединении, вернувшемся в пул
+    resp = await cli.get('/read_write')
+    assert await resp.json() == {'read_only': 'off', 'isolation': 'read committed', 'same_transaction': True}
+    assert len(checkouts) == 5
+
+    # Обработчик, не обращающийся к базе, соединение не берет
+    resp = await cli.get('/nothing')
+    assert resp.status == 200
+    assert len(checkouts) == 5
+
+
+async def test_stream_error_after_prepare(aiohttp_client, caplog):
+    async def rows():
+        yield {'id': 1}
+        raise RuntimeError('cursor failed')
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        return await stream_json_list(request, rows())
+
+    app = web.Application(middlewares=[error_middleware])
+    app.router.add_get('/stream', handler)
+    cli = await aiohttp_client(app)
+
+    # Заголовки уже отправлены: соединение обрывается, второй ответ с ошибкой не отправляется
+    with caplog.at_level(logging.ERROR):
+        resp = await cli.get('/stream')
+        assert resp.status == 200
+        with pytest.raises(ClientPayloadError):
+            await resp.read()
+    assert [record.name for record in caplog.records] == ['api.payloads']
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+from marshmallow import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.payloads import dumps
+from api.schemas.facility import FacilityRequest, FacilityResponse
+from api.serializers import load_facility, serialize_facility, serialize_facility_row
+from db import Facility
+from db.facility_rows import FacilityRows
+from db.facility import FacilityCoveringTypes, FacilityPayingTypes, FacilityPropertyForms, FacilityTypes
+
+
+async def test_serialize_facility(setup_db):
+    async with setup_db() as session:
+        session: AsyncSession
+        await session.begin()
+
+        session.add(Facility(name='Пустой', x=0, y=0))
+        session.add(Facility(
+            name='Зал "Олимп"\n\\ ё',
+            x=37.5,
+            y=-55.25,
+            type=FacilityTypes.Gym,
+            owner_name='Иванов',
+            property_form=FacilityPropertyForms.Municipal,
+            length=1e20,
+            width=0.1,
+            area=100,
+            actual_workload=0,
+            annual_capacity=123456,
+            notes='табуляция\tи пробелы  ',
+            converting_type=FacilityCoveringTypes.Polymer,
+            is_accessible_for_disabled=False,
+            paying_type=FacilityPayingTypes.FullFree,
+            eps=-1,
+            hidden=True
+        ))
+        await session.flush()
+
+        facilities = (await session.execute(sa.select(Facility))).scalars().all()
+        assert len(facilities) == 2
+        for facility in facilities:
+            expected = dumps(FacilityResponse().dump(facility))
+            assert json.loads(serialize_facility(facility)) == json.loads(expected)
+
+            # Объект, еще не загруженный из базы
+            copy = Facility(**facility.dict())
+            copy.id = facility.id
+            assert json.loads(serialize_facility(copy)) == json.loads(expected)
+
+        # Строчки без ORM сериализуются так же, как объекты
+        rows = {row.id: row for row in (await session.execute(FacilityRows.select())).all()}
+        assert len(rows) == 2
+        for facility in facilities:
+            row = rows[facility.id]
+            assert row.modified_at == facility.modified_at
+            assert json.loads(serialize_facility_row(row)) == json.loads(serialize_facility(facility))
+
+
+@pytest.mark.parametrize('data', [
+    {'name': 'Зал', 'x': 1, 'y': 2.5},
+    {'name': 'Зал', 'x': '30.1', 'y': ' 59 ', 'type': 'Gym', 'hidden': 'false', 'eps': '12', 'area': 1e20},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'is_accessible_for_disabled': 1, 'hidden': True, 'actual_workload': 7},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'property_form': 'Municipal', 'paying_type': 'FullFree'},
+    # Значения, которые быстрый путь отдает marshmallow
+    {'name': 'Зал', 'x': 0, 'y': 0, 'eps': 12.0},
+    {'name': 'Зал', 'x': True, 'y': 0},
+    {'name': 'Зал', 'x': 'nan', 'y': 0},
+    {'name': 'Зал', 'x': 10 ** 400, 'y': 0},
+    {'name': 'Зал', 'x': '1e400', 'y': 0},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'type': 'gym'},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'type': None},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'eps': '1.5'},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'hidden': 'maybe'},
+    {'name': 1, 'x': 0, 'y': 0},
+    {'name': 'Зал', 'x': 0},
+    {'name': 'Зал', 'x': 0, 'y': 0, 'id': 'unknown field'},
+    [],
+])
+def test_load_facility(data):
+    try:
+        expected = FacilityRequest().load(data)
+    except ValidationError as e:
+        with pytest.raises(ValidationError) as error:
+            load_facility(data)
+        assert error.value.messages == e.messages
+    else:
+        assert load_facility(data) == expected
@@ -0,0 +1,13 @@
+import pytest
+
+from settings import Settings
+
+
+def test_workers(monkeypatch):
+    monkeypatch.setenv('API_WORKERS', '3')
+    assert Settings.new().API_WORKERS == 3
+    monkeypatch.setenv('API_WORKERS', '0')
+    assert Settings.new().API_WORKERS >= 1
+    monkeypatch.setenv('API_WORKERS', '-1')
+    with pytest.raises(ValueError):
+        Settings.new()
@@ -0,0 +1,66 @@
+import logging
+
+import pytest
+from aiohttp import web
+
+from api.app import create_app
+from api.timing import instrument_engine
+from db.facility import Facility
+from settings import Settings
+
+
+@pytest.fixture
+def timing_cli(loop, aiohttp_client, setup_db):
+    app: web.Application = create_app(Settings.new())
+
+    app.cleanup_ctx.pop()
+    app['sessionmaker'] = setup_db
+    # Все запросы считаются медленными, чтобы попасть в журнал
+    instrument_engine(setup_db.kw['bind'].sync_engine, slow_query_ms=0, slow_query_sample=1)
+
+    return loop.run_until_complete(aiohttp_client(app))
+
+
+def server_timing(header: str) -> dict[str, str]:
+    metrics = {}
+    for metric in header.split(', '):
+        name, *params = metric.split(';')
+        metrics[name] = dict(param.split('=', 1) for param in params)
+    return metrics
+
+
+def test_search_shape():
+    assert Facility.search_shape() == 'search'
+    assert Facility.search_shape(
+        q='зал',
+        limit=10,
+        offset=20,
+        order_by='rank',
+        filters=[{'field': 'eps', 'gt': 1, 'lt': 5}, {'field': 'type', 'eq': 'Gym'}]
+    ) == 'search q filters=[eps:lt+gt,type:eq] order_by=rank limit offset'
+    assert Facility.search_shape(order_by='name', order_desc=True, limit=10, offset=20, after=('a', 'id')) \
+        == 'search order_by=name desc limit after'
+
+
+async def test_server_timing(timing_cli, caplog):
+    resp = await timing_cli.get('/ping')
+    assert set(server_timing(resp.headers['Server-Timing'])) == {'db', 'orm', 'serialize', 'encode', 'total'}
+    assert server_timing(resp.headers['Server-Timing'])['db']['desc'] == '"0 queries"'
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='api.timing'):
+        search_data = {'q': 'зал', 'limit': 10, 'filters': [{'field': 'eps', 'gt': 1}]}
+        resp = await timing_cli.post('/facility/search', data=search_data)
+    assert resp.status == 200
+    assert (await resp.json())['count'] == 0
+
+    # Поиск - потоковый ответ, но запрос к базе выполнен до отправки заголовков
+    metrics = server_timing(resp.headers['Server-Timing'])
+    assert metrics['db']['desc'] == '"1 queries"'
+    assert float(metrics['db']['dur']) > 0
+    assert float(metrics['total']['dur']) >= float(metrics['db']['dur'])
+
+    # В журнале медленных запросов форма поиска без значений
+    messages = [record.getMessage() for record in caplog.records if record.name == 'api.timing']
+    assert any('[search q filters=[eps:gt] limit]' in message for message in messages)
+    assert not any('зал' in message for message in messages)
@@ -39,3 +39,20 @@ async def test_search(setup_db):
         print(fs)  #
 
         await session.rollback()
+
+
+async def test_stream(setup_db):
+    async with setup_db() as session:
+        session: AsyncSession
+        await session.begin()
+
+        for i in range(1, 1201):
+            session.add(Facility(name=f'gym {i}', x=i, y=456))
+        await session.flush()
+
+        names = [f.name async for f in Facility.stream(session, Facility.search_stmt(order_by='x'))]
+        assert len(names) == 1200
+        assert names[0] == 'gym 1'
+        assert names[-1] == 'gym 1200'
+
+        await session.rollback()
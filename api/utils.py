@@ -1,31 +1,62 @@
+import asyncio
 import ssl
 
-import logging
-
 from aiohttp import web
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
+from api.metrics import TimedPool
+from api.timing import instrument_engine
 
-async def setup_db(app: web.Application, settings):
-    db_conn_str = settings.API_DB_URL
+
+def db_connect_args(use_ssl: bool) -> dict:
+    """
+    Параметры подключения asyncpg: если use_ssl, сертификат для доступа к базе берется из CA.pem.
+    """
     connect_args = {}
-    if settings.API_DB_USE_SSL:
+    if use_ssl:
         connect_args["ssl"] = ssl.create_default_context(cafile='./CA.pem')
+    return connect_args
+
+
+async def setup_db(app: web.Application, settings):
+    db_conn_str = settings.API_DB_URL
+    connect_args = db_connect_args(settings.API_DB_USE_SSL)
 
     engine = create_async_engine(
         db_conn_str,
         connect_args=connect_args,
+        poolclass=TimedPool,
         pool_size=20,
         max_overflow=60
     )
 
+    instrument_engine(engine.sync_engine, settings.API_SLOW_QUERY_MS, settings.API_SLOW_QUERY_SAMPLE)
+
     Session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
     app['sessionmaker'] = Session
 
+    # Реплики для чтения: сессии на них создаются тем же Session с другим bind
+    replicas = None
+    checks = None
+    if settings.API_DB_REPLICA_URLS:
+        from api.replicas import ReplicaSet
+        replicas = ReplicaSet([
+            create_async_engine(url, connect_args=connect_args, poolclass=TimedPool, pool_size=20, max_overflow=60)
+            for url in settings.API_DB_REPLICA_URLS
+        ])
+        for replica in replicas.replicas:
+            instrument_engine(replica.engine.sync_engine, settings.API_SLOW_QUERY_MS, settings.API_SLOW_QUERY_SAMPLE)
+        await replicas.check()
+        checks = asyncio.create_task(replicas.run_checks())
+    app['replicas'] = replicas
+
     try:
         yield
     finally:
+        if replicas is not None:
+            checks.cancel()
+            await replicas.dispose()
         await engine.dispose()
 
 
@@ -39,11 +70,3 @@ def hash_password(password: str | None) -> str | None:
         return None
     from hashlib import sha256
     return sha256(str(password).encode()).hexdigest()
-
-
-def setup_logger(logger: logging.Logger):
-    logger.setLevel(logging.DEBUG)
-    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s - %(message)s")
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)